@@ -1,11 +1,24 @@
 import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
-from PIL import Image, ImageTk
+from tkinter import filedialog, messagebox, simpledialog, ttk
+from PIL import ImageTk
 import sqlite3
 import os
 import io
+import queue
+import threading
+import time
 
-from database import conectar, criar_tabelas, adicionar_imagem, listar_imagens, extrair_imagem_temp
+from database import (transacao, fechar_conexao, criar_tabelas, adicionar_imagens,
+                      listar_imagens_pagina, contar_imagens, listar_testes_pagina, contar_testes)
+from lista_virtual import ListaVirtual
+from importacao import listar_origem, importar_lote, exportar_teste
+from normalizacao import preparar_para_banco, NORMALIZAR_NA_IMPORTACAO
+from semelhanca import calcular_assinatura, imagens_semelhantes
+from miniaturas import abrir_miniatura
+from medicoes import medir
+from sorteio import configuracao
+
+TAMANHO_PREVIEW = (400, 300)  # Mesmo tamanho da canvas de pré-visualização
 
 
 def centralizar_janela(janela, largura, altura):
@@ -36,9 +49,23 @@ class AdminApp:
         tk.Button(root, text="Salvar Teste",
                   command=self.salvar_teste).pack(pady=5)
 
-        tk.Label(root, text="Testes cadastrados:").pack()
-        self.lista_testes = tk.Listbox(root)
+        frame_busca = tk.Frame(root)
+        frame_busca.pack()
+        tk.Label(frame_busca, text="Testes cadastrados:").pack(side=tk.LEFT)
+        tk.Label(frame_busca, text="Buscar:").pack(side=tk.LEFT, padx=(20, 0))
+        self.busca_testes = tk.StringVar()
+        tk.Entry(frame_busca, textvariable=self.busca_testes).pack(side=tk.LEFT)
+
+        self.lista_testes = ListaVirtual(
+            root,
+            buscar_pagina=lambda ultimo, limite: listar_testes_pagina(
+                ultimo[1] if ultimo else None, limite, self.busca_testes.get().strip()),
+            contar=lambda: contar_testes(self.busca_testes.get().strip()),
+            formatar=lambda teste: f"{teste[0]} - {teste[1]} - {teste[2] or ''}",
+            ordem=lambda teste: teste[1])
         self.lista_testes.pack(fill=tk.BOTH, expand=True)
+        self.busca_testes.trace_add(
+            "write", lambda *_: self.lista_testes.recarregar_em_breve())
 
         frame_botoes = tk.Frame(root)
         frame_botoes.pack(pady=5)
@@ -51,12 +78,27 @@ class AdminApp:
                   command=self.editar_teste).grid(row=0, column=2, padx=5)
         tk.Button(frame_botoes, text="Excluir Teste",
                   command=self.deletar_teste).grid(row=0, column=3, padx=5)
+        tk.Button(frame_botoes, text="Importar em Lote",
+                  command=self.importar_em_lote).grid(row=1, column=0, padx=5, pady=5)
+        tk.Button(frame_botoes, text="Exportar Imagens",
+                  command=self.exportar_imagens).grid(row=1, column=1, padx=5, pady=5)
+        # Desligado, as imagens são gravadas como vieram (ver normalizacao.py)
+        self.normalizar = tk.BooleanVar(value=NORMALIZAR_NA_IMPORTACAO)
+        tk.Checkbutton(frame_botoes, text="Reduzir imagens ao adicionar (guarda o original)",
+                       variable=self.normalizar).grid(row=1, column=2, columnspan=2, padx=5)
 
         if self.voltar:
             tk.Button(root, text="Voltar", fg="red",
                       command=self.voltar).pack(pady=5)
 
-        self.carregar_testes()
+        self.lista_testes.recarregar()
+
+    def teste_selecionado(self, mensagem="Selecione um teste!"):
+        """(id, nome, descricao) do teste selecionado; avisa se não houver."""
+        teste = self.lista_testes.selecionada()
+        if teste is None:
+            messagebox.showerror("Erro", mensagem)
+        return teste
 
     def salvar_teste(self):
         nome = self.entry_nome.get().strip()
@@ -64,42 +106,27 @@ class AdminApp:
         if not nome:
             messagebox.showerror("Erro", "O nome do teste é obrigatório!")
             return
-        conn = conectar()
-        cursor = conn.cursor()
         try:
-            cursor.execute(
-                "INSERT INTO testes (nome, descricao) VALUES (?, ?)", (nome, descricao))
-            conn.commit()
-            messagebox.showinfo("Sucesso", "Teste cadastrado!")
-            self.entry_nome.delete(0, tk.END)
-            self.entry_desc.delete(0, tk.END)
-            self.carregar_testes()
+            with medir("admin.salvar_teste"), transacao() as conn:
+                conn.execute(
+                    "INSERT INTO testes (nome, descricao) VALUES (?, ?)", (nome, descricao))
         except sqlite3.IntegrityError:
             messagebox.showerror("Erro", "Já existe um teste com esse nome!")
-        finally:
-            conn.close()
-
-    def carregar_testes(self):
-        self.lista_testes.delete(0, tk.END)
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, nome, descricao FROM testes ORDER BY nome")
-        for row in cursor.fetchall():
-            self.lista_testes.insert(
-                tk.END, f"{row[0]} - {row[1]} - {row[2] or ''}")
-        conn.close()
+            return
+        messagebox.showinfo("Sucesso", "Teste cadastrado!")
+        self.entry_nome.delete(0, tk.END)
+        self.entry_desc.delete(0, tk.END)
+        self.lista_testes.recarregar()
 
     def adicionar_imagem(self):
-        selecao = self.lista_testes.curselection()
-        if not selecao:
-            messagebox.showerror("Erro", "Selecione um teste!")
+        teste = self.teste_selecionado()
+        if teste is None:
             return
-
-        item = self.lista_testes.get(selecao[0])
-        teste_id = int(item.split(" - ", 1)[0])
+        teste_id = teste[0]
 
         arquivo = filedialog.askopenfilename(
-            title="Selecione uma imagem", filetypes=[("Imagens", "*.png;*.jpg;*.jpeg")])
+            title="Selecione uma imagem",
+            filetypes=[("Imagens", "*.png;*.jpg;*.jpeg;*.tif;*.tiff")])
         if not arquivo:
             return
 
@@ -107,78 +134,313 @@ class AdminApp:
         resposta_correta = "OK" if resp == "yes" else "NOK"
 
         try:
-            adicionar_imagem(teste_id, arquivo, resposta_correta)
+            # Pelo caminho: o PIL lê do disco e o banco grava em pedaços, então
+            # um arquivo grande não é carregado inteiro na memória
+            dados, original = preparar_para_banco(arquivo, self.normalizar.get())
+            assinatura = calcular_assinatura(dados)
+        except Exception as e:
+            messagebox.showerror("Erro", f"Erro ao ler imagem: {e}")
+            return
+
+        parecidas = imagens_semelhantes(assinatura)
+        if parecidas:
+            texto = "\n".join(
+                f"{nome} (teste {outro_teste}, {resposta})"
+                for _, outro_teste, nome, resposta, _ in parecidas[:10])
+            if not messagebox.askyesno(
+                    "Imagem repetida?",
+                    f"Esta imagem parece ser a mesma foto de:\n{texto}\n\nAdicionar mesmo assim?"):
+                return
+
+        try:
+            adicionar_imagens(teste_id, [(os.path.basename(arquivo), resposta_correta,
+                                          dados, original, assinatura)])
             messagebox.showinfo("Sucesso", "Imagem adicionada ao banco!")
         except Exception as e:
             messagebox.showerror("Erro", f"Erro ao salvar imagem: {e}")
 
+    def importar_em_lote(self):
+        teste = self.teste_selecionado()
+        if teste is None:
+            return
+        teste_id = teste[0]
+
+        if messagebox.askyesno("Importar em Lote",
+                               "Importar de uma pasta?\n(Não = arquivo .zip ou gabarito .csv)"):
+            origem = filedialog.askdirectory(title="Selecione a pasta de imagens")
+        else:
+            origem = filedialog.askopenfilename(
+                title="Selecione o arquivo", filetypes=[("Zip ou gabarito", "*.zip;*.csv")])
+        if not origem:
+            return
+
+        try:
+            itens = listar_origem(origem)
+        except Exception as e:
+            messagebox.showerror("Erro", f"Erro ao ler a origem: {e}")
+            return
+        if not itens:
+            itens.fechar()
+            messagebox.showerror("Erro", "Nenhuma imagem encontrada!")
+            return
+
+        sem_resposta = sum(1 for _, resposta, _ in itens if resposta is None)
+        if sem_resposta:
+            resp = messagebox.askyesnocancel(
+                "Resposta Correta",
+                f"{sem_resposta} imagem(ns) sem gabarito (gabarito.csv ou pasta OK/NOK).\n"
+                "Considerar essas imagens como OK? (Não = NOK)")
+            if resp is None:
+                itens.fechar()
+                return
+            padrao = "OK" if resp else "NOK"
+            itens[:] = [(nome, resposta or padrao, ler) for nome, resposta, ler in itens]
+
+        janela = tk.Toplevel(self.root)
+        janela.title("Importando imagens")
+        centralizar_janela(janela, 400, 120)
+        janela.grab_set()
+        janela.protocol("WM_DELETE_WINDOW", lambda: None)  # não fecha no meio
+        barra = ttk.Progressbar(janela, length=350, maximum=len(itens))
+        barra.pack(pady=15)
+        status = tk.Label(janela, text=f"0 de {len(itens)}")
+        status.pack()
+
+        eventos = queue.Queue()
+        inicio = time.perf_counter()
+        normalizar = self.normalizar.get()  # lido aqui: a thread não toca no Tk
+
+        def trabalhar():
+            try:
+                resultado = importar_lote(
+                    teste_id, itens, normalizar=normalizar,
+                    progresso=lambda feitas, total: eventos.put(("progresso", feitas)))
+                eventos.put(("fim", resultado))
+            except Exception as e:
+                eventos.put(("erro", e))
+            finally:
+                itens.fechar()  # o .zip de origem, se for o caso
+                fechar_conexao()
+
+        def acompanhar():
+            try:
+                while True:
+                    tipo, valor = eventos.get_nowait()
+                    if tipo == "progresso":
+                        barra["value"] = valor
+                        decorrido = time.perf_counter() - inicio
+                        status.config(
+                            text=f"{valor} de {len(itens)} ({valor / decorrido:.1f} imagens/s)")
+                    elif tipo == "erro":
+                        janela.destroy()
+                        messagebox.showerror("Erro", f"Erro na importação: {valor}")
+                        return
+                    else:
+                        janela.destroy()
+                        self.mostrar_resultado_importacao(valor)
+                        return
+            except queue.Empty:
+                pass
+            janela.after(100, acompanhar)
+
+        threading.Thread(target=trabalhar, daemon=True).start()
+        acompanhar()
+
+    def mostrar_resultado_importacao(self, resultado):
+        texto = (f"Importadas: {resultado['importadas']}\n"
+                 f"Erros: {len(resultado['erros'])}\n"
+                 f"Tempo: {resultado['segundos']:.1f} s "
+                 f"({resultado['imagens_por_segundo']:.1f} imagens/s)")
+        if resultado["erros"]:
+            texto += "\n\n" + "\n".join(
+                f"{nome}: {motivo}" for nome, motivo in resultado["erros"][:10])
+            if len(resultado["erros"]) > 10:
+                texto += "\n..."
+        semelhantes = resultado["semelhantes"]
+        if semelhantes:
+            texto += f"\n\nQuase repetidas (mesma foto já cadastrada): {len(semelhantes)}\n"
+            texto += "\n".join(
+                f"{nome} ~ {parecida} (teste {teste}, {resposta})"
+                for nome, parecida, teste, resposta, _ in semelhantes[:10])
+            if len(semelhantes) > 10:
+                texto += "\n..."
+        messagebox.showinfo("Importação concluída", texto)
+
+    def exportar_imagens(self):
+        teste = self.teste_selecionado()
+        if teste is None:
+            return
+        teste_id, nome_teste, _ = teste
+
+        if messagebox.askyesno("Exportar Imagens",
+                               "Exportar para uma pasta?\n(Não = arquivo .zip)"):
+            destino = filedialog.askdirectory(title="Selecione a pasta de destino")
+        else:
+            destino = filedialog.asksaveasfilename(
+                title="Salvar como", defaultextension=".zip", initialfile=f"{nome_teste}.zip",
+                filetypes=[("Zip", "*.zip")])
+        if not destino:
+            return
+
+        janela = tk.Toplevel(self.root)
+        janela.title("Exportando imagens")
+        centralizar_janela(janela, 400, 120)
+        janela.grab_set()
+        janela.protocol("WM_DELETE_WINDOW", lambda: None)  # não fecha no meio
+        barra = ttk.Progressbar(janela, length=350)
+        barra.pack(pady=15)
+        status = tk.Label(janela, text="")
+        status.pack()
+        eventos = queue.Queue()
+
+        def trabalhar():
+            try:
+                resultado = exportar_teste(
+                    teste_id, destino,
+                    progresso=lambda feitas, total: eventos.put(("progresso", (feitas, total))))
+                eventos.put(("fim", resultado))
+            except Exception as e:
+                eventos.put(("erro", e))
+            finally:
+                fechar_conexao()
+
+        def acompanhar():
+            try:
+                while True:
+                    tipo, valor = eventos.get_nowait()
+                    if tipo == "progresso":
+                        barra["maximum"], barra["value"] = valor[1], valor[0]
+                        status.config(text=f"{valor[0]} de {valor[1]}")
+                    elif tipo == "erro":
+                        janela.destroy()
+                        messagebox.showerror("Erro", f"Erro na exportação: {valor}")
+                        return
+                    else:
+                        janela.destroy()
+                        messagebox.showinfo(
+                            "Exportação concluída",
+                            f"Exportadas: {valor['exportadas']} ({valor['bytes'] / 2 ** 20:.1f} MB)\n"
+                            f"Tempo: {valor['segundos']:.1f} s\nDestino: {destino}")
+                        return
+            except queue.Empty:
+                pass
+            janela.after(100, acompanhar)
+
+        threading.Thread(target=trabalhar, daemon=True).start()
+        acompanhar()
+
     def editar_teste(self):
-        selecao = self.lista_testes.curselection()
-        if not selecao:
-            messagebox.showerror("Erro", "Selecione um teste para editar!")
+        teste = self.teste_selecionado("Selecione um teste para editar!")
+        if teste is None:
             return
 
-        item = self.lista_testes.get(selecao[0])
-        teste_id, nome_atual, desc_atual = item.split(" - ", 2)
+        teste_id, nome_atual, desc_atual = teste
         novo_nome = simpledialog.askstring(
             "Editar Nome", "Novo nome do teste:", initialvalue=nome_atual)
         if not novo_nome:
             return
         nova_desc = simpledialog.askstring(
-            "Editar Descrição", "Nova descrição:", initialvalue=desc_atual)
+            "Editar Descrição", "Nova descrição:", initialvalue=desc_atual or "")
         if nova_desc is None:
             return
 
-        conn = conectar()
-        cursor = conn.cursor()
+        num_atual, proporcao_atual = configuracao(teste_id)
+        num_questoes = simpledialog.askinteger(
+            "Questões", "Questões por sessão:", initialvalue=num_atual,
+            minvalue=1, maxvalue=1000)
+        if num_questoes is None:
+            return
+        texto_ok = simpledialog.askstring(
+            "Proporção OK",
+            "% de questões com resposta OK\n(vazio: a mesma proporção das imagens do teste):",
+            initialvalue="" if proporcao_atual is None else f"{proporcao_atual * 100:g}")
+        if texto_ok is None:
+            return
         try:
-            cursor.execute("UPDATE testes SET nome=?, descricao=? WHERE id=?",
-                           (novo_nome, nova_desc, int(teste_id)))
-            conn.commit()
-            messagebox.showinfo("Sucesso", "Teste atualizado!")
-            self.carregar_testes()
+            proporcao_ok = float(texto_ok.replace(",", ".")) / 100 if texto_ok.strip() else None
+        except ValueError:
+            proporcao_ok = -1
+        if proporcao_ok is not None and not 0 <= proporcao_ok <= 1:
+            messagebox.showerror("Erro", "Informe uma porcentagem entre 0 e 100.")
+            return
+
+        try:
+            with medir("admin.editar_teste"), transacao() as conn:
+                conn.execute("""
+                    UPDATE testes SET nome=?, descricao=?, num_questoes=?, proporcao_ok=?
+                    WHERE id=?
+                """, (novo_nome, nova_desc, num_questoes, proporcao_ok, teste_id))
         except sqlite3.IntegrityError:
             messagebox.showerror("Erro", "Já existe um teste com esse nome!")
-        finally:
-            conn.close()
+            return
+        messagebox.showinfo("Sucesso", "Teste atualizado!")
+        if novo_nome != nome_atual and self.busca_testes.get().strip():
+            # O nome novo pode não passar mais na busca (LIKE do banco)
+            self.lista_testes.recarregar()
+        else:
+            self.lista_testes.atualizar((teste_id, novo_nome, nova_desc))
 
     def deletar_teste(self):
-        selecao = self.lista_testes.curselection()
-        if not selecao:
-            messagebox.showerror("Erro", "Selecione um teste!")
+        teste = self.teste_selecionado()
+        if teste is None:
             return
 
-        item = self.lista_testes.get(selecao[0])
-        teste_id, nome_teste, _ = item.split(" - ", 2)
+        teste_id, nome_teste, _ = teste
         confirmar = messagebox.askyesno(
             "Confirmar Exclusão", f"Deseja excluir o teste '{nome_teste}' e suas imagens?")
         if not confirmar:
             return
 
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute("DELETE FROM testes WHERE id=?", (int(teste_id),))
-        conn.commit()
-        conn.close()
+        # As imagens saem junto (ON DELETE CASCADE, com foreign_keys=ON)
+        with medir("admin.deletar_teste"), transacao() as conn:
+            conn.execute("DELETE FROM testes WHERE id=?", (teste_id,))
         messagebox.showinfo("Sucesso", "Teste excluído!")
-        self.carregar_testes()
+        self.lista_testes.remover(teste_id)
 
     def abrir_janela_gerenciar_imagens(self):
-        selecao = self.lista_testes.curselection()
-        if not selecao:
-            messagebox.showerror(
-                "Erro", "Selecione um teste para gerenciar imagens!")
+        teste = self.teste_selecionado("Selecione um teste para gerenciar imagens!")
+        if teste is None:
             return
-
-        item = self.lista_testes.get(selecao[0])
-        teste_id, teste_nome, _ = item.split(" - ", 2)
+        teste_id, teste_nome, _ = teste
 
         janela = tk.Toplevel(self.root)
         janela.title(f"Gerenciar Imagens - {teste_nome}")
         centralizar_janela(janela, 750, 500)
 
-        lista = tk.Listbox(janela)
-        lista.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=10, pady=10)
+        esquerda = tk.Frame(janela)
+        esquerda.pack(side=tk.LEFT, fill=tk.BOTH, expand=True, padx=10, pady=10)
+
+        # Busca por nome e filtro por resposta
+        filtros = tk.Frame(esquerda)
+        filtros.pack(fill=tk.X)
+        tk.Label(filtros, text="Buscar:").pack(side=tk.LEFT)
+        busca = tk.StringVar()
+        tk.Entry(filtros, textvariable=busca, width=18).pack(side=tk.LEFT)
+        filtro_resposta = tk.StringVar(value="Todas")
+        tk.OptionMenu(filtros, filtro_resposta, "Todas", "OK", "NOK").pack(side=tk.LEFT, padx=5)
+        contador = tk.Label(esquerda, anchor=tk.W)
+        contador.pack(fill=tk.X)
+
+        def resposta_filtrada():
+            return None if filtro_resposta.get() == "Todas" else filtro_resposta.get()
+
+        def contar():
+            total = contar_imagens(teste_id, busca.get().strip(), resposta_filtrada())
+            contador.config(text=f"{total} imagem(ns)")
+            return total
+
+        lista = ListaVirtual(
+            esquerda,
+            buscar_pagina=lambda ultima, limite: listar_imagens_pagina(
+                teste_id, (ultima[1], ultima[0]) if ultima else None, limite,
+                busca.get().strip(), resposta_filtrada()),
+            contar=contar,
+            formatar=lambda img: f"{img[0]} - {img[1]} - {img[2]}",
+            ao_selecionar=lambda img: mostrar_preview(img))
+        lista.pack(fill=tk.BOTH, expand=True)
+        busca.trace_add("write", lambda *_: lista.recarregar_em_breve())
+        filtro_resposta.trace_add("write", lambda *_: lista.recarregar())
+        lista.recarregar()
 
         frame = tk.Frame(janela)
         frame.pack(side=tk.RIGHT, fill=tk.Y, padx=10, pady=10)
@@ -188,68 +450,51 @@ class AdminApp:
         canvas.pack(pady=10)
         imagens_cache = {}
 
-        def carregar():
-            lista.delete(0, tk.END)
-            imagens = listar_imagens(int(teste_id))
-            for img_id, nome, resp in imagens:
-                lista.insert(tk.END, f"{img_id} - {nome} - {resp}")
-            return imagens
-
-        imagens = carregar()
-
-        def mostrar_preview(event=None):
-            selecionado = lista.curselection()
-            if not selecionado:
-                return
-            index = selecionado[0]
-            img_id, nome, resp = imagens[index]
-            caminho_temp = extrair_imagem_temp(img_id)
-            if not caminho_temp:
-                return
-            img = Image.open(caminho_temp)
-            img = img.resize((400, 300), Image.LANCZOS)
-            img_tk = ImageTk.PhotoImage(img)
+        def mostrar_preview(img):
+            img_id, nome, resp = img
+            with medir("admin.preview"):
+                img = abrir_miniatura(img_id, TAMANHO_PREVIEW)
+                if img is None:
+                    return
+                img_tk = ImageTk.PhotoImage(img)
             imagens_cache["preview"] = img_tk
             canvas.delete("all")
             canvas.create_image(0, 0, anchor=tk.NW, image=img_tk)
             canvas.image = img_tk
 
-        lista.bind("<<ListboxSelect>>", mostrar_preview)
-
         def excluir():
-            selecionado = lista.curselection()
-            if not selecionado:
+            img = lista.selecionada()
+            if img is None:
                 messagebox.showerror("Erro", "Selecione uma imagem!")
                 return
-            index = selecionado[0]
-            img_id, _, _ = imagens[index]
             if not messagebox.askyesno("Confirmação", "Excluir esta imagem?"):
                 return
-            conn = conectar()
-            cursor = conn.cursor()
-            cursor.execute("DELETE FROM imagens WHERE id=?", (img_id,))
-            conn.commit()
-            conn.close()
+            with medir("admin.excluir_imagem"), transacao() as conn:
+                conn.execute("DELETE FROM imagens WHERE id=?", (img[0],))
             messagebox.showinfo("Sucesso", "Imagem excluída!")
-            imagens[:] = carregar()
+            lista.remover(img[0])
+            contador.config(text=f"{lista.total} imagem(ns)")
+            canvas.delete("all")
 
         def editar_resposta():
-            selecionado = lista.curselection()
-            if not selecionado:
+            img = lista.selecionada()
+            if img is None:
                 messagebox.showerror("Erro", "Selecione uma imagem!")
                 return
-            index = selecionado[0]
-            img_id, _, resp_atual = imagens[index]
+            img_id, nome, resp_atual = img
             nova_resp = "OK" if messagebox.askyesno(
                 "Editar", "Definir resposta como OK? (Não = NOK)") else "NOK"
-            conn = conectar()
-            cursor = conn.cursor()
-            cursor.execute(
-                "UPDATE imagens SET resposta_correta=? WHERE id=?", (nova_resp, img_id))
-            conn.commit()
-            conn.close()
+            with medir("admin.editar_resposta"), transacao() as conn:
+                conn.execute(
+                    "UPDATE imagens SET resposta_correta=? WHERE id=?", (nova_resp, img_id))
             messagebox.showinfo("Sucesso", "Resposta atualizada!")
-            imagens[:] = carregar()
+            if resposta_filtrada() not in (None, nova_resp):
+                # Saiu do filtro OK/NOK em uso
+                lista.remover(img_id)
+                contador.config(text=f"{lista.total} imagem(ns)")
+                canvas.delete("all")
+            else:
+                lista.atualizar((img_id, nome, nova_resp))
 
         tk.Button(frame, text="Editar Resposta",
                   command=editar_resposta).pack(pady=5)
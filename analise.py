@@ -0,0 +1,214 @@
+# analise.py - indicadores sobre o histórico de respostas (sessoes/respostas)
+#
+# Uso: python analise.py [--completo] [--saida pasta]
+# Por padrão só processa as sessões novas desde a última execução.
+import os
+import pickle
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from database import conectar, criar_tabelas, get_db_path
+
+ARQUIVO_ESTADO = "analise_estado.pkl"  # Fica na mesma pasta do banco
+
+
+def carregar_respostas(desde_sessao=0):
+    """
+    Lê de uma vez as respostas das sessões com id maior que `desde_sessao`,
+    já com os dados da sessão. As respostas vêm só como números (bem mais
+    rápido que passar textos pelo read_sql) e os textos da sessão viram
+    categorias para economizar memória.
+    """
+    conn = conectar()
+    linhas = conn.execute("""
+        SELECT sessao_id, IFNULL(imagem_id, 0), resposta = 'OK',
+               resposta_correta = 'OK', correta, IFNULL(tempo_ms, -1)
+        FROM respostas WHERE sessao_id > ?
+    """, (desde_sessao,)).fetchall()
+    respostas = pd.DataFrame(
+        np.array(linhas, dtype=np.int64).reshape(-1, 6),
+        columns=["sessao_id", "imagem_id", "resposta_ok", "correta_ok", "correta", "tempo_ms"])
+    del linhas
+
+    sessoes = pd.read_sql_query("""
+        SELECT id AS sessao_id, teste_id, avaliador, matricula, operador,
+               turno, finalizado_em
+        FROM sessoes WHERE id > ?
+    """, conn, params=(desde_sessao,))
+    for coluna in ("avaliador", "matricula", "operador", "turno"):
+        sessoes[coluna] = sessoes[coluna].fillna("").astype("category")
+    sessoes["finalizado_em"] = pd.to_datetime(sessoes["finalizado_em"])
+    sessoes["semana"] = sessoes["finalizado_em"].dt.to_period("W").dt.start_time
+
+    return respostas.merge(sessoes, on="sessao_id", how="inner")
+
+
+def _agregar(df):
+    """
+    Contagens somáveis (por isso o modo incremental só precisa somar as
+    sessões novas às contagens guardadas). As taxas saem de resumir().
+    """
+    com_tempo = df["tempo_ms"] >= 0
+    df = df.assign(
+        acertos=df["correta"],
+        erros=1 - df["correta"],
+        # Falso OK: peça NOK aprovada; falso NOK: peça OK reprovada
+        falso_ok=df["resposta_ok"] & (1 - df["correta_ok"]),
+        falso_nok=(1 - df["resposta_ok"]) & df["correta_ok"],
+        tempo_ms=df["tempo_ms"].where(com_tempo, 0),
+        com_tempo=com_tempo.astype(np.int64),
+        total=1,
+    )
+    contagens = ["total", "acertos", "erros", "falso_ok", "falso_nok"]
+
+    # resposta_ok somado = respostas OK por imagem, para a concordância
+    por_imagem = df.groupby("imagem_id")[
+        contagens + ["tempo_ms", "com_tempo", "resposta_ok"]].sum()
+
+    soma = df[["falso_ok", "falso_nok", "total", "correta_ok", "acertos"]].sum()
+    ok_ok = int(soma["correta_ok"] - soma["falso_nok"])
+    nok_nok = int(soma["total"] - soma["correta_ok"] - soma["falso_ok"])
+    confusao = pd.DataFrame(
+        [[nok_nok, int(soma["falso_ok"])], [int(soma["falso_nok"]), ok_ok]],
+        index=pd.Index(["NOK", "OK"], name="resposta_correta"),
+        columns=pd.Index(["NOK", "OK"], name="resposta"))
+
+    tabelas = {
+        "por_imagem": por_imagem,
+        "por_operador": df.groupby(["matricula", "operador"], observed=True)[contagens].sum(),
+        "por_operador_semana": df.groupby(["matricula", "semana"], observed=True)[
+            ["total", "acertos"]].sum(),
+        "por_avaliador": df.groupby("avaliador", observed=True)[contagens].sum(),
+        "por_turno": df.groupby("turno", observed=True)[contagens].sum(),
+        "confusao": confusao,
+    }
+    return {nome: _sem_categorias(tabela) for nome, tabela in tabelas.items()}
+
+
+def _sem_categorias(tabela):
+    """Troca índices categóricos por comuns, para somar tabelas de execuções diferentes."""
+    tabela = tabela.copy()
+    for eixo in ("index", "columns"):
+        indice = getattr(tabela, eixo)
+        if isinstance(indice, pd.MultiIndex):
+            indice = indice.set_levels(
+                [nivel.astype(object) if isinstance(nivel, pd.CategoricalIndex) else nivel
+                 for nivel in indice.levels])
+        elif isinstance(indice, pd.CategoricalIndex):
+            indice = indice.astype(object)
+        setattr(tabela, eixo, indice)
+    return tabela
+
+
+def _somar(estado, novo):
+    if estado is None:
+        return novo
+    return {chave: estado[chave].add(novo[chave], fill_value=0).fillna(0).astype("int64")
+            for chave in estado}
+
+
+def _tendencia(por_semana):
+    """
+    Inclinação (pontos percentuais de precisão por semana) da reta de
+    mínimos quadrados de cada operador, calculada de forma vetorizada.
+    """
+    semanas = por_semana.reset_index()
+    semanas["precisao"] = semanas["acertos"] / semanas["total"] * 100
+    semanas["x"] = (semanas["semana"] - semanas["semana"].min()).dt.days / 7
+    semanas["xy"] = semanas["x"] * semanas["precisao"]
+    semanas["xx"] = semanas["x"] ** 2
+    g = semanas.groupby("matricula", observed=True)[["x", "precisao", "xy", "xx"]]
+    soma, n = g.sum(), g.size()
+    variancia = soma["xx"] - soma["x"] ** 2 / n
+    covariancia = soma["xy"] - soma["x"] * soma["precisao"] / n
+    return (covariancia / variancia.replace(0, np.nan)).rename("tendencia_pp_semana")
+
+
+def _nomes_imagens(ids):
+    """Nome atual de cada imagem; para as já excluídas, o nome gravado nas respostas."""
+    conn = conectar()
+    nomes = dict(conn.execute("SELECT id, nome_arquivo FROM imagens"))
+    faltando = [int(i) for i in ids if i not in nomes]
+    for inicio in range(0, len(faltando), 500):
+        lote = faltando[inicio:inicio + 500]
+        nomes.update(conn.execute(f"""
+            SELECT imagem_id, MAX(nome_arquivo) FROM respostas
+            WHERE imagem_id IN ({",".join("?" * len(lote))}) GROUP BY imagem_id
+        """, lote))
+    return [nomes.get(i, "") for i in ids]
+
+
+def resumir(estado):
+    """Tabelas finais (taxas) a partir das contagens."""
+    por_imagem = estado["por_imagem"].copy()
+    por_imagem.insert(0, "nome_arquivo", _nomes_imagens(por_imagem.index))
+    por_imagem["taxa_erro"] = por_imagem["erros"] / por_imagem["total"]
+    por_imagem["tempo_medio_ms"] = por_imagem["tempo_ms"] / por_imagem["com_tempo"].replace(0, np.nan)
+    # Fração das respostas que concordam com a maioria
+    por_imagem["concordancia"] = np.maximum(
+        por_imagem["resposta_ok"], por_imagem["total"] - por_imagem["resposta_ok"]) / por_imagem["total"]
+    por_imagem = por_imagem.sort_values("taxa_erro", ascending=False)
+
+    por_operador = estado["por_operador"].copy()
+    por_operador["precisao"] = por_operador["acertos"] / por_operador["total"]
+    por_operador = por_operador.join(_tendencia(estado["por_operador_semana"]), on="matricula")
+
+    resumos = {"imagens": por_imagem, "operadores": por_operador}
+    for chave, nome in (("por_avaliador", "avaliadores"), ("por_turno", "turnos")):
+        tabela = estado[chave].copy()
+        tabela["precisao"] = tabela["acertos"] / tabela["total"]
+        resumos[nome] = tabela
+    resumos["confusao"] = estado["confusao"]
+    return resumos
+
+
+def _caminho_estado():
+    return os.path.join(os.path.dirname(get_db_path()), ARQUIVO_ESTADO)
+
+
+def atualizar(completo=False):
+    """
+    Processa as sessões novas (ou todas, com completo=True), soma às
+    contagens guardadas e devolve o resultado de resumir().
+    """
+    criar_tabelas()
+    estado, ultima_sessao = None, 0
+    caminho = _caminho_estado()
+    if not completo and os.path.exists(caminho):
+        with open(caminho, "rb") as f:
+            salvo = pickle.load(f)
+        estado, ultima_sessao = salvo["estado"], salvo["ultima_sessao"]
+
+    df = carregar_respostas(ultima_sessao)
+    if not df.empty:
+        estado = _somar(estado, _agregar(df))
+        ultima_sessao = int(df["sessao_id"].max())
+        with open(caminho, "wb") as f:
+            pickle.dump({"estado": estado, "ultima_sessao": ultima_sessao}, f)
+
+    if estado is None:
+        return None
+    return resumir(estado)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Indicadores de desempenho a partir do histórico de respostas.")
+    parser.add_argument("--completo", action="store_true",
+                        help="reprocessa todo o histórico em vez de só o que é novo")
+    parser.add_argument("--saida", default=os.path.join(os.path.abspath("."), "resultados", "analise"),
+                        help="pasta onde gravar os CSVs")
+    args = parser.parse_args()
+
+    resumos = atualizar(args.completo)
+    if resumos is None:
+        print("Nenhuma resposta registrada ainda.")
+    else:
+        os.makedirs(args.saida, exist_ok=True)
+        for nome, tabela in resumos.items():
+            tabela.to_csv(os.path.join(args.saida, f"{nome}.csv"),
+                          sep=';', encoding='utf-8-sig')
+        print(resumos["confusao"])
+        print(f"CSVs gravados em: {args.saida}")
@@ -0,0 +1,217 @@
+# backend.py - de onde a tela de teste lê testes e imagens e para onde manda os resultados
+#
+# BackendLocal usa o testes.db deste PC (o padrão). Com a variável de
+# ambiente SERVIDOR_TESTES (ex.: http://192.168.0.10:8765), a estação usa
+# o servidor.py de outro PC: várias estações testando ao mesmo tempo sem
+# compartilhar o arquivo do banco pela rede. Nesse caso o padrão é
+# replica.BackendReplica (cópia local sincronizada; funciona sem rede);
+# com USAR_REPLICA = False, BackendRemoto faz cada leitura no servidor.
+# O cadastro (admin/cli) continua local, no PC do servidor.
+import os
+import json
+import threading
+import http.client
+from io import BytesIO
+from urllib.parse import urlsplit, urlencode
+
+from PIL import Image
+
+from medicoes import medir
+
+SERVIDOR = os.environ.get("SERVIDOR_TESTES")  # URL do servidor.py; vazio = banco local
+USAR_REPLICA = True  # Com servidor: lê de uma cópia local (replica.py) em vez de ir à rede
+TIMEOUT_S = 10  # Tempo máximo de cada requisição ao servidor
+
+
+class ErroServidor(Exception):
+    def __init__(self, mensagem, status=None):
+        super().__init__(mensagem)
+        self.status = status  # HTTP da resposta; None se o servidor não respondeu
+
+
+class BackendLocal:
+    """Chama direto as funções do banco (mesma interface do BackendRemoto)."""
+
+    remoto = False
+    alteracoes = 0  # Muda quando os testes disponíveis mudam (ver BackendReplica)
+
+    def listar_testes_pagina(self, depois=None, limite=200, busca=""):
+        from database import listar_testes_pagina
+        return listar_testes_pagina(depois, limite, busca)
+
+    def contar_testes(self, busca=""):
+        from database import contar_testes
+        return contar_testes(busca)
+
+    def sortear_questoes(self, teste_id, historico_ate=None):
+        from sorteio import sortear_questoes
+        return sortear_questoes(teste_id, historico_ate=historico_ate)
+
+    def obter_miniatura(self, imagem_id, tamanho, ajustar=False, formato="PNG"):
+        from miniaturas import obter_miniatura
+        return obter_miniatura(imagem_id, tamanho, ajustar, formato)
+
+    def registrar_sessao(self, sessao, respostas):
+        from database import registrar_sessao
+        return registrar_sessao(sessao, respostas)
+
+    def abrir_miniatura(self, imagem_id, tamanho):
+        """Como miniaturas.abrir_miniatura: a PIL.Image pronta, ou None."""
+        from miniaturas import abrir_miniatura
+        return abrir_miniatura(imagem_id, tamanho)
+
+
+class BackendRemoto(BackendLocal):
+    """
+    Cliente HTTP/JSON do servidor.py. Cada thread mantém a sua conexão
+    aberta (keep-alive); se ela cair, tenta uma vez com uma conexão nova.
+    Falhas viram ErroServidor.
+    """
+
+    remoto = True
+
+    def __init__(self, url, timeout=TIMEOUT_S):
+        self.url = url
+        partes = urlsplit(url if "://" in url else "http://" + url)
+        self.host = partes.hostname
+        self.porta = partes.port or 80
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _conexao(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = http.client.HTTPConnection(self.host, self.porta, timeout=self.timeout)
+            self._local.conn = conn
+        return conn
+
+    def _requisitar(self, metodo, caminho, corpo=None):
+        """(status, cabeçalhos, bytes) da resposta."""
+        cabecalhos = {}
+        if corpo is not None:
+            corpo = json.dumps(corpo).encode("utf-8")
+            cabecalhos["Content-Type"] = "application/json"
+        # Um nome por recurso (http.testes, http.imagens...), não por id
+        nome = "http." + caminho.split("?")[0].strip("/").split("/")[0]
+        for tentativa in (1, 2):
+            conn = self._conexao()
+            try:
+                with medir(nome) as m:
+                    conn.request(metodo, caminho, corpo, cabecalhos)
+                    resposta = conn.getresponse()
+                    dados = resposta.read()
+                    m["bytes"] = len(dados)
+                return resposta.status, resposta.headers, dados
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                self._local.conn = None
+                # POST não é repetido: o servidor pode ter gravado antes de cair
+                if tentativa == 2 or metodo != "GET":
+                    raise ErroServidor(f"Sem resposta do servidor: {e}")
+
+    def _json(self, metodo, caminho, corpo=None):
+        status, _, dados = self._requisitar(metodo, caminho, corpo)
+        try:
+            resultado = json.loads(dados) if dados else {}
+        except ValueError:
+            raise ErroServidor(f"Resposta inválida do servidor (HTTP {status})", status)
+        if status >= 400:
+            raise ErroServidor(resultado.get("erro", f"HTTP {status}"), status)
+        return resultado
+
+    def listar_testes_pagina(self, depois=None, limite=200, busca=""):
+        params = {"limite": limite, "busca": busca}
+        if depois is not None:
+            params["depois"] = depois
+        return [tuple(t) for t in self._json("GET", "/testes?" + urlencode(params))["testes"]]
+
+    def contar_testes(self, busca=""):
+        return self._json("GET", "/testes/contagem?" + urlencode({"busca": busca}))["total"]
+
+    def sortear_questoes(self, teste_id, historico_ate=None):
+        params = {"historico_ate": historico_ate} if historico_ate else {}
+        resultado = self._json("GET", f"/testes/{teste_id}/questoes?" + urlencode(params))
+        return [tuple(q) for q in resultado["questoes"]], resultado["sorteio"]
+
+    def obter_miniatura(self, imagem_id, tamanho, ajustar=False, formato="PNG"):
+        params = urlencode({"largura": tamanho[0], "altura": tamanho[1],
+                            "ajustar": int(ajustar), "formato": formato})
+        status, _, dados = self._requisitar("GET", f"/imagens/{imagem_id}/miniatura?{params}")
+        if status == 404:
+            return None
+        if status >= 400:
+            raise ErroServidor(f"HTTP {status} ao buscar a imagem {imagem_id}", status)
+        return dados
+
+    def abrir_miniatura(self, imagem_id, tamanho):
+        dados = self.obter_miniatura(imagem_id, tamanho)
+        if dados is None:
+            return None
+        imagem = Image.open(BytesIO(dados))
+        imagem.load()
+        return imagem
+
+    def registrar_sessao(self, sessao, respostas):
+        return self._json("POST", "/sessoes", {
+            "sessao": sessao, "respostas": [list(r) for r in respostas]})["id"]
+
+    def registrar_sessoes(self, lote):
+        """Várias sessões [(sessao, respostas)] num pedido só. Retorna os ids."""
+        return self._json("POST", "/sessoes/lote", {"sessoes": [
+            {"sessao": sessao, "respostas": [list(r) for r in respostas]}
+            for sessao, respostas in lote]})["ids"]
+
+    def sincronizar(self, desde, limite=500):
+        """Alterações depois da versão `desde` (ver database.alteracoes_desde)."""
+        return self._json("GET", "/sincronizar?" + urlencode({"desde": desde, "limite": limite}))
+
+    def baixar_conteudo(self, hash_conteudo, destino):
+        """
+        Copia o conteúdo para `destino` (arquivo binário aberto) em pedaços,
+        sem guardá-lo inteiro na memória. Retorna os bytes copiados.
+        """
+        from database import TAMANHO_PEDACO
+        # Conexão própria: a resposta é lida aos poucos e a de keep-alive
+        # da thread não pode ficar no meio de uma resposta
+        conn = http.client.HTTPConnection(self.host, self.porta, timeout=self.timeout)
+        try:
+            with medir("http.conteudos") as m:
+                conn.request("GET", f"/conteudos/{hash_conteudo}")
+                resposta = conn.getresponse()
+                if resposta.status >= 400:
+                    raise ErroServidor(
+                        f"HTTP {resposta.status} ao baixar o conteúdo {hash_conteudo}",
+                        resposta.status)
+                total = 0
+                while True:
+                    pedaco = resposta.read(TAMANHO_PEDACO)
+                    if not pedaco:
+                        break
+                    destino.write(pedaco)
+                    total += len(pedaco)
+                m["bytes"] = total
+            return total
+        except (OSError, http.client.HTTPException) as e:
+            raise ErroServidor(f"Sem resposta do servidor: {e}")
+        finally:
+            conn.close()
+
+
+_backend = None
+
+
+def obter_backend():
+    """
+    Backend único do processo, conforme SERVIDOR_TESTES. Com réplica, deve
+    ser chamado antes da primeira conexão ao banco (troca o arquivo usado).
+    """
+    global _backend
+    if _backend is None:
+        if not SERVIDOR:
+            _backend = BackendLocal()
+        elif USAR_REPLICA:
+            from replica import BackendReplica
+            _backend = BackendReplica(SERVIDOR)
+        else:
+            _backend = BackendRemoto(SERVIDOR)
+    return _backend
@@ -0,0 +1,337 @@
+# bench_caminhos.py - tempos dos caminhos quentes do teste, sem abrir janela
+#
+# Uso: python benchmarks/bench_caminhos.py [--banco arquivo.db] [--imagens 50000]
+#      [--testes 10] [--largura 640] [--altura 480] [--sessoes 2000]
+#      [--repeticoes 20] [--caminhos listar_imagens,iniciar_teste,...]
+#      [--tolerancia 0.2] [--sem-salvar]
+# Mede, cada um num processo novo (para o pico de memória ser só dele):
+#   listar_imagens    database.listar_imagens do maior teste
+#   iniciar_teste     o sorteio das questões (o que a tela faz ao começar)
+#   decodificar       decodificar + redimensionar uma imagem do BLOB, sem cache
+#   tela_questao      espera por questão no CarregadorQuestoes, cache frio e
+#                     sem tempo de resposta entre as questões (pior caso)
+#   finalizar_teste   correção + registro da sessão no banco
+#   gerar_pdf         PDF de uma sessão com metade das questões erradas
+# Sem --banco, usa um banco sintético (gerar_banco.py), guardado na pasta
+# temporária e reaproveitado nas próximas execuções com a mesma configuração;
+# com --banco, trabalha numa cópia. Mostra vazão (linhas/s em listar_imagens,
+# operações/s nos outros), p50/p99 e pico de memória (RSS), acrescenta o
+# resultado em benchmarks/resultados.jsonl e compara com a última execução
+# da mesma configuração: sai com código 1 se algum p50 piorou mais que a
+# tolerância.
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from datetime import datetime
+
+PASTA = os.path.dirname(os.path.abspath(__file__))
+RAIZ = os.path.dirname(PASTA)
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, PASTA)
+
+ARQUIVO_RESULTADOS = os.path.join(PASTA, "resultados.jsonl")
+CAMINHOS = ["listar_imagens", "iniciar_teste", "decodificar", "tela_questao",
+            "finalizar_teste", "gerar_pdf"]
+MINIMO_MS = 1.0  # Pioras menores que isso no p50 são ruído, mesmo em porcentagem alta
+AVALIADOR_BENCH = "bench_caminhos"  # Sessões gravadas pelo benchmark (apagadas no fim)
+
+
+def pico_memoria_mb():
+    """Maior RSS do processo até agora, em MB."""
+    # No Linux, ru_maxrss herda o pico do processo pai; VmHWM é só deste
+    if os.path.exists("/proc/self/status"):
+        with open("/proc/self/status") as f:
+            for linha in f:
+                if linha.startswith("VmHWM:"):
+                    return round(int(linha.split()[1]) / 2 ** 10, 1)
+    try:
+        import resource
+    except ImportError:  # Windows
+        import ctypes
+        from ctypes import wintypes
+
+        class Contadores(ctypes.Structure):
+            _fields_ = [("cb", wintypes.DWORD), ("PageFaultCount", wintypes.DWORD)] + [
+                (nome, ctypes.c_size_t) for nome in (
+                    "PeakWorkingSetSize", "WorkingSetSize", "QuotaPeakPagedPoolUsage",
+                    "QuotaPagedPoolUsage", "QuotaPeakNonPagedPoolUsage",
+                    "QuotaNonPagedPoolUsage", "PagefileUsage", "PeakPagefileUsage")]
+
+        contadores = Contadores()
+        contadores.cb = ctypes.sizeof(contadores)
+        ctypes.windll.psapi.GetProcessMemoryInfo(
+            ctypes.windll.kernel32.GetCurrentProcess(), ctypes.byref(contadores), contadores.cb)
+        return round(contadores.PeakWorkingSetSize / 2 ** 20, 1)
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (2 ** 20 if sys.platform == "darwin" else 2 ** 10), 1)
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def _limpar_miniaturas():
+    from database import transacao
+    with transacao() as conn:
+        conn.execute("DELETE FROM miniaturas")
+
+
+def _cronometrar(tempos, funcao, *args):
+    inicio = time.perf_counter()
+    resultado = funcao(*args)
+    tempos.append((time.perf_counter() - inicio) * 1000)
+    return resultado
+
+
+def _agora():
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+# Cada caminho recebe (teste_id, repeticoes) e devolve (tempos_ms, itens por operação)
+
+def _listar_imagens(teste_id, repeticoes):
+    from database import listar_imagens
+    tempos = []
+    for _ in range(repeticoes):
+        linhas = _cronometrar(tempos, listar_imagens, teste_id)
+    return tempos, len(linhas)
+
+
+def _iniciar_teste(teste_id, repeticoes):
+    from backend import BackendLocal
+    backend = BackendLocal()
+    tempos = []
+    for _ in range(repeticoes):
+        _cronometrar(tempos, backend.sortear_questoes, teste_id, _agora())
+    return tempos, 1
+
+
+def _decodificar(teste_id, repeticoes):
+    from database import listar_imagens, abrir_blob_imagem
+    from miniaturas import redimensionar
+    from questoes import TAMANHO_QUESTAO
+
+    def decodificar(imagem_id):
+        with abrir_blob_imagem(imagem_id) as blob:
+            redimensionar(blob, TAMANHO_QUESTAO).load()
+
+    ids = [row[0] for row in listar_imagens(teste_id)]
+    tempos = []
+    for imagem_id in random.Random(0).sample(ids, min(len(ids), repeticoes * 10)):
+        _cronometrar(tempos, decodificar, imagem_id)
+    return tempos, 1
+
+
+def _tela_questao(teste_id, repeticoes):
+    from sorteio import sortear_questoes
+    from questoes import CarregadorQuestoes
+    tempos = []
+    for semente in range(repeticoes):
+        _limpar_miniaturas()
+        questoes, _ = sortear_questoes(teste_id, semente=semente)
+        carregador = CarregadorQuestoes(questoes)
+        for index in range(len(carregador)):
+            _cronometrar(tempos, carregador.obter, index)
+        carregador.encerrar()
+    return tempos, 1
+
+
+def _sessao(teste_id, semente):
+    """Questões sorteadas e respostas com metade errada, como numa sessão."""
+    from sorteio import sortear_questoes
+    questoes, _ = sortear_questoes(teste_id, semente=semente)
+    respostas = [resposta if i % 2 else ("NOK" if resposta == "OK" else "OK")
+                 for i, (_, _, resposta) in enumerate(questoes)]
+    return questoes, respostas
+
+
+def _finalizar_teste(teste_id, repeticoes):
+    from database import registrar_sessao, transacao
+    from executar_teste import corrigir
+
+    def finalizar(questoes, respostas_usuario):
+        respostas, acertos = corrigir(questoes, respostas_usuario)
+        registrar_sessao({
+            "teste_id": teste_id, "avaliador": AVALIADOR_BENCH, "operador": "bench",
+            "matricula": "0", "turno": "A", "iniciado_em": _agora(), "finalizado_em": _agora(),
+            "acertos": acertos, "total": len(questoes), "semente": 0,
+        }, [r + (1000,) for r in respostas])
+
+    tempos = []
+    try:
+        for semente in range(repeticoes):
+            _cronometrar(tempos, finalizar, *_sessao(teste_id, semente))
+    finally:
+        with transacao() as conn:
+            conn.execute("DELETE FROM sessoes WHERE avaliador=?", (AVALIADOR_BENCH,))
+    return tempos, 1
+
+
+def _gerar_pdf(teste_id, repeticoes):
+    from relatorios import gerar_pdf_relatorio
+    from executar_teste import corrigir
+    pasta = tempfile.mkdtemp(prefix="bench_caminhos_pdf_")
+    tempos = []
+    for semente in range(repeticoes):
+        respostas, acertos = corrigir(*_sessao(teste_id, semente))
+        _limpar_miniaturas()  # as miniaturas do PDF são geradas no fim da sessão
+        _cronometrar(tempos, gerar_pdf_relatorio, {
+            "nome": "bench", "matricula": "0", "turno": "A", "avaliador": AVALIADOR_BENCH,
+            "acertos": acertos, "porcentagem": acertos / len(respostas) * 100,
+            "respostas": respostas, "pasta_resultados": pasta,
+        }, f"bench_{semente}.pdf")
+    shutil.rmtree(pasta, ignore_errors=True)
+    return tempos, 1
+
+
+def medir_caminho(caminho, banco, repeticoes):
+    """Roda um caminho neste processo. Usado pelo processo filho (--medir)."""
+    import database
+    database.definir_db_path(banco)
+    teste_id = database.conectar().execute("""
+        SELECT teste_id FROM imagens GROUP BY teste_id ORDER BY COUNT(*) DESC LIMIT 1
+    """).fetchone()[0]
+    inicio = time.perf_counter()
+    tempos, itens = globals()["_" + caminho](teste_id, repeticoes)
+    duracao = time.perf_counter() - inicio
+    return {
+        "operacoes": len(tempos),
+        "por_s": round(len(tempos) * itens / duracao, 1),
+        "p50_ms": round(statistics.median(tempos), 2),
+        "p99_ms": round(percentil(tempos, 99), 2),
+        "media_ms": round(statistics.mean(tempos), 2),
+        "pico_rss_mb": pico_memoria_mb(),
+    }
+
+
+def preparar_banco(args):
+    """(caminho do banco a usar, descrição da configuração)."""
+    pasta = os.path.join(tempfile.gettempdir(), "bench_caminhos")
+    os.makedirs(pasta, exist_ok=True)
+    if args.banco:
+        copia = os.path.join(pasta, "copia.db")
+        shutil.copyfile(args.banco, copia)
+        import database
+        database.definir_db_path(copia)
+        conn = database.conectar()
+        config = {"banco": os.path.basename(args.banco),
+                  "testes": conn.execute("SELECT COUNT(*) FROM testes").fetchone()[0],
+                  "imagens": conn.execute("SELECT COUNT(*) FROM imagens").fetchone()[0],
+                  "sessoes": conn.execute("SELECT COUNT(*) FROM sessoes").fetchone()[0]}
+        database.fechar_conexao()
+        return copia, config
+
+    from gerar_banco import gerar_banco
+    config = {"testes": args.testes, "imagens": args.imagens,
+              "resolucao": f"{args.largura}x{args.altura}", "sessoes": args.sessoes}
+    nome = "sintetico_{testes}_{imagens}_{resolucao}_{sessoes}.db".format(**config)
+    banco = os.path.join(pasta, nome)
+    if not os.path.exists(banco):
+        print(f"Gerando {banco}...", file=sys.stderr)
+        provisorio = banco + ".gerando"
+        if os.path.exists(provisorio):
+            os.remove(provisorio)
+        gerar_banco(provisorio, args.testes, args.imagens, args.largura, args.altura,
+                    sessoes=args.sessoes)
+        os.replace(provisorio, banco)
+    return banco, config
+
+
+def versao_codigo():
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=RAIZ,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def comparar(resultado, anteriores, tolerancia):
+    """Linhas de comparação com a última execução igual; e se houve piora."""
+    base = next((r for r in reversed(anteriores)
+                 if r["config"] == resultado["config"] and r["repeticoes"] == resultado["repeticoes"]),
+                None)
+    if base is None:
+        return ["Sem execução anterior com esta configuração para comparar."], False
+    linhas = [f"Comparado com {base['versao']} ({base['data']}):"]
+    piorou = False
+    for caminho, atual in resultado["caminhos"].items():
+        antes = base["caminhos"].get(caminho)
+        if not antes:
+            continue
+        variacao = atual["p50_ms"] / antes["p50_ms"] - 1 if antes["p50_ms"] else 0.0
+        marca = ""
+        if variacao > tolerancia and atual["p50_ms"] - antes["p50_ms"] > MINIMO_MS:
+            marca = "  <-- PIOROU"
+            piorou = True
+        linhas.append(f"  {caminho:16} p50 {antes['p50_ms']:9.2f} -> {atual['p50_ms']:9.2f} ms "
+                      f"({variacao:+.0%})  RSS {antes['pico_rss_mb']} -> {atual['pico_rss_mb']} MB{marca}")
+    return linhas, piorou
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempos dos caminhos quentes, sem janela.")
+    parser.add_argument("--banco", help="mede numa cópia deste banco em vez do sintético")
+    parser.add_argument("--testes", type=int, default=10)
+    parser.add_argument("--imagens", type=int, default=50000)
+    parser.add_argument("--largura", type=int, default=640)
+    parser.add_argument("--altura", type=int, default=480)
+    parser.add_argument("--sessoes", type=int, default=2000, help="histórico de sessões do sintético")
+    parser.add_argument("--repeticoes", type=int, default=20,
+                        help="sessões (ou chamadas) medidas por caminho")
+    parser.add_argument("--caminhos", default=",".join(CAMINHOS))
+    parser.add_argument("--tolerancia", type=float, default=0.2,
+                        help="piora de p50 aceita antes de acusar regressão (0.2 = 20%%)")
+    parser.add_argument("--sem-salvar", action="store_true",
+                        help=f"não acrescenta o resultado em {os.path.basename(ARQUIVO_RESULTADOS)}")
+    parser.add_argument("--medir", help=argparse.SUPPRESS)  # processo filho: um caminho só
+    args = parser.parse_args()
+
+    if args.medir:
+        print(json.dumps(medir_caminho(args.medir, args.banco, args.repeticoes)))
+        return
+
+    caminhos = [c.strip() for c in args.caminhos.split(",") if c.strip()]
+    desconhecidos = sorted(set(caminhos) - set(CAMINHOS))
+    if desconhecidos:
+        parser.error(f"caminhos desconhecidos: {', '.join(desconhecidos)}")
+    banco, config = preparar_banco(args)
+
+    resultado = {"data": _agora(), "versao": versao_codigo(),
+                 "python": sys.version.split()[0], "plataforma": platform.platform(),
+                 "config": config, "repeticoes": args.repeticoes, "caminhos": {}}
+    ambiente = dict(os.environ)
+    ambiente.pop("SERVIDOR_TESTES", None)  # sempre o banco local (BackendLocal)
+    for caminho in caminhos:
+        print(f"{caminho}...", file=sys.stderr)
+        saida = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), "--medir", caminho, "--banco", banco,
+             "--repeticoes", str(args.repeticoes)],
+            cwd=tempfile.gettempdir(), env=ambiente, capture_output=True, text=True,
+            check=True).stdout
+        resultado["caminhos"][caminho] = json.loads(saida.strip().splitlines()[-1])
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+    anteriores = []
+    if os.path.exists(ARQUIVO_RESULTADOS):
+        with open(ARQUIVO_RESULTADOS, encoding="utf-8") as f:
+            anteriores = [json.loads(linha) for linha in f if linha.strip()]
+    linhas, piorou = comparar(resultado, anteriores, args.tolerancia)
+    print("\n".join(linhas), file=sys.stderr)
+    if not args.sem_salvar:
+        with open(ARQUIVO_RESULTADOS, "a", encoding="utf-8") as f:
+            f.write(json.dumps(resultado, ensure_ascii=False) + "\n")
+    if piorou:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+# bench_inicio.py - tempo de abertura do programa (imports e executável)
+#
+# Uso: python benchmarks/bench_inicio.py [--repeticoes 5] [--top 15] [--exe dist/main.exe]
+# Mede com `python -X importtime` quanto custa importar cada tela, num
+# processo novo a cada repetição. Com --exe, mede também o executável
+# gerado pelo PyInstaller até a tela inicial aparecer (ver MEDIR_INICIO em main.py).
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODULOS = ["main", "executar_teste", "admin", "relatorios", "cli"]
+
+
+def importtime(modulo):
+    """Executa `import modulo` com -X importtime; devolve {módulo: (próprio_us, acumulado_us)}."""
+    saida = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {modulo}"],
+        cwd=RAIZ, capture_output=True, text=True, check=True).stderr
+    tempos = {}
+    for linha in saida.splitlines():
+        if not linha.startswith("import time:") or "self [us]" in linha:
+            continue
+        proprio, acumulado, nome = linha[len("import time:"):].split("|")
+        tempos[nome.strip()] = (int(proprio), int(acumulado))
+    return tempos
+
+
+def medir_modulo(modulo, repeticoes):
+    totais = []
+    for _ in range(repeticoes):
+        tempos = importtime(modulo)
+        totais.append(tempos[modulo][1] / 1000)
+    return tempos, {
+        "mediana_ms": round(statistics.median(totais), 1),
+        "minimo_ms": round(min(totais), 1),
+        "pesados": sorted(m for m in ("pandas", "numpy", "reportlab", "PIL.ImageTk")
+                          if m in tempos),
+    }
+
+
+def medir_exe(exe, repeticoes):
+    ambiente = dict(os.environ, MEDIR_INICIO="1")
+    tempos = []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        subprocess.run([exe], env=ambiente, check=True)
+        tempos.append((time.perf_counter() - inicio) * 1000)
+    return {"mediana_ms": round(statistics.median(tempos), 1),
+            "minimo_ms": round(min(tempos), 1)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Tempo de abertura do programa.")
+    parser.add_argument("--repeticoes", type=int, default=5)
+    parser.add_argument("--top", type=int, default=15,
+                        help="módulos mais caros (acumulado) listados para main")
+    parser.add_argument("--exe", help="executável do PyInstaller a medir")
+    args = parser.parse_args()
+
+    resultado = {"python": sys.version.split()[0], "modulos": {}}
+    for modulo in MODULOS:
+        tempos, resumo = medir_modulo(modulo, args.repeticoes)
+        resultado["modulos"][modulo] = resumo
+        if modulo == "main":
+            mais_caros = sorted(tempos.items(), key=lambda item: item[1][1], reverse=True)
+            resultado["main_top"] = [
+                {"modulo": nome, "acumulado_ms": round(acumulado / 1000, 1)}
+                for nome, (_, acumulado) in mais_caros[:args.top]]
+    if args.exe:
+        resultado["exe"] = medir_exe(args.exe, args.repeticoes)
+    print(json.dumps(resultado, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
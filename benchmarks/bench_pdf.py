@@ -0,0 +1,92 @@
+# bench_pdf.py - compara o PDF com as imagens originais x miniaturas do cache
+#
+# Uso: python benchmarks/bench_pdf.py [--imagens 10] [--largura 4000] [--altura 3000]
+# Roda num banco temporário com fotos sintéticas; não mexe no testes.db.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+from io import BytesIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+
+def foto_sintetica(largura, altura, semente):
+    """JPEG com ruído, para não comprimir de forma irreal."""
+    rnd = random.Random(semente)
+    pequena = Image.frombytes(
+        "RGB", (largura // 16, altura // 16),
+        bytes(rnd.getrandbits(8) for _ in range((largura // 16) * (altura // 16) * 3)))
+    imagem = pequena.resize((largura, altura), Image.BICUBIC)
+    saida = BytesIO()
+    imagem.save(saida, "JPEG", quality=92)
+    return saida.getvalue()
+
+
+def medir(gerar, pasta):
+    inicio = time.perf_counter()
+    arquivo = gerar(pasta)
+    segundos = time.perf_counter() - inicio
+    return {"bytes": os.path.getsize(arquivo), "segundos": round(segundos, 3)}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tamanho e tempo do PDF: originais x miniaturas.")
+    parser.add_argument("--imagens", type=int, default=10,
+                        help="questões erradas no relatório")
+    parser.add_argument("--distintas", type=int, default=5,
+                        help="imagens diferentes (o resto são repetições)")
+    parser.add_argument("--largura", type=int, default=4000)
+    parser.add_argument("--altura", type=int, default=3000)
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix="bench_pdf_")
+    os.chdir(pasta)  # database.get_db_path usa a pasta atual
+
+    import database
+    import relatorios
+    from miniaturas import obter_miniatura
+
+    database.criar_tabelas()
+    with database.transacao() as conn:
+        conn.execute("INSERT INTO testes (nome) VALUES ('bench')")
+    database.adicionar_imagens(1, [
+        (f"{i}.jpg", "OK", foto_sintetica(args.largura, args.altura, i))
+        for i in range(args.distintas)])
+    ids = [row[0] for row in database.listar_imagens(1)]
+    erradas = [ids[i % len(ids)] for i in range(args.imagens)]
+
+    def com_originais(destino):
+        erros = [(f"{i}.jpg", "NOK", "OK", database.carregar_imagem(i)) for i in erradas]
+        return relatorios.gerar_pdf("antes", "1", "A", 0, 0.0, erros,
+                                    pasta_resultados=os.path.join(destino, "antes"))
+
+    def com_miniaturas(destino):
+        erros = [(f"{i}.jpg", "NOK", "OK",
+                  obter_miniatura(i, relatorios.TAMANHO_MINIATURA_PDF,
+                                  ajustar=True, formato="JPEG"))
+                 for i in erradas]
+        return relatorios.gerar_pdf("depois", "1", "A", 0, 0.0, erros,
+                                    pasta_resultados=os.path.join(destino, "depois"))
+
+    resultado = {
+        "imagens": args.imagens,
+        "distintas": args.distintas,
+        "resolucao": f"{args.largura}x{args.altura}",
+        "dpi_miniatura": relatorios.DPI_MINIATURA_PDF,
+        "antes_originais": medir(com_originais, pasta),
+        # primeira vez gera as miniaturas; a segunda já encontra no cache
+        "depois_cache_frio": medir(com_miniaturas, pasta),
+        "depois_cache_quente": medir(com_miniaturas, pasta),
+    }
+    print(json.dumps(resultado, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,168 @@
+# bench_semelhanca.py - escala da busca de fotos repetidas com fotos da mesma peça
+#
+# Uso: python benchmarks/bench_semelhanca.py [--quantidades 250,500,1000,2000]
+#      [--copias 0.02] [--lado 540] [--calibrar N]
+# O pior caso da busca são fotos diferentes da mesma peça: o dhash delas é
+# quase igual e quase todas viram candidatas umas das outras. As fotos são
+# geradas a partir de imagens/Teste 1, cada uma com uma marca própria numa
+# posição ao acaso (como um defeito ou uma sujeira), e uma fração delas é
+# uma cópia recomprimida de outra (essas têm que ser avisadas). Para cada
+# quantidade mede a importação (importacao.importar_lote) num banco novo, uma
+# segunda importação de mais 10% sobre esse banco (a busca no que já estava
+# gravado) e o relatorio_duplicatas, numa pasta temporária; não mexe no
+# testes.db. Com --calibrar N, em vez disso mede a maior diferença de pixel
+# da miniatura entre cada foto e as suas cópias recomprimidas e a menor entre
+# fotos diferentes, em N fotos geradas e nas de imagens/Teste 1 (a margem em
+# volta de semelhanca.DIFERENCA_MAXIMA).
+import os
+import sys
+import glob
+import json
+import time
+import random
+import argparse
+import tempfile
+from io import BytesIO
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import numpy as np  # noqa: E402
+from PIL import Image, ImageDraw  # noqa: E402
+
+PASTA_FOTOS = os.path.join(RAIZ, "imagens", "Teste 1")
+
+
+def _jpeg(imagem, qualidade):
+    saida = BytesIO()
+    imagem.save(saida, "JPEG", quality=qualidade)
+    return saida.getvalue()
+
+
+def gerar_fotos(quantidade, fracao_copias, lado, semente=0):
+    """[(nome, resposta, bytes)]: fotos da mesma peça e algumas cópias recomprimidas."""
+    rnd = random.Random(semente)
+    bases = []
+    for caminho in sorted(glob.glob(os.path.join(PASTA_FOTOS, "*.png"))):
+        with Image.open(caminho) as imagem:
+            bases.append(imagem.convert("RGB").resize((lado, lado), Image.LANCZOS))
+    fotos = []
+    copias = int(quantidade * fracao_copias)
+    for numero in range(quantidade - copias):
+        imagem = bases[numero % len(bases)].copy()
+        x, y, raio = rnd.randrange(lado), rnd.randrange(lado), rnd.randint(lado // 25, lado // 15)
+        # Contrastando com o fundo, para ser outra foto também na miniatura 64x64
+        tom = 0 if sum(imagem.getpixel((x, y))) > 3 * 128 else 255
+        ImageDraw.Draw(imagem).ellipse((x - raio, y - raio, x + raio, y + raio), fill=(tom,) * 3)
+        fotos.append((f"{numero}.jpg", "OK" if numero % 2 else "NOK", _jpeg(imagem, 90)))
+    for numero in range(copias):
+        nome, resposta, dados = fotos[rnd.randrange(len(fotos) - copias or 1)]
+        with Image.open(BytesIO(dados)) as imagem:
+            menor = imagem.resize((lado * 3 // 4, lado * 3 // 4), Image.LANCZOS)
+        fotos.append((f"copia_{numero}_de_{nome}", resposta, _jpeg(menor, 60)))
+    return fotos
+
+
+def medir(quantidade, fracao_copias, lado):
+    pasta = tempfile.mkdtemp(prefix="bench_semelhanca_")
+    import database
+    import importacao
+    from semelhanca import relatorio_duplicatas
+
+    database.definir_db_path(os.path.join(pasta, "testes.db"))
+    database.criar_tabelas()
+    with database.transacao() as conn:
+        conn.execute("INSERT INTO testes (nome) VALUES ('bench')")
+    fotos = gerar_fotos(quantidade, fracao_copias, lado)
+    itens = [(nome, resposta, lambda d=dados: d) for nome, resposta, dados in fotos]
+
+    inicio = time.perf_counter()
+    r = importacao.importar_lote(1, itens)
+    importacao_s = time.perf_counter() - inicio
+
+    extras = gerar_fotos(max(1, quantidade // 10), fracao_copias, lado, semente=1)
+    inicio = time.perf_counter()
+    r_extra = importacao.importar_lote(
+        1, [(f"extra_{nome}", resposta, lambda d=dados: d) for nome, resposta, dados in extras])
+    sobre_banco_s = time.perf_counter() - inicio
+
+    inicio = time.perf_counter()
+    grupos = relatorio_duplicatas()
+    relatorio_s = time.perf_counter() - inicio
+    database.fechar_conexao()
+
+    copias = sum(1 for nome, _, _ in fotos if nome.startswith("copia_"))
+    return {
+        "imagens": quantidade,
+        "copias": copias,
+        "importacao_s": round(importacao_s, 2),
+        "avisos_importacao": len(r["semelhantes"]),
+        "importacao_sobre_banco_s": round(sobre_banco_s, 2),
+        "imagens_sobre_banco": len(extras),
+        "avisos_sobre_banco": len(r_extra["semelhantes"]),
+        "relatorio_s": round(relatorio_s, 2),
+        "grupos_relatorio": len(grupos),
+    }
+
+
+def calibrar(quantidade, lado):
+    """Margem entre as cópias recomprimidas e as fotos diferentes, na miniatura em cinza."""
+    from semelhanca import calcular_assinatura, DIFERENCA_MAXIMA
+
+    def cinza(dados):
+        return np.frombuffer(calcular_assinatura(dados)[6], dtype=np.uint8).astype(np.int16)
+
+    conjuntos = {"geradas": [dados for _, _, dados in gerar_fotos(quantidade, 0, lado)]}
+    conjuntos["imagens/Teste 1"] = []
+    for caminho in sorted(glob.glob(os.path.join(PASTA_FOTOS, "*.png"))):
+        with open(caminho, "rb") as f:
+            conjuntos["imagens/Teste 1"].append(f.read())
+
+    resultado = {"diferenca_maxima": DIFERENCA_MAXIMA}
+    for nome, fotos in conjuntos.items():
+        cinzas = np.array([cinza(dados) for dados in fotos])
+        copias = []
+        for dados, original in zip(fotos, cinzas):
+            with Image.open(BytesIO(dados)) as imagem:
+                imagem = imagem.convert("RGB")
+                for qualidade, escala in ((95, 1), (75, 1), (50, 1), (30, 1), (85, 0.5),
+                                          (60, 0.37), (30, 0.37), (85, 1.5)):
+                    tamanho = (int(imagem.width * escala), int(imagem.height * escala))
+                    copia = imagem.resize(tamanho, Image.LANCZOS) if escala != 1 else imagem
+                    copias.append(int(np.abs(cinza(_jpeg(copia, qualidade)) - original).max()))
+        diferentes = [int(np.abs(cinzas[i + 1:] - cinzas[i]).max(axis=1).min())
+                      for i in range(len(cinzas) - 1)]
+        resultado[nome] = {
+            "fotos": len(fotos),
+            "copias": len(copias),
+            "copias_maior_diferenca": max(copias),
+            "copias_p99": float(np.percentile(copias, 99)),
+            "diferentes_menor_diferenca": min(diferentes),
+            "diferentes_p1": float(np.percentile(diferentes, 1)),
+            # Valores de DIFERENCA_MAXIMA que separam tudo neste conjunto
+            "separa_de_ate": ([max(copias), min(diferentes) - 1]
+                              if max(copias) < min(diferentes) else None),
+        }
+    return resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Tempo da busca de repetidas com fotos da mesma peça.")
+    parser.add_argument("--quantidades", default="250,500,1000,2000")
+    parser.add_argument("--copias", type=float, default=0.02,
+                        help="fração das fotos que são cópias recomprimidas de outra")
+    parser.add_argument("--lado", type=int, default=540, help="lado das fotos geradas")
+    parser.add_argument("--calibrar", type=int, metavar="N",
+                        help="mede a margem de DIFERENCA_MAXIMA com N fotos geradas")
+    args = parser.parse_args()
+
+    if args.calibrar:
+        print(json.dumps(calibrar(args.calibrar, args.lado), indent=2))
+        return
+    resultados = [medir(int(q), args.copias, args.lado) for q in args.quantidades.split(",")]
+    print(json.dumps(resultados, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# carga_servidor.py - quantas sessões por segundo o servidor.py aguenta
+#
+# Uso: python benchmarks/carga_servidor.py [--estacoes 1,2,4,8,16] [--segundos 10]
+#      [--imagens 150] [--trabalhadores 8] [--banco arquivo.db] [--sem-aquecer]
+# Sobe o servidor.py num processo separado (com um banco sintético numa
+# pasta temporária, ou com --banco) e simula estações em threads: cada uma
+# repete uma sessão completa pelo BackendRemoto (lista os testes, sorteia
+# as questões, baixa as miniaturas e registra o resultado). Antes, gera
+# as miniaturas de todas as imagens, para medir o regime normal e não o
+# cache frio (--sem-aquecer mede com ele). Mostra sessões
+# por segundo e latência de cada tipo de pedido para cada nível de concorrência.
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def criar_banco(caminho, imagens):
+    from gerar_banco import gerar_banco
+    gerar_banco(caminho, testes=1, imagens=imagens, distintas=imagens)
+
+
+def porta_livre():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def esperar_servidor(backend, limite_s=30):
+    fim = time.time() + limite_s
+    while time.time() < fim:
+        try:
+            return backend._json("GET", "/saude")
+        except Exception:
+            time.sleep(0.2)
+    raise RuntimeError("O servidor não respondeu")
+
+
+def estacao(backend, parar, tempos, sessoes):
+    """Repete sessões completas até `parar`; acumula (tipo, ms) em tempos."""
+    def medir(tipo, funcao, *args):
+        inicio = time.perf_counter()
+        resultado = funcao(*args)
+        tempos.append((tipo, (time.perf_counter() - inicio) * 1000))
+        return resultado
+
+    while not parar.is_set():
+        testes = medir("testes", backend.listar_testes_pagina, None, 200)
+        teste_id = testes[0][0]
+        questoes, sorteio = medir("questoes", backend.sortear_questoes, teste_id,
+                                  datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+        for imagem_id, _, _ in questoes:
+            medir("miniatura", backend.obter_miniatura, imagem_id, (400, 300))
+        agora = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        medir("sessao", backend.registrar_sessao, dict(sorteio, **{
+            "teste_id": teste_id, "avaliador": "carga", "operador": "carga",
+            "matricula": "0", "turno": "A", "iniciado_em": agora, "finalizado_em": agora,
+            "acertos": 0, "total": len(questoes),
+        }), [(imagem_id, nome, "OK", resposta, 500) for imagem_id, nome, resposta in questoes])
+        sessoes.append(time.perf_counter())
+
+
+def aquecer(backend):
+    """Gera no servidor as miniaturas de todas as imagens (cache das telas)."""
+    from database import conectar
+    inicio = time.perf_counter()
+    ids = [row[0] for row in conectar().execute("SELECT id FROM imagens")]
+    for imagem_id in ids:
+        backend.obter_miniatura(imagem_id, (400, 300))
+    return round(time.perf_counter() - inicio, 1)
+
+
+def percentil(valores, p):
+    valores = sorted(valores)
+    return valores[min(len(valores) - 1, int(len(valores) * p / 100))]
+
+
+def rodar_nivel(url, estacoes, segundos):
+    from backend import BackendRemoto
+    parar = threading.Event()
+    tempos, sessoes = [], []
+    threads = [threading.Thread(target=estacao, args=(BackendRemoto(url), parar, tempos, sessoes))
+               for _ in range(estacoes)]
+    inicio = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(segundos)
+    parar.set()
+    for t in threads:
+        t.join()
+    duracao = time.perf_counter() - inicio
+    por_tipo = {}
+    for tipo, ms in tempos:
+        por_tipo.setdefault(tipo, []).append(ms)
+    return {
+        "estacoes": estacoes,
+        "sessoes": len(sessoes),
+        "sessoes_por_s": round(len(sessoes) / duracao, 2),
+        "pedidos_por_s": round(len(tempos) / duracao, 1),
+        "latencia_ms": {tipo: {"p50": round(statistics.median(v), 1),
+                               "p95": round(percentil(v, 95), 1)}
+                        for tipo, v in sorted(por_tipo.items())},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga do servidor.py.")
+    parser.add_argument("--estacoes", default="1,2,4,8,16",
+                        help="níveis de concorrência, separados por vírgula")
+    parser.add_argument("--segundos", type=float, default=10, help="duração de cada nível")
+    parser.add_argument("--imagens", type=int, default=150, help="imagens do banco sintético")
+    parser.add_argument("--trabalhadores", type=int, default=8, help="threads do servidor")
+    parser.add_argument("--banco", help="usa este banco em vez de um sintético (recebe sessões!)")
+    parser.add_argument("--sem-aquecer", action="store_true",
+                        help="não gera as miniaturas antes (mede com o cache frio)")
+    args = parser.parse_args()
+
+    pasta = tempfile.mkdtemp(prefix="carga_servidor_")
+    banco = args.banco
+    if not banco:
+        banco = os.path.join(pasta, "testes.db")
+        print(f"Criando banco sintético com {args.imagens} imagens...", file=sys.stderr)
+        criar_banco(banco, args.imagens)
+
+    porta = porta_livre()
+    url = f"http://127.0.0.1:{porta}"
+    servidor = subprocess.Popen(
+        [sys.executable, os.path.join(RAIZ, "servidor.py"), "--banco", banco,
+         "--host", "127.0.0.1", "--porta", str(porta),
+         "--trabalhadores", str(args.trabalhadores)],
+        cwd=pasta, stderr=subprocess.DEVNULL)
+    try:
+        from backend import BackendRemoto
+        esperar_servidor(BackendRemoto(url))
+        aquecimento_s = None
+        if not args.sem_aquecer:
+            print("Gerando as miniaturas...", file=sys.stderr)
+            import database
+            database.definir_db_path(banco)
+            aquecimento_s = aquecer(BackendRemoto(url))
+        niveis = []
+        for estacoes in (int(n) for n in args.estacoes.split(",")):
+            print(f"{estacoes} estação(ões)...", file=sys.stderr)
+            niveis.append(rodar_nivel(url, estacoes, args.segundos))
+    finally:
+        servidor.terminate()
+        servidor.wait()
+    print(json.dumps({"banco": banco, "trabalhadores": args.trabalhadores,
+                      "aquecimento_s": aquecimento_s, "niveis": niveis}, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+# gerar_banco.py - banco sintético grande para os benchmarks
+#
+# Uso: python benchmarks/gerar_banco.py saida.db [--testes 10] [--imagens 50000]
+#      [--largura 640] [--altura 480] [--distintas 200] [--sessoes 2000] [--semente 0]
+# Cria testes com imagens JPEG de ruído na resolução pedida e, opcionalmente,
+# um histórico de sessões respondidas (pesa no sorteio e nos relatórios).
+# Codificar dezenas de milhares de fotos levaria muito tempo: são geradas
+# `distintas` fotos, e cada imagem é uma delas com alguns bytes próprios
+# depois do fim do JPEG. Os decodificadores ignoram esses bytes, mas o hash
+# muda, então cada imagem tem o seu conteúdo no banco, como fotos reais.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from io import BytesIO
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from PIL import Image  # noqa: E402
+
+LOTE_IMAGENS = 500  # Imagens por transação
+QUESTOES_POR_SESSAO = 10
+
+
+def foto_sintetica(semente, largura=640, altura=480):
+    """JPEG com ruído, para não comprimir de forma irreal."""
+    rnd = random.Random(semente)
+    pequena = Image.frombytes(
+        "RGB", (max(1, largura // 20), max(1, altura // 20)),
+        bytes(rnd.getrandbits(8) for _ in range(max(1, largura // 20) * max(1, altura // 20) * 3)))
+    saida = BytesIO()
+    pequena.resize((largura, altura), Image.BILINEAR).save(saida, "JPEG", quality=85)
+    return saida.getvalue()
+
+
+def _gerar_sessoes(conn, quantidade, rnd):
+    """Sessões de 10 questões em testes ao acaso, ~15% de erros, nos últimos 90 dias."""
+    por_teste = {}
+    for imagem_id, teste_id, nome, resposta in conn.execute(
+            "SELECT id, teste_id, nome_arquivo, resposta_correta FROM imagens"):
+        por_teste.setdefault(teste_id, []).append((imagem_id, nome, resposta))
+    testes = sorted(por_teste)
+    inicio = datetime.now() - timedelta(days=90)
+    for numero in range(quantidade):
+        teste_id = rnd.choice(testes)
+        questoes = rnd.sample(por_teste[teste_id], min(QUESTOES_POR_SESSAO, len(por_teste[teste_id])))
+        respostas = []
+        for imagem_id, nome, correta in questoes:
+            resposta = correta if rnd.random() > 0.15 else ("NOK" if correta == "OK" else "OK")
+            respostas.append((imagem_id, nome, resposta, correta, rnd.randint(400, 4000)))
+        iniciado = inicio + timedelta(seconds=numero * 90 * 86400 // max(1, quantidade))
+        cursor = conn.execute("""
+            INSERT INTO sessoes (teste_id, avaliador, operador, matricula, turno,
+                                 iniciado_em, finalizado_em, acertos, total)
+            VALUES (?, 'bench', ?, ?, ?, ?, ?, ?, ?)
+        """, (teste_id, f"Operador {numero % 50}", str(1000 + numero % 50), "ABC"[numero % 3],
+              iniciado.strftime("%Y-%m-%d %H:%M:%S"),
+              (iniciado + timedelta(minutes=2)).strftime("%Y-%m-%d %H:%M:%S"),
+              sum(r[2] == r[3] for r in respostas), len(respostas)))
+        conn.executemany("""
+            INSERT INTO respostas (sessao_id, ordem, imagem_id, nome_arquivo,
+                                   resposta, resposta_correta, correta, tempo_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, ((cursor.lastrowid, ordem, imagem_id, nome, resposta, correta,
+               int(resposta == correta), tempo_ms)
+              for ordem, (imagem_id, nome, resposta, correta, tempo_ms) in enumerate(respostas, 1)))
+
+
+def gerar_banco(caminho, testes=10, imagens=50000, largura=640, altura=480,
+                distintas=200, sessoes=0, semente=0):
+    """
+    Cria o banco em `caminho` (não pode existir). Retorna um resumo com a
+    configuração, o tamanho do arquivo e os segundos gastos.
+    """
+    import database
+    if os.path.exists(caminho):
+        raise FileExistsError(caminho)
+    inicio = time.perf_counter()
+    database.definir_db_path(caminho)
+    database.criar_tabelas()
+    rnd = random.Random(semente)
+    fotos = [foto_sintetica(semente * 100003 + i, largura, altura)
+             for i in range(max(1, min(distintas, imagens)))]
+
+    with database.transacao() as conn:
+        conn.executemany("INSERT INTO testes (nome) VALUES (?)",
+                         [(f"Teste {numero + 1}",) for numero in range(testes)])
+    teste_ids = [row[0] for row in database.conectar().execute("SELECT id FROM testes ORDER BY id")]
+    for inicio_lote in range(0, imagens, LOTE_IMAGENS):
+        linhas_por_teste = {}
+        for numero in range(inicio_lote, min(imagens, inicio_lote + LOTE_IMAGENS)):
+            dados = fotos[numero % len(fotos)] + numero.to_bytes(4, "big")
+            resposta = "OK" if rnd.random() < 0.7 else "NOK"
+            linhas_por_teste.setdefault(teste_ids[numero % len(teste_ids)], []).append(
+                (f"foto_{numero:06d}.jpg", resposta, dados))
+        for teste_id, linhas in linhas_por_teste.items():
+            database.adicionar_imagens(teste_id, linhas)
+    if sessoes:
+        with database.transacao() as conn:
+            _gerar_sessoes(conn, sessoes, rnd)
+    database.conectar().execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    database.fechar_conexao()
+    return {
+        "testes": testes, "imagens": imagens, "resolucao": f"{largura}x{altura}",
+        "distintas": len(fotos), "sessoes": sessoes, "semente": semente,
+        "bytes": os.path.getsize(caminho),
+        "segundos": round(time.perf_counter() - inicio, 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Gera um banco sintético para os benchmarks.")
+    parser.add_argument("saida", help="arquivo .db a criar")
+    parser.add_argument("--testes", type=int, default=10)
+    parser.add_argument("--imagens", type=int, default=50000, help="total, divididas entre os testes")
+    parser.add_argument("--largura", type=int, default=640)
+    parser.add_argument("--altura", type=int, default=480)
+    parser.add_argument("--distintas", type=int, default=200,
+                        help="fotos codificadas de fato (ver o cabeçalho do arquivo)")
+    parser.add_argument("--sessoes", type=int, default=0, help="sessões no histórico de respostas")
+    parser.add_argument("--semente", type=int, default=0)
+    args = parser.parse_args()
+    resumo = gerar_banco(args.saida, args.testes, args.imagens, args.largura, args.altura,
+                         args.distintas, args.sessoes, args.semente)
+    print(json.dumps(resumo, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+# cli.py - administração e relatórios pela linha de comando (sem Tk)
+#
+# Uso: python cli.py [--banco testes.db] <comando> ...
+#   testes listar | testes criar NOME [--descricao D] | testes excluir TESTE
+#   testes configurar TESTE [--questoes N] [--proporcao-ok P]
+#   importar TESTE ORIGEM [--criar] [--resposta OK|NOK] [--normalizar [--sem-original]]
+#   exportar-imagens TESTE DESTINO   (pasta ou arquivo .zip, com gabarito.csv)
+#   exportar [--teste T] [--desde AAAA-MM-DD] [--ate AAAA-MM-DD] [--saida arquivo.csv]
+#   pdf [SESSAO ...] [--teste T] [--desde ...] [--ate ...] [--saida pasta]
+#   duplicatas [--teste T] [--distancia N] [--diferenca N]
+#   sorteio SESSAO
+#   tempos [ARQUIVO ...] [--nome OPERACAO]
+# TESTE pode ser o id ou o nome. A saída é sempre JSON no stdout; em caso
+# de erro, {"erro": ...} no stderr e código de saída 1.
+import os
+import sys
+import glob
+import json
+import sqlite3
+import argparse
+
+import database
+from database import conectar, transacao, criar_tabelas
+from sorteio import configuracao
+from medicoes import iniciar_perfil
+
+PASTA_RESULTADOS = os.path.join(os.path.abspath("."), "resultados")
+
+
+class ErroCli(Exception):
+    pass
+
+
+def _obter_teste(valor):
+    """Id do teste a partir do id ou do nome."""
+    conn = conectar()
+    row = None
+    if valor.isdigit():
+        row = conn.execute("SELECT id FROM testes WHERE id=?", (int(valor),)).fetchone()
+    if row is None:
+        row = conn.execute("SELECT id FROM testes WHERE nome=?", (valor,)).fetchone()
+    if row is None:
+        raise ErroCli(f"Teste não encontrado: {valor}")
+    return row[0]
+
+
+def _filtro_sessoes(args):
+    """Condição SQL (sobre `s`, a tabela sessoes) e parâmetros dos filtros de teste e data."""
+    condicoes, params = [], []
+    if args.teste:
+        condicoes.append("s.teste_id = ?")
+        params.append(_obter_teste(args.teste))
+    if args.desde:
+        condicoes.append("s.finalizado_em >= ?")
+        params.append(args.desde)
+    if args.ate:
+        # Data sem hora vale pelo dia inteiro
+        condicoes.append("s.finalizado_em < date(?, '+1 day')" if len(args.ate) == 10
+                         else "s.finalizado_em <= ?")
+        params.append(args.ate)
+    return " AND ".join(condicoes), params
+
+
+def listar_testes(args):
+    cursor = conectar().execute("""
+        SELECT t.id, t.nome, t.descricao, t.num_questoes, t.proporcao_ok, COUNT(i.id)
+        FROM testes t LEFT JOIN imagens i ON i.teste_id = t.id
+        GROUP BY t.id ORDER BY t.nome
+    """)
+    return [{"id": id, "nome": nome, "descricao": descricao, "num_questoes": num_questoes,
+             "proporcao_ok": proporcao_ok, "imagens": imagens}
+            for id, nome, descricao, num_questoes, proporcao_ok, imagens in cursor]
+
+
+def criar_teste(args):
+    try:
+        with transacao() as conn:
+            cursor = conn.execute("INSERT INTO testes (nome, descricao) VALUES (?, ?)",
+                                  (args.nome, args.descricao))
+    except sqlite3.IntegrityError:
+        raise ErroCli(f"Já existe um teste com o nome: {args.nome}")
+    return {"id": cursor.lastrowid, "nome": args.nome, "descricao": args.descricao}
+
+
+def excluir_teste(args):
+    teste_id = _obter_teste(args.teste)
+    # As imagens saem junto (ON DELETE CASCADE)
+    with transacao() as conn:
+        conn.execute("DELETE FROM testes WHERE id=?", (teste_id,))
+    return {"id": teste_id, "excluido": True}
+
+
+def configurar_teste(args):
+    """Questões por sessão e proporção de OK (vazio: a das imagens do teste)."""
+    teste_id = _obter_teste(args.teste)
+    with transacao() as conn:
+        if args.questoes is not None:
+            if args.questoes < 1:
+                raise ErroCli("--questoes deve ser pelo menos 1")
+            conn.execute("UPDATE testes SET num_questoes=? WHERE id=?",
+                         (args.questoes, teste_id))
+        if args.proporcao_ok is not None:
+            try:
+                proporcao = float(args.proporcao_ok) if args.proporcao_ok else None
+            except ValueError:
+                raise ErroCli(f"--proporcao-ok inválida: {args.proporcao_ok}")
+            if proporcao is not None and not 0 <= proporcao <= 1:
+                raise ErroCli("--proporcao-ok deve estar entre 0 e 1")
+            conn.execute("UPDATE testes SET proporcao_ok=? WHERE id=?",
+                         (proporcao, teste_id))
+    num_questoes, proporcao_ok = configuracao(teste_id)
+    return {"id": teste_id, "num_questoes": num_questoes, "proporcao_ok": proporcao_ok}
+
+
+def importar(args):
+    from importacao import listar_origem, importar_lote
+
+    if args.criar and not conectar().execute(
+            "SELECT 1 FROM testes WHERE nome=?", (args.teste,)).fetchone():
+        with transacao() as conn:
+            conn.execute("INSERT INTO testes (nome) VALUES (?)", (args.teste,))
+    teste_id = _obter_teste(args.teste)
+    if not os.path.exists(args.origem):
+        raise ErroCli(f"Origem não encontrada: {args.origem}")
+    try:
+        itens = listar_origem(args.origem)
+    except ValueError as e:
+        raise ErroCli(str(e))
+
+    with itens:
+        if args.resposta:
+            # Como na tela de administração: vale para as que vieram sem gabarito
+            itens[:] = [(nome, resposta or args.resposta, ler) for nome, resposta, ler in itens]
+        r = importar_lote(teste_id, itens, normalizar=args.normalizar,
+                          guardar_original=not args.sem_original,
+                          progresso=lambda feitas, total: print(
+                              f"\r{feitas}/{total}", end="", file=sys.stderr))
+    print(file=sys.stderr)
+    return {
+        "teste_id": teste_id,
+        "importadas": r["importadas"],
+        "erros": [{"arquivo": nome, "motivo": motivo} for nome, motivo in r["erros"]],
+        "semelhantes": [
+            {"arquivo": nome, "parecida_com": parecida, "teste_id": teste,
+             "resposta": resposta, "distancia": d}
+            for nome, parecida, teste, resposta, d in r["semelhantes"]],
+        "segundos": round(r["segundos"], 3),
+        "imagens_por_segundo": round(r["imagens_por_segundo"], 1),
+    }
+
+
+def exportar_imagens(args):
+    """Imagens do teste e o gabarito, numa pasta ou num .zip (reimportáveis)."""
+    from importacao import exportar_teste
+
+    teste_id = _obter_teste(args.teste)
+    r = exportar_teste(teste_id, args.destino, progresso=lambda feitas, total: print(
+        f"\r{feitas}/{total}", end="", file=sys.stderr))
+    print(file=sys.stderr)
+    return {"teste_id": teste_id, "destino": args.destino, "exportadas": r["exportadas"],
+            "bytes": r["bytes"], "segundos": round(r["segundos"], 3)}
+
+
+def exportar(args):
+    """Uma linha por resposta (ver relatorios.exportar_respostas)."""
+    from relatorios import exportar_respostas
+
+    where, params = _filtro_sessoes(args)
+    saida = os.path.abspath(args.saida or os.path.join(PASTA_RESULTADOS, "exportacao.csv"))
+    sessoes, respostas = exportar_respostas(saida, where, params)
+    return {"arquivo": saida, "sessoes": sessoes, "respostas": respostas}
+
+
+def regerar_pdf(args):
+    from relatorios import dados_da_sessao, gerar_pdf_relatorio
+
+    if args.sessoes:
+        ids = args.sessoes
+    else:
+        where, params = _filtro_sessoes(args)
+        ids = [row[0] for row in conectar().execute(
+            f"SELECT s.id FROM sessoes s {'WHERE ' + where if where else ''} ORDER BY s.id",
+            params)]
+
+    pasta = os.path.abspath(args.saida or PASTA_RESULTADOS)
+    gerados, erros = [], []
+    for sessao_id in ids:
+        dados = dados_da_sessao(sessao_id, pasta)
+        if dados is None:
+            erros.append({"sessao": sessao_id, "motivo": "sessão não encontrada"})
+            continue
+        try:
+            # Nome pela sessão: várias sessões do mesmo operador não se sobrescrevem
+            arquivo = gerar_pdf_relatorio(
+                dados, nome_pdf=f"resultado_{dados['nome']}_sessao{sessao_id}.pdf")
+            gerados.append({"sessao": sessao_id, "arquivo": arquivo})
+        except Exception as e:
+            erros.append({"sessao": sessao_id, "motivo": str(e)})
+    return {"gerados": gerados, "erros": erros}
+
+
+def duplicatas(args):
+    from semelhanca import relatorio_duplicatas, DISTANCIA_MAXIMA
+
+    if args.distancia is None:
+        args.distancia = DISTANCIA_MAXIMA
+    if not 0 <= args.distancia <= 7:
+        raise ErroCli("--distancia deve estar entre 0 e 7")
+    teste_id = _obter_teste(args.teste) if args.teste else None
+    if args.diferenca is not None and not 0 <= args.diferenca <= 255:
+        raise ErroCli("--diferenca deve estar entre 0 e 255")
+    grupos = relatorio_duplicatas(args.distancia, teste_id, progresso=lambda feitas, total: print(
+        f"\r{feitas}/{total}", end="", file=sys.stderr), diferenca=args.diferenca)
+    return {
+        "grupos": len(grupos),
+        "com_conflito": sum(1 for g in grupos if g["conflito"]),
+        "duplicatas": [
+            {"conflito": g["conflito"],
+             "imagens": [{"id": id, "teste": teste, "arquivo": nome, "resposta": resposta}
+                         for id, teste, nome, resposta in g["imagens"]]}
+            for g in grupos],
+    }
+
+
+def conferir_sorteio(args):
+    """Refaz o sorteio da sessão e compara com as imagens que ela registrou."""
+    from sorteio import repetir_sorteio
+
+    questoes = repetir_sorteio(args.sessao)
+    if questoes is None:
+        raise ErroCli(f"Sessão não encontrada ou sem semente: {args.sessao}")
+    registradas = [row[0] for row in conectar().execute(
+        "SELECT imagem_id FROM respostas WHERE sessao_id=? ORDER BY ordem", (args.sessao,))]
+    sorteadas = [q[0] for q in questoes]
+    return {"sessao": args.sessao, "confere": sorteadas == registradas,
+            "sorteadas": sorteadas, "registradas": registradas}
+
+
+def resumir_tempos(args):
+    """Resume os tempos gravados ao fim das sessões (ver medicoes.py)."""
+    from medicoes import ler, resumo
+
+    arquivos = args.arquivos or sorted(glob.glob(os.path.join(PASTA_RESULTADOS, "tempos", "*.jsonl")))
+    if not arquivos:
+        raise ErroCli("Nenhum arquivo de tempos encontrado")
+    try:
+        eventos = ler(arquivos)
+    except (OSError, ValueError) as e:
+        raise ErroCli(f"Não foi possível ler os tempos: {e}")
+    if args.nome:
+        eventos = [e for e in eventos if e["nome"].startswith(args.nome)]
+    return {"arquivos": len(arquivos), "eventos": len(eventos),
+            "sessoes": len({e.get("sessao_id") for e in eventos if e.get("sessao_id")}),
+            "operacoes": resumo(eventos)}
+
+
+def _adicionar_filtros(parser):
+    parser.add_argument("--teste", help="id ou nome do teste")
+    parser.add_argument("--desde", help="data/hora inicial (AAAA-MM-DD[ HH:MM:SS])")
+    parser.add_argument("--ate", help="data/hora final (AAAA-MM-DD[ HH:MM:SS])")
+
+
+def criar_parser():
+    parser = argparse.ArgumentParser(
+        description="Administração e relatórios do Sistema de Testes sem interface gráfica.")
+    parser.add_argument("--banco", help="arquivo do banco (padrão: o mesmo do programa)")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    testes = comandos.add_parser("testes", help="cadastro de testes")
+    acoes = testes.add_subparsers(dest="acao", required=True)
+    acoes.add_parser("listar").set_defaults(funcao=listar_testes)
+    criar = acoes.add_parser("criar")
+    criar.add_argument("nome")
+    criar.add_argument("--descricao", default="")
+    criar.set_defaults(funcao=criar_teste)
+    excluir = acoes.add_parser("excluir")
+    excluir.add_argument("teste", help="id ou nome do teste")
+    excluir.set_defaults(funcao=excluir_teste)
+    configurar = acoes.add_parser("configurar", help="questões por sessão e proporção de OK")
+    configurar.add_argument("teste", help="id ou nome do teste")
+    configurar.add_argument("--questoes", type=int, help="questões por sessão")
+    configurar.add_argument("--proporcao-ok",
+                            help="fração de questões OK, de 0 a 1 ('' = a das imagens)")
+    configurar.set_defaults(funcao=configurar_teste)
+
+    imp = comandos.add_parser("importar", help="importa imagens (pasta, .zip ou gabarito .csv)")
+    imp.add_argument("teste", help="id ou nome do teste")
+    imp.add_argument("origem")
+    imp.add_argument("--criar", action="store_true", help="cria o teste se não existir")
+    imp.add_argument("--resposta", type=str.upper, choices=["OK", "NOK"],
+                     help="resposta das imagens sem gabarito (gabarito.csv ou pasta OK/NOK)")
+    imp.add_argument("--normalizar", action=argparse.BooleanOptionalAction,
+                     help="reduz as imagens para a resolução de exibição "
+                          "(padrão: normalizacao.NORMALIZAR_NA_IMPORTACAO, desligado)")
+    imp.add_argument("--sem-original", action="store_true",
+                     help="com --normalizar, não guarda o arquivo original")
+    imp.set_defaults(funcao=importar)
+
+    exi = comandos.add_parser("exportar-imagens",
+                              help="exporta as imagens e o gabarito (pasta ou .zip)")
+    exi.add_argument("teste", help="id ou nome do teste")
+    exi.add_argument("destino", help="pasta ou arquivo terminado em .zip")
+    exi.set_defaults(funcao=exportar_imagens)
+
+    exp = comandos.add_parser("exportar", help="exporta as respostas registradas para CSV")
+    _adicionar_filtros(exp)
+    exp.add_argument("--saida", help="arquivo CSV (padrão: resultados/exportacao.csv)")
+    exp.set_defaults(funcao=exportar)
+
+    pdf = comandos.add_parser("pdf", help="refaz o PDF de sessões já registradas")
+    pdf.add_argument("sessoes", nargs="*", type=int, help="ids das sessões")
+    _adicionar_filtros(pdf)
+    pdf.add_argument("--saida", help="pasta dos PDFs (padrão: resultados)")
+    pdf.set_defaults(funcao=regerar_pdf)
+
+    dup = comandos.add_parser("duplicatas", help="fotos repetidas (iguais ou quase iguais)")
+    dup.add_argument("--teste", help="só as imagens deste teste (id ou nome)")
+    dup.add_argument("--distancia", type=int,
+                     help="bits diferentes (de 64) para ser candidata, até 7 (padrão: 3); "
+                          "a miniatura em cinza confirma")
+    dup.add_argument("--diferenca", type=int,
+                     help="maior diferença (de 255) num pixel da miniatura em cinza para ser "
+                          "a mesma foto (padrão: semelhanca.DIFERENCA_MAXIMA, 64)")
+    dup.set_defaults(funcao=duplicatas)
+
+    sor = comandos.add_parser("sorteio", help="confere o sorteio de uma sessão pela semente")
+    sor.add_argument("sessao", type=int, help="id da sessão")
+    sor.set_defaults(funcao=conferir_sorteio)
+
+    tem = comandos.add_parser("tempos", help="resume os tempos medidos nas sessões")
+    tem.add_argument("arquivos", nargs="*",
+                     help="arquivos .jsonl (padrão: todos de resultados/tempos)")
+    tem.add_argument("--nome", help="só as operações que começam com este nome (ex.: db.)")
+    tem.set_defaults(funcao=resumir_tempos)
+    return parser
+
+
+def main(argv=None):
+    args = criar_parser().parse_args(argv)
+    iniciar_perfil()  # só com PERFIL_TESTES
+    if args.banco:
+        database.definir_db_path(args.banco)
+    try:
+        criar_tabelas()
+        resultado = args.funcao(args)
+    except (ErroCli, sqlite3.Error) as e:
+        print(json.dumps({"erro": str(e)}, ensure_ascii=False), file=sys.stderr)
+        return 1
+    print(json.dumps(resultado, ensure_ascii=False, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
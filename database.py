@@ -2,28 +2,105 @@ import sqlite3
 import os
 import sys
 import tempfile
+import shutil
+import atexit
+import threading
+import hashlib
+from contextlib import contextmanager
+
+from medicoes import medir, medido
+
+TAMANHO_PEDACO = 1024 * 1024  # Leitura/escrita de BLOBs em pedaços de 1 MB
+
+# Pragmas aplicados a cada conexão nova
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # leitores não bloqueiam o escritor
+    "PRAGMA synchronous=NORMAL",    # seguro com WAL e bem mais rápido
+    "PRAGMA foreign_keys=ON",       # faz o ON DELETE CASCADE funcionar
+    "PRAGMA cache_size=-20000",     # ~20 MB de cache de páginas
+    "PRAGMA mmap_size=268435456",   # até 256 MB mapeados em memória
+    "PRAGMA busy_timeout=5000",     # espera até 5 s por um lock
+)
 
 # Caminho do banco de dados (pasta persistente)
+_db_path = None
 
 
 def get_db_path():
-    if getattr(sys, 'frozen', False):  # executável (PyInstaller)
-        base_dir = os.path.join(os.environ.get(
-            "APPDATA", os.path.expanduser("~")), "TesteImagensApp")
-    else:
-        base_dir = os.path.abspath(".")
-    os.makedirs(base_dir, exist_ok=True)
-    return os.path.join(base_dir, "testes.db")
+    global _db_path
+    if _db_path is None:
+        if getattr(sys, 'frozen', False):  # executável (PyInstaller)
+            base_dir = os.path.join(os.environ.get(
+                "APPDATA", os.path.expanduser("~")), "TesteImagensApp")
+        else:
+            base_dir = os.path.abspath(".")
+        os.makedirs(base_dir, exist_ok=True)
+        _db_path = os.path.join(base_dir, "testes.db")
+    return _db_path
+
+
+# Usa outro arquivo de banco (ex.: linha de comando com --banco).
+# Chame antes da primeira conexão.
+def definir_db_path(caminho):
+    global _db_path
+    _db_path = os.path.abspath(caminho)
+
 
+# Usa outro arquivo na pasta padrão do programa (ex.: a réplica das estações
+# ligadas a um servidor). Só antes da primeira conexão do processo.
+def definir_nome_banco(nome):
+    if _conectou:
+        raise RuntimeError(f"O banco já está aberto; não dá mais para trocar para {nome}")
+    definir_db_path(os.path.join(os.path.dirname(get_db_path()), nome))
 
-# Função para conectar ao banco
+
+# Uma conexão por thread, reaproveitada enquanto a thread existir
+_local = threading.local()
+_conectou = False  # alguma conexão já foi aberta neste processo
+
+
+# Função para conectar ao banco. Devolve a conexão da thread atual
+# (não feche: use fechar_conexao() ao encerrar a thread, se preciso).
 def conectar():
-    return sqlite3.connect(get_db_path())
+    global _conectou
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        _conectou = True
+        with medir("db.conectar"):
+            conn = sqlite3.connect(get_db_path())
+            for pragma in PRAGMAS:
+                conn.execute(pragma)
+        _local.conn = conn
+    return conn
+
+
+# Fecha a conexão da thread atual (a próxima chamada a conectar() reabre)
+def fechar_conexao():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
+
+
+# Transação: commit ao sair do bloco, rollback se houver exceção.
+# Não aninhe: um bloco interno faria commit do externo.
+@contextmanager
+def transacao():
+    conn = conectar()
+    with conn:
+        yield conn
 
 
 # Criação das tabelas
 def criar_tabelas():
-    conn = conectar()
+    with transacao() as conn:
+        migrou = _criar_tabelas(conn)
+    if migrou:
+        # Devolve ao disco o espaço da tabela antiga
+        conectar().execute("VACUUM")
+
+
+def _criar_tabelas(conn):
     cursor = conn.cursor()
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS testes (
@@ -32,65 +109,714 @@ def criar_tabelas():
         descricao TEXT
     )
     """)
+    # Configuração do sorteio (ver sorteio.py); NULL = padrão
+    _adicionar_coluna(cursor, "testes", "num_questoes", "INTEGER")
+    _adicionar_coluna(cursor, "testes", "proporcao_ok", "REAL")
+    # Bytes das imagens, endereçados pelo SHA-256: a mesma foto usada em
+    # vários testes é guardada uma vez só. `referencias` conta as linhas de
+    # imagens que apontam para o conteúdo (mantido pelos gatilhos abaixo).
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS conteudos (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        hash TEXT UNIQUE NOT NULL,
+        dados BLOB NOT NULL,
+        tamanho INTEGER NOT NULL,
+        referencias INTEGER NOT NULL DEFAULT 0
+    )
+    """)
     cursor.execute("""
     CREATE TABLE IF NOT EXISTS imagens (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         teste_id INTEGER NOT NULL,
         nome_arquivo TEXT NOT NULL,
-        imagem BLOB NOT NULL,
+        hash TEXT NOT NULL REFERENCES conteudos(hash),
         resposta_correta TEXT CHECK(resposta_correta IN ('OK', 'NOK')),
         FOREIGN KEY (teste_id) REFERENCES testes(id) ON DELETE CASCADE
     )
     """)
-    conn.commit()
-    conn.close()
+    migrou = _migrar_imagens_para_conteudos(conn)
+    # Listagem/sorteio por teste (cobre id, nome e resposta) e busca por hash
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_imagens_teste
+    ON imagens(teste_id, resposta_correta, nome_arquivo)
+    """)
+    # Listagem paginada do administrador, em ordem de nome
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_imagens_teste_nome ON imagens(teste_id, nome_arquivo)
+    """)
+    # O sorteio usa o idx_imagens_teste; este índice era um prefixo dele
+    cursor.execute("DROP INDEX IF EXISTS idx_imagens_sorteio")
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_imagens_hash ON imagens(hash)
+    """)
+    # Arquivo original guardado junto da versão normalizada (opcional, ver
+    # normalizacao.py); some junto com o conteúdo a que pertence
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS originais (
+        hash TEXT PRIMARY KEY REFERENCES conteudos(hash) ON DELETE CASCADE,
+        dados BLOB NOT NULL,
+        tamanho INTEGER NOT NULL
+    )
+    """)
+    # Hash perceptual de cada conteúdo, para achar fotos quase iguais (ver
+    # semelhanca.py). O dhash é dividido em 4 bandas de 16 bits, cada uma
+    # indexada: fotos parecidas têm pelo menos uma banda quase igual.
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS assinaturas (
+        hash TEXT PRIMARY KEY REFERENCES conteudos(hash) ON DELETE CASCADE,
+        dhash INTEGER NOT NULL,
+        ahash INTEGER NOT NULL,
+        banda0 INTEGER NOT NULL,
+        banda1 INTEGER NOT NULL,
+        banda2 INTEGER NOT NULL,
+        banda3 INTEGER NOT NULL,
+        cinza BLOB
+    )
+    """)
+    # Miniatura em cinza que confirma as candidatas do dhash (NULL nas
+    # assinaturas antigas: semelhanca.py completa quando precisa)
+    _adicionar_coluna(cursor, "assinaturas", "cinza", "BLOB")
+    for banda in range(4):
+        cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_assinaturas_banda{banda} ON assinaturas(banda{banda})
+        """)
 
+    # Contagem de referências; o conteúdo sem referências é apagado na hora
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS conteudos_ref_inserida
+    AFTER INSERT ON imagens BEGIN
+        UPDATE conteudos SET referencias = referencias + 1 WHERE hash = NEW.hash;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS conteudos_ref_excluida
+    AFTER DELETE ON imagens BEGIN
+        UPDATE conteudos SET referencias = referencias - 1 WHERE hash = OLD.hash;
+        DELETE FROM conteudos WHERE hash = OLD.hash AND referencias <= 0;
+    END
+    """)
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS conteudos_ref_substituida
+    AFTER UPDATE OF hash ON imagens WHEN NEW.hash <> OLD.hash BEGIN
+        UPDATE conteudos SET referencias = referencias + 1 WHERE hash = NEW.hash;
+        UPDATE conteudos SET referencias = referencias - 1 WHERE hash = OLD.hash;
+        DELETE FROM conteudos WHERE hash = OLD.hash AND referencias <= 0;
+    END
+    """)
 
-# Adiciona imagem ao banco
-def adicionar_imagem(teste_id, caminho, resposta_correta):
-    with open(caminho, "rb") as f:
-        imagem_blob = f.read()
-    nome_arquivo = os.path.basename(caminho)
+    # Histórico das sessões de teste e das respostas de cada questão.
+    # Sobrevive à exclusão do teste/imagem (guarda o nome do arquivo).
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS sessoes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        teste_id INTEGER REFERENCES testes(id) ON DELETE SET NULL,
+        avaliador TEXT,
+        operador TEXT NOT NULL,
+        matricula TEXT,
+        turno TEXT,
+        iniciado_em TEXT NOT NULL,
+        finalizado_em TEXT NOT NULL,
+        acertos INTEGER NOT NULL,
+        total INTEGER NOT NULL
+    )
+    """)
+    # Semente do sorteio das questões, para repetir a sessão numa auditoria;
+    # ponderado = 0 quando o sorteio não usou o histórico de erros (estações
+    # com réplica, ver replica.py)
+    _adicionar_coluna(cursor, "sessoes", "semente", "INTEGER")
+    _adicionar_coluna(cursor, "sessoes", "ponderado", "INTEGER NOT NULL DEFAULT 1")
+    # Quantas questões (e quantas OK) o sorteio tirou e o maior id de imagem
+    # que ele considerou: a auditoria não depende da configuração atual do teste
+    _adicionar_coluna(cursor, "sessoes", "sorteadas", "INTEGER")
+    _adicionar_coluna(cursor, "sessoes", "sorteadas_ok", "INTEGER")
+    _adicionar_coluna(cursor, "sessoes", "ate_imagem", "INTEGER")
+    # Identificador gerado na estação: o reenvio da mesma sessão não duplica
+    _adicionar_coluna(cursor, "sessoes", "uid", "TEXT")
+    cursor.execute("""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_sessoes_uid ON sessoes(uid)
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS respostas (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        sessao_id INTEGER NOT NULL REFERENCES sessoes(id) ON DELETE CASCADE,
+        ordem INTEGER NOT NULL,
+        imagem_id INTEGER,
+        nome_arquivo TEXT NOT NULL,
+        resposta TEXT NOT NULL,
+        resposta_correta TEXT NOT NULL,
+        correta INTEGER NOT NULL,
+        tempo_ms INTEGER
+    )
+    """)
+    # Agregações por operador, por teste e por imagem
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sessoes_matricula ON sessoes(matricula, finalizado_em)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_sessoes_teste ON sessoes(teste_id, finalizado_em)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_respostas_sessao ON respostas(sessao_id)
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_respostas_imagem ON respostas(imagem_id, correta)
+    """)
 
-    conn = conectar()
+    _criar_versoes(cursor)
+
+    # Réplica das estações (ver replica.py): estado da sincronização e
+    # sessões ainda não enviadas ao servidor
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS replica_estado (
+        chave TEXT PRIMARY KEY,
+        valor TEXT
+    )
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS envios_pendentes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dados TEXT NOT NULL,
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        ultimo_erro TEXT,
+        criado_em REAL NOT NULL
+    )
+    """)
+    # Sessão que o servidor recusou (ou que falhou demais): fica guardada,
+    # mas sai da fila de envio (ver replica.py)
+    _adicionar_coluna(cursor, "envios_pendentes", "recusado_em", "REAL")
+
+    # Pedidos de relatório ainda não gerados (ver relatorios.py)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS relatorios_pendentes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        dados TEXT NOT NULL,
+        tentativas INTEGER NOT NULL DEFAULT 0,
+        ultimo_erro TEXT,
+        criado_em REAL NOT NULL
+    )
+    """)
+
+    # Cache das imagens redimensionadas (ver miniaturas.py), por conteúdo
+    colunas = [c[1] for c in cursor.execute("PRAGMA table_info(miniaturas)")]
+    if colunas and "formato" not in colunas:  # esquema antigo; é só cache
+        cursor.execute("DROP TRIGGER IF EXISTS miniaturas_imagem_excluida")
+        cursor.execute("DROP TRIGGER IF EXISTS miniaturas_imagem_substituida")
+        cursor.execute("DROP TABLE miniaturas")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS miniaturas (
+        hash TEXT NOT NULL,
+        largura INTEGER NOT NULL,
+        altura INTEGER NOT NULL,
+        ajustar INTEGER NOT NULL DEFAULT 0,
+        formato TEXT NOT NULL DEFAULT 'PNG',
+        dados BLOB NOT NULL,
+        tamanho INTEGER NOT NULL,
+        acessado_em REAL NOT NULL,
+        PRIMARY KEY (hash, largura, altura, ajustar, formato)
+    )
+    """)
+    cursor.execute("""
+    CREATE INDEX IF NOT EXISTS idx_miniaturas_acesso ON miniaturas(acessado_em)
+    """)
+    # Invalida as miniaturas quando o conteúdo deixa de existir
+    cursor.execute("""
+    CREATE TRIGGER IF NOT EXISTS miniaturas_conteudo_excluido
+    AFTER DELETE ON conteudos BEGIN
+        DELETE FROM miniaturas WHERE hash = OLD.hash;
+    END
+    """)
+    return migrou
+
+
+# Versões para a sincronização das réplicas: toda inclusão ou alteração em
+# testes/imagens recebe o próximo número de versao_banco, e toda exclusão
+# deixa um registro em exclusoes com o seu número. Quem já tem tudo até a
+# versão V só precisa do que tem versão maior que V (ver alteracoes_desde).
+def _criar_versoes(cursor):
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS versao_banco (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        versao INTEGER NOT NULL
+    )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO versao_banco (id, versao) VALUES (1, 0)")
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS exclusoes (
+        versao INTEGER PRIMARY KEY,
+        tabela TEXT NOT NULL,
+        registro_id INTEGER NOT NULL
+    )
+    """)
+    colunas = {
+        "testes": "nome, descricao, num_questoes, proporcao_ok",
+        "imagens": "teste_id, nome_arquivo, hash, resposta_correta",
+    }
+    for tabela, alteraveis in colunas.items():
+        _adicionar_coluna(cursor, tabela, "versao", "INTEGER NOT NULL DEFAULT 0")
+        _adicionar_coluna(cursor, tabela, "atualizado_em", "TEXT")
+        cursor.execute(f"""
+        CREATE INDEX IF NOT EXISTS idx_{tabela}_versao ON {tabela}(versao)
+        """)
+        marcar = f"""
+            UPDATE versao_banco SET versao = versao + 1;
+            UPDATE {tabela} SET versao = (SELECT versao FROM versao_banco),
+                                atualizado_em = datetime('now', 'localtime')
+            WHERE id = NEW.id;
+        """
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS versao_{tabela}_inserido
+        AFTER INSERT ON {tabela} BEGIN {marcar} END
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS versao_{tabela}_alterado
+        AFTER UPDATE OF {alteraveis} ON {tabela} BEGIN {marcar} END
+        """)
+        cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS versao_{tabela}_excluido
+        AFTER DELETE ON {tabela} BEGIN
+            UPDATE versao_banco SET versao = versao + 1;
+            INSERT INTO exclusoes (versao, tabela, registro_id)
+            SELECT versao, '{tabela}', OLD.id FROM versao_banco;
+        END
+        """)
+
+
+# Acrescenta a coluna se o banco foi criado antes dela existir
+def _adicionar_coluna(cursor, tabela, coluna, definicao):
+    colunas = [c[1] for c in cursor.execute(f"PRAGMA table_info({tabela})")]
+    if coluna not in colunas:
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN {coluna} {definicao}")
+
+
+# Bancos antigos guardam os bytes em imagens.imagem: move cada BLOB para
+# conteudos (sem duplicar) e recria imagens apontando para o hash.
+def _migrar_imagens_para_conteudos(conn):
     cursor = conn.cursor()
+    colunas = [c[1] for c in cursor.execute("PRAGMA table_info(imagens)")]
+    if "imagem" not in colunas:
+        return False
+
+    if not conn.in_transaction:
+        cursor.execute("BEGIN")
+    cursor.execute("""
+    CREATE TABLE imagens_nova (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        teste_id INTEGER NOT NULL,
+        nome_arquivo TEXT NOT NULL,
+        hash TEXT NOT NULL REFERENCES conteudos(hash),
+        resposta_correta TEXT CHECK(resposta_correta IN ('OK', 'NOK')),
+        FOREIGN KEY (teste_id) REFERENCES testes(id) ON DELETE CASCADE
+    )
+    """)
+    ids = [row[0] for row in cursor.execute("SELECT id FROM imagens")]
+    for imagem_id in ids:
+        sha = hashlib.sha256()
+        with conn.blobopen("imagens", "imagem", imagem_id, readonly=True) as blob:
+            while True:
+                pedaco = blob.read(TAMANHO_PEDACO)
+                if not pedaco:
+                    break
+                sha.update(pedaco)
+        hash_conteudo = sha.hexdigest()
+        # A cópia dos bytes acontece dentro do SQLite
+        cursor.execute("""
+            INSERT OR IGNORE INTO conteudos (hash, dados, tamanho)
+            SELECT ?, imagem, length(imagem) FROM imagens WHERE id=?
+        """, (hash_conteudo, imagem_id))
+        cursor.execute("""
+            INSERT INTO imagens_nova (id, teste_id, nome_arquivo, hash, resposta_correta)
+            SELECT id, teste_id, nome_arquivo, ?, resposta_correta FROM imagens WHERE id=?
+        """, (hash_conteudo, imagem_id))
+    cursor.execute("DROP TABLE imagens")
+    cursor.execute("ALTER TABLE imagens_nova RENAME TO imagens")
     cursor.execute("""
-        INSERT INTO imagens (teste_id, nome_arquivo, resposta_correta, imagem)
-        VALUES (?, ?, ?, ?)
-    """, (teste_id, nome_arquivo, resposta_correta, imagem_blob))
-    conn.commit()
-    conn.close()
+        UPDATE conteudos SET referencias =
+            (SELECT COUNT(*) FROM imagens WHERE imagens.hash = conteudos.hash)
+    """)
+    return True
+
+
+# Hash usado como endereço do conteúdo
+def calcular_hash(dados):
+    return hashlib.sha256(dados).hexdigest()
+
+
+# O mesmo para um arquivo em disco, lido em pedaços
+def calcular_hash_arquivo(caminho):
+    h = hashlib.sha256()
+    with open(caminho, "rb") as f:
+        while True:
+            pedaco = f.read(TAMANHO_PEDACO)
+            if not pedaco:
+                break
+            h.update(pedaco)
+    return h.hexdigest()
+
+
+# Hash de uma fonte de conteúdo: bytes ou caminho de arquivo
+def _hash_fonte(fonte):
+    if isinstance(fonte, (bytes, bytearray)):
+        return calcular_hash(fonte)
+    return calcular_hash_arquivo(fonte)
+
+
+# Grava um arquivo do disco em conteudos ou originais sem lê-lo inteiro:
+# reserva o espaço com zeroblob e copia em pedaços pelo handle incremental.
+# Não faz nada se o hash já existe; se o arquivo mudou depois do hash
+# calculado, levanta ValueError (a transação desfaz a linha).
+def _gravar_arquivo(conn, tabela, hash_conteudo, caminho):
+    tamanho = os.path.getsize(caminho)
+    cursor = conn.execute(f"""
+        INSERT OR IGNORE INTO {tabela} (hash, dados, tamanho) VALUES (?, zeroblob(?), ?)
+    """, (hash_conteudo, tamanho, tamanho))
+    if cursor.rowcount == 0:
+        return
+    h = hashlib.sha256()
+    with conn.blobopen(tabela, "dados", cursor.lastrowid) as blob, open(caminho, "rb") as f:
+        while True:
+            pedaco = f.read(TAMANHO_PEDACO)
+            if not pedaco:
+                break
+            if blob.tell() + len(pedaco) > tamanho:
+                raise ValueError(f"{caminho} mudou durante a gravação")
+            blob.write(pedaco)
+            h.update(pedaco)
+    if h.hexdigest() != hash_conteudo:
+        raise ValueError(f"{caminho} mudou durante a gravação")
+
+
+# Grava pares (hash, fonte) em conteudos ou originais, sem repetir hash já
+# existente. Bytes vão num executemany; caminhos, por _gravar_arquivo.
+def _gravar_fontes(conn, tabela, fontes):
+    fontes = list(fontes)
+    conn.executemany(f"""
+        INSERT OR IGNORE INTO {tabela} (hash, dados, tamanho) VALUES (?, ?, ?)
+    """, ((hash_conteudo, fonte, len(fonte)) for hash_conteudo, fonte in fontes
+          if isinstance(fonte, (bytes, bytearray))))
+    for hash_conteudo, fonte in fontes:
+        if not isinstance(fonte, (bytes, bytearray)):
+            _gravar_arquivo(conn, tabela, hash_conteudo, fonte)
+
+
+# Grava em conteudos um arquivo que deve ter o hash dado (ex.: baixado pela
+# réplica), em pedaços; ValueError se não tiver. Não faz nada se já existe.
+def gravar_conteudo(hash_conteudo, caminho):
+    with transacao() as conn:
+        _gravar_arquivo(conn, "conteudos", hash_conteudo, caminho)
+
+
+# Adiciona imagem ao banco (o arquivo é copiado em pedaços, sem ser lido inteiro)
+def adicionar_imagem(teste_id, caminho, resposta_correta):
+    nome_arquivo = os.path.basename(caminho)
+    adicionar_imagens(teste_id, [(nome_arquivo, resposta_correta, caminho)])
+
+
+# Adiciona várias imagens numa única transação.
+# linhas: [(nome_arquivo, resposta_correta, bytes_da_imagem)], com dois
+# itens opcionais: os bytes do arquivo original, guardados em originais, e
+# a assinatura de semelhanca.calcular_assinatura, guardada em assinaturas.
+# A imagem e o original podem ser bytes ou o caminho de um arquivo, que é
+# gravado em pedaços (arquivos grandes não passam inteiros pela memória).
+# Conteúdo já existente no banco (mesmo hash) não é gravado de novo.
+@medido("db.adicionar_imagens")
+def adicionar_imagens(teste_id, linhas):
+    # Os hashes (que leem os arquivos) são calculados antes de abrir a transação
+    linhas = [(linha[0], linha[1], _hash_fonte(linha[2]), linha[2],
+               linha[3] if len(linha) > 3 else None,
+               linha[4] if len(linha) > 4 else None) for linha in linhas]
+    with transacao() as conn:
+        _gravar_fontes(conn, "conteudos", (
+            (hash_conteudo, dados) for _, _, hash_conteudo, dados, _, _ in linhas))
+        _gravar_fontes(conn, "originais", (
+            (hash_conteudo, original) for _, _, hash_conteudo, _, original, _ in linhas
+            if original is not None))
+        conn.executemany("""
+            INSERT OR IGNORE INTO assinaturas
+                (hash, dhash, ahash, banda0, banda1, banda2, banda3, cinza)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, ((hash_conteudo,) + tuple(assinatura)
+              for _, _, hash_conteudo, _, _, assinatura in linhas if assinatura is not None))
+        conn.executemany("""
+            INSERT INTO imagens (teste_id, nome_arquivo, resposta_correta, hash)
+            VALUES (?, ?, ?, ?)
+        """, ((teste_id, nome, resposta, hash_conteudo) for nome, resposta, hash_conteudo, _, _, _ in linhas))
+
+
+# Grava uma sessão de teste e todas as respostas numa única transação.
+# sessao: dicionário com teste_id, avaliador, operador, matricula, turno,
+#         iniciado_em, finalizado_em ('AAAA-MM-DD HH:MM:SS'), acertos, total
+#         e, opcionais, semente, sorteadas, sorteadas_ok, ate_imagem e ponderado
+#         (ver sorteio.py) e uid (ver replica.py)
+# respostas: [(imagem_id, nome_arquivo, resposta, resposta_correta, tempo_ms)]
+# Retorna o id da sessão (o da já gravada, se o uid se repetir).
+@medido("db.registrar_sessao")
+def registrar_sessao(sessao, respostas):
+    sessao = dict(sessao, semente=sessao.get("semente"), sorteadas=sessao.get("sorteadas"),
+                  sorteadas_ok=sessao.get("sorteadas_ok"), ate_imagem=sessao.get("ate_imagem"),
+                  ponderado=sessao.get("ponderado", 1), uid=sessao.get("uid"))
+    with transacao() as conn:
+        if sessao["uid"]:
+            row = conn.execute(
+                "SELECT id FROM sessoes WHERE uid=?", (sessao["uid"],)).fetchone()
+            if row:
+                return row[0]  # reenvio de uma sessão já registrada
+        cursor = conn.execute("""
+            INSERT INTO sessoes (teste_id, avaliador, operador, matricula, turno,
+                                 iniciado_em, finalizado_em, acertos, total, semente,
+                                 sorteadas, sorteadas_ok, ate_imagem, ponderado, uid)
+            VALUES ((SELECT id FROM testes WHERE id = :teste_id),  -- NULL se já excluído
+                    :avaliador, :operador, :matricula, :turno,
+                    :iniciado_em, :finalizado_em, :acertos, :total, :semente,
+                    :sorteadas, :sorteadas_ok, :ate_imagem, :ponderado, :uid)
+        """, sessao)
+        sessao_id = cursor.lastrowid
+        conn.executemany("""
+            INSERT INTO respostas (sessao_id, ordem, imagem_id, nome_arquivo,
+                                   resposta, resposta_correta, correta, tempo_ms)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, ((sessao_id, ordem, imagem_id, nome, resposta, correta,
+               int(resposta == correta), tempo_ms)
+              for ordem, (imagem_id, nome, resposta, correta, tempo_ms) in enumerate(respostas, 1)))
+    return sessao_id
 
 
 # Lista as imagens de um teste
+@medido("db.listar_imagens")
 def listar_imagens(teste_id):
     conn = conectar()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT id, nome_arquivo, resposta_correta FROM imagens WHERE teste_id=?
     """, (teste_id,))
-    imagens = cursor.fetchall()
-    conn.close()
-    return imagens
+    return cursor.fetchall()
+
+
+# Condição de busca por nome (trecho, sem diferenciar maiúsculas) e resposta
+def _filtro_imagens(teste_id, busca, resposta):
+    condicoes, params = ["teste_id = ?"], [teste_id]
+    if busca:
+        condicoes.append("nome_arquivo LIKE ? ESCAPE '\\'")
+        params.append(f"%{_escapar_like(busca)}%")
+    if resposta:
+        condicoes.append("resposta_correta = ?")
+        params.append(resposta)
+    return condicoes, params
+
+
+def _escapar_like(texto):
+    return texto.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+# Uma página de imagens de um teste, em ordem de nome: (id, nome_arquivo,
+# resposta_correta). Paginação por chave: `depois` é o (nome_arquivo, id)
+# da última linha da página anterior, então cada página custa o mesmo
+# não importa quão longe se está na lista.
+@medido("db.listar_imagens_pagina")
+def listar_imagens_pagina(teste_id, depois=None, limite=200, busca="", resposta=None):
+    condicoes, params = _filtro_imagens(teste_id, busca, resposta)
+    if depois:
+        condicoes.append("(nome_arquivo, id) > (?, ?)")
+        params.extend(depois)
+    return conectar().execute(f"""
+        SELECT id, nome_arquivo, resposta_correta FROM imagens
+        WHERE {" AND ".join(condicoes)}
+        ORDER BY nome_arquivo, id LIMIT ?
+    """, params + [limite]).fetchall()
+
+
+# Quantas imagens passam no mesmo filtro de listar_imagens_pagina
+@medido("db.contar_imagens")
+def contar_imagens(teste_id, busca="", resposta=None):
+    condicoes, params = _filtro_imagens(teste_id, busca, resposta)
+    return conectar().execute(
+        f"SELECT COUNT(*) FROM imagens WHERE {' AND '.join(condicoes)}", params).fetchone()[0]
+
+
+# Uma página de testes em ordem de nome: (id, nome, descricao).
+# `depois` é o nome do último teste da página anterior.
+@medido("db.listar_testes_pagina")
+def listar_testes_pagina(depois=None, limite=200, busca=""):
+    condicoes, params = [], []
+    if busca:
+        condicoes.append("nome LIKE ? ESCAPE '\\'")
+        params.append(f"%{_escapar_like(busca)}%")
+    if depois is not None:
+        condicoes.append("nome > ?")
+        params.append(depois)
+    where = "WHERE " + " AND ".join(condicoes) if condicoes else ""
+    return conectar().execute(f"""
+        SELECT id, nome, descricao FROM testes {where} ORDER BY nome LIMIT ?
+    """, params + [limite]).fetchall()
 
 
-# Extrai imagem temporariamente (para exibir no teste)
+@medido("db.contar_testes")
+def contar_testes(busca=""):
+    if not busca:
+        return conectar().execute("SELECT COUNT(*) FROM testes").fetchone()[0]
+    return conectar().execute(
+        "SELECT COUNT(*) FROM testes WHERE nome LIKE ? ESCAPE '\\'",
+        (f"%{_escapar_like(busca)}%",)).fetchone()[0]
+
+
+# Alterações em testes e imagens com versão maior que `desde` (-1: tudo),
+# para a sincronização das réplicas. Os testes e as exclusões de testes vêm
+# sempre completos (são poucos e as imagens dependem deles); as imagens e as
+# exclusões de imagens vêm em ordem de versão, no máximo `limite`.
+# Retorna {"versao": até onde a resposta cobre, "mais": se faltou algo,
+#          "testes": [(id, nome, descricao, num_questoes, proporcao_ok)],
+#          "testes_excluidos": [id],
+#          "imagens": [(versao, id, teste_id, nome_arquivo, hash, resposta_correta)],
+#          "imagens_excluidas": [(versao, id)]}
+def alteracoes_desde(desde, limite=500):
+    conn = conectar()
+    conn.execute("BEGIN")  # leitura num único instante do banco
+    try:
+        versao = conn.execute("SELECT versao FROM versao_banco").fetchone()[0]
+        testes = conn.execute("""
+            SELECT id, nome, descricao, num_questoes, proporcao_ok FROM testes
+            WHERE versao > ? ORDER BY versao
+        """, (desde,)).fetchall()
+        testes_excluidos = [row[0] for row in conn.execute("""
+            SELECT registro_id FROM exclusoes WHERE versao > ? AND tabela = 'testes'
+        """, (desde,))]
+        imagens = conn.execute("""
+            SELECT versao, id, teste_id, nome_arquivo, hash, resposta_correta FROM imagens
+            WHERE versao > ? ORDER BY versao LIMIT ?
+        """, (desde, limite + 1)).fetchall()
+        imagens_excluidas = conn.execute("""
+            SELECT versao, registro_id FROM exclusoes WHERE versao > ? AND tabela = 'imagens'
+            ORDER BY versao LIMIT ?
+        """, (desde, limite + 1)).fetchall()
+    finally:
+        conn.commit()
+
+    # As duas listas de imagens juntas, cortadas no limite pela versão
+    juntas = sorted([(v, 0) for v, *_ in imagens] + [(v, 1) for v, _ in imagens_excluidas])
+    mais = len(juntas) > limite
+    if mais:
+        versao = juntas[limite - 1][0]
+        imagens = [i for i in imagens if i[0] <= versao]
+        imagens_excluidas = [e for e in imagens_excluidas if e[0] <= versao]
+    return {"versao": versao, "mais": mais, "testes": testes,
+            "testes_excluidos": testes_excluidos, "imagens": imagens,
+            "imagens_excluidas": imagens_excluidas}
+
+
+# Hash do conteúdo de uma imagem (None se não existe)
+def obter_hash(imagem_id):
+    row = conectar().execute(
+        "SELECT hash FROM imagens WHERE id=?", (imagem_id,)).fetchone()
+    return row[0] if row else None
+
+
+# Lê o BLOB de uma única imagem (carregamento sob demanda)
+def carregar_imagem(imagem_id):
+    conn = conectar()
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT c.dados FROM imagens i JOIN conteudos c ON c.hash = i.hash
+        WHERE i.id=?
+    """, (imagem_id,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+
+# Handle de BLOB com readline, que o sqlite3.Blob não tem e o PIL usa ao
+# identificar alguns formatos (ex.: TIFF). O resto vai direto para o handle.
+class _LeitorBlob:
+    def __init__(self, blob):
+        self._blob = blob
+
+    def __getattr__(self, nome):
+        return getattr(self._blob, nome)
+
+    def __len__(self):
+        return len(self._blob)
+
+    def readline(self, limite=-1):
+        inicio = self._blob.tell()
+        linha = b""
+        while limite < 0 or len(linha) < limite:
+            pedaco = self._blob.read(256)
+            if not pedaco:
+                break
+            fim = pedaco.find(b"\n")
+            linha += pedaco if fim < 0 else pedaco[:fim + 1]
+            if fim >= 0:
+                break
+        if limite >= 0:
+            linha = linha[:limite]
+        self._blob.seek(inicio + len(linha))
+        return linha
+
+
+# Abre um handle incremental (somente leitura) para um conteúdo pelo hash.
+# O handle se comporta como arquivo (read/seek/tell), então dá para
+# decodificar direto dele, sem copiar o BLOB inteiro nem passar pelo disco.
+# Produz None se o conteúdo não existe.
+@contextmanager
+def abrir_blob_conteudo(hash_conteudo):
+    conn = conectar()
+    row = conn.execute(
+        "SELECT id FROM conteudos WHERE hash=?", (hash_conteudo,)).fetchone()
+    if not row:
+        yield None
+        return
+    with conn.blobopen("conteudos", "dados", row[0], readonly=True) as blob:
+        yield _LeitorBlob(blob)
+
+
+# O mesmo, a partir do id da imagem
+@contextmanager
+def abrir_blob_imagem(imagem_id):
+    with abrir_blob_conteudo(obter_hash(imagem_id)) as blob:
+        yield blob
+
+
+# Pasta temporária única do processo, apagada ao sair
+_pasta_temp = None
+
+
+def _obter_pasta_temp():
+    global _pasta_temp
+    if _pasta_temp is None:
+        _pasta_temp = tempfile.mkdtemp(prefix="testes_imagens_")
+        atexit.register(shutil.rmtree, _pasta_temp, ignore_errors=True)
+    return _pasta_temp
+
+
+# Extrai imagem para um arquivo temporário (só para quem precisa de um
+# caminho em disco; para exibir, prefira abrir_blob_imagem/carregar_imagem).
+# Os arquivos ficam numa única pasta, apagados ao sair, com o hash do
+# conteúdo no nome: são reaproveitados enquanto a imagem não muda, e uma
+# imagem substituída gera um arquivo novo.
 def extrair_imagem_temp(imagem_id):
     conn = conectar()
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT nome_arquivo, imagem FROM imagens WHERE id=?", (imagem_id,))
+    cursor.execute("SELECT nome_arquivo, hash FROM imagens WHERE id=?", (imagem_id,))
     row = cursor.fetchone()
-    conn.close()
 
     if not row:
         return None
+    nome_arquivo, hash_conteudo = row
+
+    caminho_temp = os.path.join(
+        _obter_pasta_temp(), f"{hash_conteudo}_{os.path.basename(nome_arquivo)}")
+    if os.path.exists(caminho_temp):
+        return caminho_temp
 
-    nome_arquivo, imagem_blob = row
-    temp_dir = tempfile.mkdtemp()
-    caminho_temp = os.path.join(temp_dir, nome_arquivo)
-    with open(caminho_temp, "wb") as f:
-        f.write(imagem_blob)
+    with abrir_blob_conteudo(hash_conteudo) as blob:
+        if blob is None:
+            return None
+        # Grava ao lado e renomeia: outra thread nunca acha o arquivo pela metade
+        parcial = f"{caminho_temp}.{threading.get_ident()}.parcial"
+        with open(parcial, "wb") as f:
+            while True:
+                pedaco = blob.read(TAMANHO_PEDACO)
+                if not pedaco:
+                    break
+                f.write(pedaco)
+    os.replace(parcial, caminho_temp)
     return caminho_temp
 
 
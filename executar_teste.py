@@ -1,117 +1,49 @@
 # executar_teste.py (compatível com banco interno)
-from reportlab.lib.utils import ImageReader
-from reportlab.lib.units import cm
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4
 import tkinter as tk
 from tkinter import messagebox
-from PIL import Image, ImageTk
-import random
-import pandas as pd
+from PIL import ImageTk
+import time
+import queue
+import logging
 import os
 import subprocess
 import platform
 from datetime import datetime
-from io import BytesIO
 
-from database import conectar, criar_tabelas
+from database import criar_tabelas
+from questoes import CarregadorQuestoes
+from lista_virtual import ListaVirtual
+from relatorios import obter_fila
+from backend import obter_backend, ErroServidor
+import medicoes
 
-NUM_QUESTOES = 10  # Número de questões por teste
+LATENCIA_ALVO_MS = 100  # Tempo máximo desejado entre o clique e a próxima imagem
+INTERVALO_AVISOS_MS = 500  # Frequência com que a tela confere relatórios prontos
 
+log = logging.getLogger(__name__)
 
-def gerar_pdf(nome_usuario, matricula, turno, acertos, porcentagem, erros_imagens, pasta_resultados=None, avaliador=None):
+
+def corrigir(questoes, respostas_usuario):
     """
-    erros_imagens: lista de tuples (nome_arquivo, resposta_usuario, resposta_correta, imagem_blob_bytes)
+    Corrige com o gabarito já carregado nas questões (por id da imagem),
+    sem voltar ao banco. Retorna (respostas, acertos), com respostas em
+    tuplas (imagem_id, nome_arquivo, resposta_usuario, resposta_correta).
     """
-    if pasta_resultados is None:
-        pasta_resultados = os.path.join(os.path.abspath("."), "resultados")
-    os.makedirs(pasta_resultados, exist_ok=True)
-
-    arquivo_pdf = os.path.join(
-        pasta_resultados,
-        f"resultado_{nome_usuario}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.pdf"
-    )
-
-    c = canvas.Canvas(arquivo_pdf, pagesize=A4)
-    largura, altura = A4
-
-    # Cabeçalho
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(2 * cm, altura - 2 * cm, "Relatório do Teste de Imagens")
-
-    c.setFont("Helvetica", 11)
-    c.drawString(2 * cm, altura - 3 * cm, f"Avaliador: {avaliador or ''}")
-    c.drawString(2 * cm, altura - 3.7 * cm, f"Nome: {nome_usuario}")
-    c.drawString(2 * cm, altura - 4.4 * cm, f"Matrícula: {matricula}")
-    c.drawString(2 * cm, altura - 5.1 * cm, f"Turno: {turno}")
-    c.drawString(2 * cm, altura - 5.8 * cm,
-                 f"Data: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
-
-    c.setFont("Helvetica-Bold", 12)
-    c.drawString(2 * cm, altura - 7 * cm, f"Acertos: {acertos}")
-    c.drawString(6 * cm, altura - 7 * cm, f"Porcentagem: {porcentagem:.2f}%")
-
-    # Espaço antes da seção de erros
-    y = altura - 8.5 * cm
-
-    if not erros_imagens:
-        c.setFont("Helvetica-Oblique", 11)
-        c.drawString(2 * cm, y, "Nenhuma imagem errada. Excelente desempenho!")
-        c.showPage()
-        c.save()
-        return arquivo_pdf
-
-    c.setFont("Helvetica-Bold", 13)
-    c.drawString(2 * cm, y, "Imagens incorretas")
-    y -= 1 * cm
-
-    # Para cada imagem errada, desenhar a miniatura e as legendas
-    thumb_max_w = 6.5 * cm
-    thumb_max_h = 5 * cm
-    gap_y = 0.6 * cm
-
-    for nome_arquivo, resposta_usuario, resposta_correta, imagem_blob in erros_imagens:
-        # Se não houver espaço vertical suficiente, cria nova página
-        if y < 4 * cm:
-            c.showPage()
-            y = altura - 2 * cm
-
-        # Colocar miniatura à esquerda
-        try:
-            img_reader = ImageReader(BytesIO(imagem_blob))
-            iw, ih = img_reader.getSize()
-            scale = min(thumb_max_w / iw, thumb_max_h / ih, 1.0)
-            w = iw * scale
-            h = ih * scale
-
-            x_img = 2 * cm
-            c.drawImage(img_reader, x_img, y - h, width=w, height=h,
-                        preserveAspectRatio=True, anchor='sw')
-        except Exception as e:
-            # Se falhar ao desenhar a imagem, apenas escreve o nome do arquivo
-            c.setFont("Helvetica-Oblique", 10)
-            c.drawString(
-                2 * cm, y, f"[Erro ao exibir miniatura] {nome_arquivo}")
-
-        # Texto à direita da miniatura (ou abaixo, caso miniatura falhe)
-        x_text = 2 * cm + thumb_max_w + 0.6 * cm
-        c.setFont("Helvetica", 10)
-        c.drawString(x_text, y - 0.5 * cm, f"Arquivo: {nome_arquivo}")
-        c.drawString(x_text, y - 1.2 * cm,
-                     f"Resposta do usuário: {resposta_usuario}")
-        c.drawString(x_text, y - 1.9 * cm,
-                     f"Resposta correta: {resposta_correta}")
-
-        # desce o ponteiro vertical
-        y -= (thumb_max_h + gap_y)
-
-    c.showPage()
-    c.save()
-    return arquivo_pdf
+    respostas = []
+    acertos = 0
+    for (img_id, nome_arquivo, resposta_correta), resposta in zip(questoes, respostas_usuario):
+        respostas.append((img_id, nome_arquivo, resposta, resposta_correta))
+        if resposta == resposta_correta:
+            acertos += 1
+    return respostas, acertos
 
 
 class TesteApp:
+    ativa = None  # Instância que recebe os avisos da fila de relatórios
+
     def __init__(self, root, voltar=None, avaliador=None):
+        # Antes do banco: com servidor, o backend escolhe o arquivo da réplica
+        self.backend = obter_backend()  # banco local ou servidor (SERVIDOR_TESTES)
         criar_tabelas()
         self.root = root
         self.voltar = voltar
@@ -124,11 +56,22 @@ class TesteApp:
         self.turno_var = tk.StringVar()
 
         self.teste_id = None
+        self.sorteio = None  # semente e parâmetros do sorteio (ver sorteio.py)
+        self.num_questoes = 0
         self.questoes = []
         self.index = 0
         self.respostas_usuario = []
-
+        self.tempos_resposta_ms = []  # imagem na tela -> clique, em ms
+        self.latencias_ms = []  # clique -> próxima imagem, em ms
+        self.marca_medicoes = 0  # início da sessão no buffer de medicoes
+        self.em_teste = False
+        self.status_relatorios = None
+
+        self.alteracoes_vistas = self.backend.alteracoes
+        self.fila_relatorios = obter_fila()
+        TesteApp.ativa = self
         self.tela_inicial()
+        self.verificar_relatorios()
 
     def centralizar_janela(self, largura, altura):
         self.root.update_idletasks()
@@ -152,9 +95,17 @@ class TesteApp:
         tk.Entry(self.root, textvariable=self.turno_var).pack()
 
         tk.Label(self.root, text="Selecione o teste:").pack()
-        self.lista_testes = tk.Listbox(self.root)
+        self.lista_testes = ListaVirtual(
+            self.root,
+            buscar_pagina=lambda ultimo, limite: self.backend.listar_testes_pagina(
+                ultimo[1] if ultimo else None, limite),
+            contar=self.backend.contar_testes,
+            formatar=lambda teste: f"{teste[0]} - {teste[1]}")
         self.lista_testes.pack(fill=tk.BOTH, expand=True)
-        self.carregar_testes()
+        try:
+            self.lista_testes.recarregar()
+        except ErroServidor as e:
+            messagebox.showerror("Erro", f"Não foi possível listar os testes: {e}")
 
         tk.Button(self.root, text="Iniciar Teste",
                   command=self.iniciar_teste).pack(pady=5)
@@ -163,59 +114,90 @@ class TesteApp:
             tk.Button(self.root, text="Voltar",
                       command=self.voltar).pack(pady=5)
 
-    def carregar_testes(self):
-        self.lista_testes.delete(0, tk.END)
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute("SELECT id, nome FROM testes ORDER BY nome")
-        for row in cursor.fetchall():
-            self.lista_testes.insert(tk.END, f"{row[0]} - {row[1]}")
-        conn.close()
+        self.status_relatorios = tk.Label(self.root, text="", fg="gray")
+        self.status_relatorios.pack()
 
     def iniciar_teste(self):
-        selecao = self.lista_testes.curselection()
-        if not selecao:
+        teste = self.lista_testes.selecionada()
+        if teste is None:
             messagebox.showerror("Erro", "Selecione um teste!")
             return
+        self.teste_id = teste[0]
+        self.marca_medicoes = medicoes.marca()
 
-        item = self.lista_testes.get(selecao[0])
-        self.teste_id, _ = item.split(" - ", 1)
-        self.teste_id = int(self.teste_id)
-
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT nome_arquivo, imagem, resposta_correta FROM imagens WHERE teste_id=?", (self.teste_id,))
-        imagens = cursor.fetchall()
-        conn.close()
+        # Só os metadados (id, nome, resposta); os BLOBs são lidos sob demanda.
+        # O sorteio (semente e parâmetros) e o início ficam na sessão, para
+        # refazer o mesmo sorteio depois
+        iniciado_em = datetime.now()
+        try:
+            questoes, self.sorteio = self.backend.sortear_questoes(
+                self.teste_id, historico_ate=iniciado_em.strftime("%Y-%m-%d %H:%M:%S"))
+        except ErroServidor as e:
+            messagebox.showerror("Erro", str(e))
+            return
 
-        if not imagens:
+        if not questoes:
             messagebox.showerror("Erro", "Este teste não possui imagens!")
             return
 
-        imgs_list = list(imagens)
-        random.shuffle(imgs_list)
-
-        # Monta as questões
-        self.questoes = imgs_list[:NUM_QUESTOES] if len(
-            imgs_list) >= NUM_QUESTOES else imgs_list * (NUM_QUESTOES // len(imgs_list) + 1)
-        self.questoes = self.questoes[:NUM_QUESTOES]
+        self.num_questoes = len(questoes)
+        self.questoes = CarregadorQuestoes(questoes)
 
         self.index = 0
         self.respostas_usuario = []
+        self.tempos_resposta_ms = []
+        self.latencias_ms = []
+        self.em_teste = True
+        self.iniciado_em = iniciado_em
         self.tela_questao()
 
+    def obter_imagem(self):
+        """
+        A PIL.Image da questão atual. Se a imagem foi apagada durante o teste
+        ou o servidor não a entregou, avisa e tira a questão do teste (a
+        correção e o total passam a ignorá-la). None quando não sobra questão.
+        """
+        while self.index < self.num_questoes:
+            try:
+                imagem = self.questoes.obter(self.index)
+            except ErroServidor as e:
+                imagem, motivo = None, str(e)
+            else:
+                motivo = "a imagem não existe mais no banco"
+            if imagem is not None:
+                return imagem
+            log.warning("Questão %d descartada: %s", self.index + 1, motivo)
+            messagebox.showwarning(
+                "Aviso", f"Não foi possível abrir a imagem da questão {self.index + 1}: "
+                f"{motivo}\nEla será ignorada neste teste.")
+            self.questoes.descartar(self.index)
+            self.num_questoes -= 1
+        return None
+
     def tela_questao(self):
+        """Mostra a questão atual; retorna False se o teste acabou antes dela."""
+        # A imagem já vem decodificada e redimensionada pela thread de trabalho;
+        # é obtida antes de limpar a tela, para não deixar a janela vazia se falhar
+        with medicoes.medir("tela_questao"):
+            imagem = self.obter_imagem()
+            if imagem is not None:
+                self.img_tk = ImageTk.PhotoImage(imagem)
+        if imagem is None:
+            self.questoes.encerrar()
+            if self.index == 0:
+                # Nenhuma questão respondida: não há sessão para registrar
+                self.em_teste = False
+                messagebox.showerror("Erro", "Nenhuma imagem deste teste pôde ser aberta.")
+                self.tela_inicial()
+            else:
+                self.finalizar_teste()
+            return False
+
         for widget in self.root.winfo_children():
             widget.destroy()
 
-        nome_arquivo, blob, _ = self.questoes[self.index]
-        imagem = Image.open(BytesIO(blob))
-        imagem = imagem.resize((400, 300), Image.LANCZOS)
-        self.img_tk = ImageTk.PhotoImage(imagem)
-
         tk.Label(
-            self.root, text=f"Questão {self.index+1} de {NUM_QUESTOES}").pack()
+            self.root, text=f"Questão {self.index+1} de {self.num_questoes}").pack()
         tk.Label(self.root, image=self.img_tk).pack()
 
         frame_btn = tk.Frame(self.root)
@@ -225,99 +207,138 @@ class TesteApp:
             "OK")).pack(side=tk.LEFT, padx=5)
         tk.Button(frame_btn, text="NOK", width=15, command=lambda: self.responder(
             "NOK")).pack(side=tk.LEFT, padx=5)
+        self.exibida_em = time.perf_counter()
+        return True
 
     def responder(self, resposta):
-        nome_arquivo, _, _ = self.questoes[self.index]
-        self.respostas_usuario.append((nome_arquivo, resposta))
+        inicio = time.perf_counter()
+        self.respostas_usuario.append(resposta)
+        self.tempos_resposta_ms.append(round((inicio - self.exibida_em) * 1000))
         self.index += 1
-        if self.index < NUM_QUESTOES:
-            self.tela_questao()
+        if self.index < self.num_questoes:
+            if self.tela_questao():
+                self.registrar_latencia(inicio)
         else:
+            self.questoes.encerrar()
             self.finalizar_teste()
 
-    def finalizar_teste(self):
-        conn = conectar()
-        cursor = conn.cursor()
-        cursor.execute(
-            "SELECT nome_arquivo, resposta_correta FROM imagens WHERE teste_id=?", (self.teste_id,))
-        respostas_certas = dict(cursor.fetchall())
-        conn.close()
-
-        acertos = 0
-        erros = []
-        for nome_arquivo, resposta in self.respostas_usuario:
-            if respostas_certas.get(nome_arquivo) == resposta:
-                acertos += 1
-            else:
-                # armazena tupla (nome, resposta_usuario)
-                erros.append((nome_arquivo, resposta))
+    def registrar_latencia(self, inicio):
+        """Guarda o tempo entre o clique e a próxima imagem na tela."""
+        latencia_ms = (time.perf_counter() - inicio) * 1000
+        self.latencias_ms.append(latencia_ms)
+        medicoes.registrar("latencia_questao", latencia_ms)
+        if latencia_ms > LATENCIA_ALVO_MS:
+            log.warning("Questão %d exibida em %.0f ms (alvo: %d ms)",
+                        self.index + 1, latencia_ms, LATENCIA_ALVO_MS)
 
-        porcentagem = (acertos / NUM_QUESTOES) * 100
+    def finalizar_teste(self):
+        respostas, acertos = corrigir(self.questoes, self.respostas_usuario)
+
+        porcentagem = (acertos / self.num_questoes) * 100
+        self.em_teste = False
+
+        finalizado_em = datetime.now()
+        sessao = dict(self.sorteio, **{
+            "teste_id": self.teste_id,
+            "avaliador": self.avaliador,
+            "operador": self.nome_var.get(),
+            "matricula": self.matricula_var.get(),
+            "turno": self.turno_var.get(),
+            "iniciado_em": self.iniciado_em.strftime("%Y-%m-%d %H:%M:%S"),
+            "finalizado_em": finalizado_em.strftime("%Y-%m-%d %H:%M:%S"),
+            "acertos": acertos,
+            "total": self.num_questoes,
+        })
+        try:
+            sessao_id = self.backend.registrar_sessao(
+                sessao, [r + (tempo,) for r, tempo in zip(respostas, self.tempos_resposta_ms)])
+        except ErroServidor as e:
+            # O resultado continua nos relatórios desta estação
+            sessao_id = None
+            messagebox.showwarning(
+                "Aviso", f"O resultado não foi registrado no servidor: {e}\n"
+                "O CSV e o PDF desta sessão serão gerados mesmo assim.")
 
+        # CSV e PDF são gerados em segundo plano; a próxima sessão já pode começar
         resultados_dir = os.path.join(os.path.abspath("."), "resultados")
-        os.makedirs(resultados_dir, exist_ok=True)
-        data_hora = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-        nome_csv = os.path.join(
-            resultados_dir, f"resultado_{self.nome_var.get()}_{data_hora}.csv")
-
-        df = pd.DataFrame({
-            "Avaliador": [self.avaliador]*len(self.respostas_usuario),
-            "Imagem": [r[0] for r in self.respostas_usuario],
-            "Resposta Usuario": [r[1] for r in self.respostas_usuario],
-            "Resposta Correta": [respostas_certas[r[0]] for r in self.respostas_usuario]
+        data_hora = finalizado_em.strftime("%Y-%m-%d_%H-%M-%S")
+        self.fila_relatorios.enviar({
+            "sessao_id": sessao_id,
+            "nome": self.nome_var.get(),
+            "matricula": self.matricula_var.get(),
+            "turno": self.turno_var.get(),
+            "avaliador": self.avaliador,
+            "acertos": acertos,
+            "porcentagem": porcentagem,
+            "respostas": respostas,
+            "data_hora": data_hora,
+            "pasta_resultados": resultados_dir,
         })
-        df.to_csv(nome_csv, index=False, sep=';', encoding='utf-8-sig')
-
-        # Monta lista com blobs das imagens erradas para o PDF
-        erros_imagens = []
-        if erros:
-            conn = conectar()
-            cursor = conn.cursor()
-            for nome_arquivo, resposta_usuario in erros:
-                cursor.execute("SELECT imagem, resposta_correta FROM imagens WHERE teste_id=? AND nome_arquivo=?",
-                               (self.teste_id, nome_arquivo))
-                row = cursor.fetchone()
-                if row:
-                    imagem_blob, resposta_correta = row  # observe que coluna imagem é o BLOB
-                    erros_imagens.append(
-                        (nome_arquivo, resposta_usuario, resposta_correta, imagem_blob))
-            conn.close()
-
-        arquivo_pdf = gerar_pdf(
-            nome_usuario=self.nome_var.get(),
-            matricula=self.matricula_var.get(),
-            turno=self.turno_var.get(),
-            acertos=acertos,
-            porcentagem=porcentagem,
-            erros_imagens=erros_imagens,
-            pasta_resultados=resultados_dir,
-            avaliador=self.avaliador
-        )
+
+        # Tempos medidos durante a sessão (ver medicoes.py), para quando o teste
+        # "fica lento"; o PDF desta sessão sai depois e entra no arquivo da próxima
+        try:
+            medicoes.exportar(
+                os.path.join(resultados_dir, "tempos", f"tempos_{data_hora}.jsonl"),
+                self.marca_medicoes, sessao_id=sessao_id, teste_id=self.teste_id,
+                matricula=self.matricula_var.get())
+        except OSError as e:
+            log.warning("Não foi possível gravar os tempos da sessão: %s", e)
 
         messagebox.showinfo(
             "Resultado",
-            f"Acertos: {acertos}\nErros: {NUM_QUESTOES - acertos}\nPorcentagem: {porcentagem:.2f}%\n\n"
-            f"CSV salvo em: {nome_csv}\nPDF salvo em: {arquivo_pdf}"
+            f"Acertos: {acertos}\nErros: {self.num_questoes - acertos}\nPorcentagem: {porcentagem:.2f}%\n\n"
+            f"Os relatórios (CSV e PDF) estão sendo gerados em: {resultados_dir}"
         )
 
-        # abre a pasta com resultados (mesmo código que você já tinha)
+        self.tela_inicial()
+
+    def verificar_relatorios(self):
+        """Mostra os avisos da fila de relatórios (roda na thread do Tk)."""
+        if TesteApp.ativa is not self:
+            return  # outra tela de teste assumiu os avisos
+        try:
+            while True:
+                _, dados, resultado, erro = self.fila_relatorios.notificacoes.get_nowait()
+                if erro:
+                    messagebox.showerror(
+                        "Erro", f"Não foi possível gerar o relatório de {dados['nome']}: {erro}\n"
+                        "O resultado ficou guardado no banco e o relatório será "
+                        "tentado de novo na próxima abertura do programa.")
+                else:
+                    self.relatorio_concluido(dados, resultado)
+        except queue.Empty:
+            pass
+        # A réplica recebeu testes novos/alterados: atualiza a lista
+        if self.backend.alteracoes != self.alteracoes_vistas and not self.em_teste:
+            self.alteracoes_vistas = self.backend.alteracoes
+            if self.lista_testes.winfo_exists():
+                self.lista_testes.recarregar()
+        self.root.after(INTERVALO_AVISOS_MS, self.verificar_relatorios)
+
+    def relatorio_concluido(self, dados, resultado):
+        _, arquivo_pdf = resultado
+        if self.status_relatorios is not None and self.status_relatorios.winfo_exists():
+            self.status_relatorios.config(
+                text=f"Relatório de {dados['nome']} salvo: {os.path.basename(arquivo_pdf)}")
+
+        # Abre a pasta com resultados, mas não no meio de um teste
+        if self.em_teste:
+            return
         try:
             sistema = platform.system()
             if sistema == "Windows":
-                os.startfile(resultados_dir)
+                os.startfile(dados["pasta_resultados"])
             elif sistema == "Darwin":
-                subprocess.Popen(["open", resultados_dir])
+                subprocess.Popen(["open", dados["pasta_resultados"]])
             else:
-                subprocess.Popen(["xdg-open", resultados_dir])
+                subprocess.Popen(["xdg-open", dados["pasta_resultados"]])
         except Exception as e:
             messagebox.showwarning(
                 "Aviso", f"Não foi possível abrir a pasta: {e}")
 
-        self.tela_inicial()
-
 
 if __name__ == "__main__":
-    criar_tabelas()
     root = tk.Tk()
     app = TesteApp(root)
     root.mainloop()
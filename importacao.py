@@ -0,0 +1,358 @@
+# importacao.py - importação de imagens em lote (pasta, .zip ou gabarito .csv)
+# e exportação das imagens de um teste no mesmo formato
+import os
+import csv
+import time
+import atexit
+import shutil
+import zipfile
+import tempfile
+from io import BytesIO, StringIO
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image
+
+from database import (conectar, adicionar_imagens, listar_imagens, abrir_blob_imagem,
+                      TAMANHO_PEDACO)
+from normalizacao import preparar_para_banco
+from semelhanca import (calcular_assinatura, imagens_semelhantes, indice_do_banco,
+                        IndiceSemelhanca)
+
+EXTENSOES = (".png", ".jpg", ".jpeg", ".tif", ".tiff")
+NOME_GABARITO = "gabarito.csv"  # Manifesto opcional dentro da pasta/zip
+TAMANHO_LOTE = 200  # Imagens por transação
+NUM_TRABALHADORES = 4  # Threads que leem e validam os arquivos
+# Arquivos maiores que isso (ex.: TIFF de microscópio) seguem pelo caminho,
+# sem serem lidos inteiros: o PIL lê do disco o que precisa e o banco grava
+# em pedaços. Os de um .zip são extraídos antes para uma pasta temporária.
+LIMITE_EM_MEMORIA = 16 * 1024 * 1024
+
+
+def _resposta_da_pasta(caminho):
+    """Usa o nome da pasta (OK/NOK) como resposta, se for o caso."""
+    pasta = os.path.basename(os.path.dirname(caminho)).upper()
+    return pasta if pasta in ("OK", "NOK") else None
+
+
+def _ler_gabarito(linhas):
+    """Lê 'arquivo;resposta' (ou com vírgula) e devolve {arquivo: resposta}."""
+    linhas = list(linhas)
+    delimitador = "," if linhas and ";" not in linhas[0] else ";"
+    gabarito = {}
+    for row in csv.reader(linhas, delimiter=delimitador):
+        if len(row) < 2:
+            continue
+        resposta = row[1].strip().upper()
+        if resposta in ("OK", "NOK"):
+            gabarito[row[0].strip().replace("\\", "/")] = resposta
+    return gabarito
+
+
+def _ler_arquivo(caminho):
+    """Os bytes do arquivo, ou o próprio caminho se for grande."""
+    if os.path.getsize(caminho) > LIMITE_EM_MEMORIA:
+        return caminho
+    with open(caminho, "rb") as f:
+        return f.read()
+
+
+_pasta_extracao = None
+
+
+def _obter_pasta_extracao():
+    global _pasta_extracao
+    if _pasta_extracao is None:
+        _pasta_extracao = tempfile.mkdtemp(prefix="testes_importacao_")
+        atexit.register(shutil.rmtree, _pasta_extracao, ignore_errors=True)
+    return _pasta_extracao
+
+
+def _ler_membro(arquivo_zip, info):
+    """Os bytes do membro do .zip, ou o caminho de uma cópia extraída se for grande."""
+    if info.file_size <= LIMITE_EM_MEMORIA:
+        return arquivo_zip.read(info)
+    fd, caminho = tempfile.mkstemp(dir=_obter_pasta_extracao(),
+                                   suffix=os.path.splitext(info.filename)[1])
+    with os.fdopen(fd, "wb") as destino, arquivo_zip.open(info) as origem:
+        shutil.copyfileobj(origem, destino, TAMANHO_PEDACO)
+    return caminho
+
+
+def _descartar(fonte):
+    """Apaga a fonte se for uma cópia extraída de um .zip."""
+    if isinstance(fonte, str) and _pasta_extracao and \
+            os.path.dirname(fonte) == _pasta_extracao:
+        try:
+            os.remove(fonte)
+        except OSError:
+            pass
+
+
+class ItensOrigem(list):
+    """
+    Lista de listar_origem. Os `ler()` de um .zip leem do arquivo aberto:
+    fechar() (ou o fim do bloco with) fecha o .zip quando a importação acaba.
+    """
+
+    def __init__(self, itens=(), arquivo_zip=None):
+        super().__init__(itens)
+        self.arquivo_zip = arquivo_zip
+
+    def fechar(self):
+        if self.arquivo_zip is not None:
+            self.arquivo_zip.close()
+            self.arquivo_zip = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *erro):
+        self.fechar()
+
+
+def listar_origem(caminho):
+    """
+    Lista as imagens de uma pasta, de um .zip ou de um gabarito .csv.
+    Devolve uma ItensOrigem de tuplas (nome_arquivo, resposta, ler), onde
+    `ler()` retorna os bytes do arquivo, ou um caminho em disco quando ele
+    passa de LIMITE_EM_MEMORIA. A resposta vem do gabarito (gabarito.csv
+    na pasta/zip, ou o próprio .csv informado), senão do nome da pasta
+    (OK/NOK); fica None quando não dá para saber.
+    """
+    itens = ItensOrigem()
+    if os.path.isdir(caminho):
+        gabarito = {}
+        caminho_gabarito = os.path.join(caminho, NOME_GABARITO)
+        if os.path.exists(caminho_gabarito):
+            with open(caminho_gabarito, encoding="utf-8-sig") as f:
+                gabarito = _ler_gabarito(f)
+        for pasta, _, arquivos in os.walk(caminho):
+            for nome in sorted(arquivos):
+                if not nome.lower().endswith(EXTENSOES):
+                    continue
+                completo = os.path.join(pasta, nome)
+                relativo = os.path.relpath(completo, caminho).replace("\\", "/")
+                resposta = gabarito.get(relativo) or gabarito.get(nome) \
+                    or _resposta_da_pasta(completo)
+                itens.append((nome, resposta,
+                              lambda c=completo: _ler_arquivo(c)))
+
+    elif zipfile.is_zipfile(caminho):
+        arquivo_zip = zipfile.ZipFile(caminho)
+        itens.arquivo_zip = arquivo_zip
+        gabarito = {}
+        if NOME_GABARITO in arquivo_zip.namelist():
+            try:
+                texto = arquivo_zip.read(NOME_GABARITO).decode("utf-8-sig")
+            except Exception:
+                itens.fechar()
+                raise
+            gabarito = _ler_gabarito(texto.splitlines())
+        for info in arquivo_zip.infolist():
+            membro = info.filename
+            if not membro.lower().endswith(EXTENSOES):
+                continue
+            nome = os.path.basename(membro)
+            resposta = gabarito.get(membro) or gabarito.get(nome) \
+                or _resposta_da_pasta(membro)
+            itens.append((nome, resposta,
+                          lambda i=info: _ler_membro(arquivo_zip, i)))
+
+    elif caminho.lower().endswith(".csv"):
+        base = os.path.dirname(os.path.abspath(caminho))
+        with open(caminho, encoding="utf-8-sig") as f:
+            gabarito = _ler_gabarito(f)
+        for relativo, resposta in gabarito.items():
+            completo = os.path.join(base, relativo)
+            itens.append((os.path.basename(relativo), resposta,
+                          lambda c=completo: _ler_arquivo(c)))
+    else:
+        raise ValueError(f"Origem não suportada: {caminho}")
+
+    return itens
+
+
+def _ler_e_validar(item, normalizar=None, guardar_original=None):
+    """
+    Lê, confere se é uma imagem válida, normaliza se pedido (ver
+    normalizacao.preparar_para_banco) e calcula a assinatura (ver
+    semelhanca.py). Retorna (linha, erro).
+    """
+    nome_arquivo, resposta, ler = item
+    fonte = None
+    try:
+        fonte = ler()
+        with Image.open(BytesIO(fonte) if isinstance(fonte, bytes) else fonte) as imagem:
+            imagem.verify()
+        dados, original = preparar_para_banco(fonte, normalizar, guardar_original)
+        assinatura = calcular_assinatura(dados)
+    except Exception as e:
+        _descartar(fonte)
+        return None, (nome_arquivo, str(e))
+    if fonte is not dados and fonte is not original:
+        _descartar(fonte)  # normalizada: a cópia extraída não vai para o banco
+    return (nome_arquivo, resposta, dados, original, assinatura), None
+
+
+def _procurar_semelhantes(teste_id, linha, indice_banco, indice_local, locais, ultimo_id):
+    """
+    Fotos já existentes (no banco ou antes nesta importação) parecidas com a
+    linha. Só avisa das do mesmo teste ou das que têm a resposta contrária.
+    `indice_banco` é o do banco no início da importação (indice_do_banco).
+    As dos lotes anteriores desta importação já estão no banco (id acima de
+    `ultimo_id`): são avisadas só pelo índice local, não duas vezes.
+    """
+    nome, resposta, _, _, assinatura = linha
+    avisos = []
+    for imagem_id, outro_teste, outro_nome, outra_resposta, d in imagens_semelhantes(
+            assinatura, indice=indice_banco):
+        if imagem_id > ultimo_id and outro_teste == teste_id:
+            continue
+        if outro_teste == teste_id or outra_resposta != resposta:
+            avisos.append((nome, outro_nome, outro_teste, outra_resposta, d))
+    for chave, d in indice_local.procurar(assinatura):
+        outro_nome, outra_resposta = locais[chave]
+        avisos.append((nome, outro_nome, teste_id, outra_resposta, d))
+    return avisos
+
+
+def importar_lote(teste_id, itens, progresso=None, normalizar=None, guardar_original=None,
+                  tamanho_lote=TAMANHO_LOTE, trabalhadores=NUM_TRABALHADORES):
+    """
+    Importa os itens de listar_origem para o teste. Os arquivos são lidos,
+    validados (e normalizados, com `normalizar`; None: o padrão de
+    normalizacao.py) em paralelo e gravados com executemany, uma transação por
+    lote; enquanto um lote é gravado, o próximo já está sendo lido.
+    `progresso(feitas, total)` é chamado a cada lote (na thread que chamou).
+    Itens sem resposta contam como erro. Retorna um dicionário com
+    importadas, erros [(nome, motivo)], semelhantes [(nome, nome_parecida,
+    teste_id, resposta_parecida, distância)], segundos e imagens_por_segundo.
+    As quase repetidas são importadas assim mesmo; `semelhantes` é só o aviso.
+    """
+    inicio = time.perf_counter()
+    total = len(itens)
+    importadas = 0
+    erros = [(nome, "resposta OK/NOK não informada")
+             for nome, resposta, _ in itens if resposta is None]
+    itens = [item for item in itens if item[1] is not None]
+    semelhantes = []
+    indice_local = IndiceSemelhanca()  # o que já foi importado nesta chamada
+    locais = {}  # chave do índice -> (nome, resposta)
+    ultimo_id = conectar().execute("SELECT COALESCE(MAX(id), 0) FROM imagens").fetchone()[0]
+    indice_banco = indice_do_banco()  # uma leitura só, em vez de uma busca por foto
+
+    with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+        pendentes = [executor.submit(_ler_e_validar, item, normalizar, guardar_original)
+                     for item in itens[:tamanho_lote]]
+        for inicio_lote in range(0, len(itens), tamanho_lote):
+            atuais = pendentes
+            proximos = itens[inicio_lote + tamanho_lote:
+                             inicio_lote + 2 * tamanho_lote]
+            pendentes = [executor.submit(_ler_e_validar, item, normalizar, guardar_original)
+                         for item in proximos]
+
+            linhas = []
+            for futuro in atuais:
+                linha, erro = futuro.result()
+                if erro:
+                    erros.append(erro)
+                else:
+                    linhas.append(linha)
+            for linha in linhas:
+                semelhantes.extend(_procurar_semelhantes(
+                    teste_id, linha, indice_banco, indice_local, locais, ultimo_id))
+                locais[len(locais)] = (linha[0], linha[1])
+                indice_local.adicionar(len(locais) - 1, linha[4])
+            try:
+                adicionar_imagens(teste_id, linhas)
+            finally:
+                for linha in linhas:
+                    _descartar(linha[2])
+                    _descartar(linha[3])
+            importadas += len(linhas)
+
+            if progresso:
+                progresso(len(erros) + importadas, total)
+
+    segundos = time.perf_counter() - inicio
+    return {
+        "importadas": importadas,
+        "erros": erros,
+        "semelhantes": semelhantes,
+        "segundos": segundos,
+        "imagens_por_segundo": importadas / segundos if segundos else 0.0,
+    }
+
+
+def _nome_exportado(nome_arquivo, imagem_id, usados):
+    """Nome do arquivo na exportação; repetidos no teste recebem o id."""
+    nome = os.path.basename(nome_arquivo.replace("\\", "/")) or f"{imagem_id}.jpg"
+    if nome.lower() in usados:
+        base, extensao = os.path.splitext(nome)
+        nome = f"{base}_{imagem_id}{extensao}"
+    usados.add(nome.lower())
+    return nome
+
+
+def _copiar_blob(blob, destino):
+    """Copia o handle do BLOB para o arquivo aberto, em pedaços. Retorna os bytes."""
+    total = 0
+    while True:
+        pedaco = blob.read(TAMANHO_PEDACO)
+        if not pedaco:
+            return total
+        destino.write(pedaco)
+        total += len(pedaco)
+
+
+def exportar_teste(teste_id, destino, progresso=None):
+    """
+    Grava as imagens do teste numa pasta ou, se `destino` termina em .zip,
+    num arquivo .zip, com um gabarito.csv (arquivo;resposta): o resultado
+    pode ser importado de volta com listar_origem. Cada imagem vai do BLOB
+    para o arquivo em pedaços, sem passar inteira pela memória.
+    `progresso(feitas, total)` é chamado a cada imagem. Retorna um
+    dicionário com exportadas, bytes e segundos.
+    """
+    inicio = time.perf_counter()
+    imagens = listar_imagens(teste_id)
+    gabarito = []
+    usados = {NOME_GABARITO}
+    total_bytes = 0
+    como_zip = destino.lower().endswith(".zip")
+    if como_zip:
+        # Fotos já são comprimidas: guardadas sem compressão, a exportação é só cópia
+        arquivo_zip = zipfile.ZipFile(destino, "w", zipfile.ZIP_STORED, allowZip64=True)
+    else:
+        os.makedirs(destino, exist_ok=True)
+    try:
+        for feitas, (imagem_id, nome_arquivo, resposta) in enumerate(imagens, 1):
+            nome = _nome_exportado(nome_arquivo, imagem_id, usados)
+            with abrir_blob_imagem(imagem_id) as blob:
+                if blob is None:
+                    continue  # apagada durante a exportação
+                if como_zip:
+                    with arquivo_zip.open(nome, "w", force_zip64=True) as saida:
+                        total_bytes += _copiar_blob(blob, saida)
+                else:
+                    with open(os.path.join(destino, nome), "wb") as saida:
+                        total_bytes += _copiar_blob(blob, saida)
+            gabarito.append((nome, resposta))
+            if progresso:
+                progresso(feitas, len(imagens))
+
+        texto = StringIO()
+        escritor = csv.writer(texto, delimiter=";", lineterminator="\n")
+        escritor.writerow(["arquivo", "resposta"])
+        escritor.writerows(gabarito)
+        texto = texto.getvalue()
+        if como_zip:
+            arquivo_zip.writestr(NOME_GABARITO, texto.encode("utf-8-sig"))
+        else:
+            with open(os.path.join(destino, NOME_GABARITO), "w", encoding="utf-8-sig") as f:
+                f.write(texto)
+    finally:
+        if como_zip:
+            arquivo_zip.close()
+    return {"exportadas": len(gabarito), "bytes": total_bytes,
+            "segundos": time.perf_counter() - inicio}
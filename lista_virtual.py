@@ -0,0 +1,222 @@
+# lista_virtual.py - Listbox que só monta as linhas visíveis, para listas grandes
+import bisect
+import tkinter as tk
+from tkinter import font as tkfont
+
+TAMANHO_PAGINA = 200  # Linhas buscadas no banco de cada vez
+ATRASO_BUSCA_MS = 300  # Pausa na digitação antes de refazer a busca
+
+
+class ListaVirtual(tk.Frame):
+    """
+    Lista com barra de rolagem para milhares de linhas. As linhas vêm do
+    banco em páginas, conforme a rolagem chega nelas, e o Listbox só recebe
+    as que cabem na tela.
+
+    buscar_pagina(ultima, limite): próximas `limite` linhas depois de
+        `ultima` (a última linha já carregada, ou None para a primeira página)
+    contar(): total de linhas (para o tamanho da barra de rolagem)
+    formatar(linha): texto exibido
+    ao_selecionar(linha): chamado quando a seleção muda
+    chave(linha): id da linha no banco (padrão: o primeiro campo)
+    ordem(linha): chave da ordenação das páginas (a mesma do ORDER BY);
+        com ela, atualizar() muda de lugar a linha cuja ordem mudou
+
+    As linhas ficam em `linhas`, na ordem da tela, e `posicoes` leva o id de
+    cada uma à sua posição; a seleção e as alterações usam esses dados,
+    nunca o texto exibido.
+    """
+
+    def __init__(self, master, buscar_pagina, contar, formatar, ao_selecionar=None,
+                 chave=lambda linha: linha[0], ordem=None, tamanho_pagina=TAMANHO_PAGINA,
+                 **kwargs):
+        super().__init__(master, **kwargs)
+        self.buscar_pagina = buscar_pagina
+        self.contar = contar
+        self.formatar = formatar
+        self.ao_selecionar = ao_selecionar
+        self.chave = chave
+        self.ordem = ordem
+        self.tamanho_pagina = tamanho_pagina
+
+        self.lista = tk.Listbox(self, exportselection=False, activestyle="none")
+        self._fonte = tkfont.Font(font=self.lista.cget("font"))
+        self.barra = tk.Scrollbar(self, orient=tk.VERTICAL, command=self._rolar)
+        self.barra.pack(side=tk.RIGHT, fill=tk.Y)
+        self.lista.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+
+        self.lista.bind("<Configure>", lambda e: self._ir_para(self.inicio))
+        self.lista.bind("<<ListboxSelect>>", self._clicou)
+        self.lista.bind("<MouseWheel>", lambda e: self._ir_para(
+            self.inicio - (3 if e.delta > 0 else -3)))
+        self.lista.bind("<Button-4>", lambda e: self._ir_para(self.inicio - 3))
+        self.lista.bind("<Button-5>", lambda e: self._ir_para(self.inicio + 3))
+        for tecla, passo in (("<Up>", -1), ("<Down>", 1)):
+            self.lista.bind(tecla, lambda e, p=passo: self._mover(p))
+        for tecla, paginas in (("<Prior>", -1), ("<Next>", 1)):
+            self.lista.bind(tecla, lambda e, p=paginas: self._mover(p * self._visiveis()))
+
+        self.linhas = []
+        self.posicoes = {}  # id -> posição em linhas
+        self.total = 0
+        self.inicio = 0  # posição da primeira linha visível
+        self.selecao = None  # posição da linha selecionada
+        self._fim = False  # já carregou até a última página
+        self._agendado = None
+
+    # ---- API ----
+
+    def recarregar(self):
+        """Volta ao início e busca de novo (depois de mudar o filtro)."""
+        self.total = self.contar()
+        self.linhas = []
+        self.posicoes = {}
+        self._fim = False
+        self.selecao = None
+        self.inicio = 0
+        self._ir_para(0)
+
+    def recarregar_em_breve(self, atraso_ms=ATRASO_BUSCA_MS):
+        """recarregar() depois de uma pausa (para ligar a um campo de busca)."""
+        if self._agendado:
+            self.after_cancel(self._agendado)
+        self._agendado = self.after(atraso_ms, self._recarregar_agendado)
+
+    def _recarregar_agendado(self):
+        self._agendado = None
+        self.recarregar()
+
+    def selecionada(self):
+        """Linha selecionada, ou None."""
+        return self.linhas[self.selecao] if self.selecao is not None else None
+
+    def atualizar(self, linha):
+        """
+        Troca a linha de mesmo id, se já carregada. Se a ordem dela mudou
+        (ex.: teste renomeado), a linha vai para o lugar novo: a última linha
+        carregada é o cursor da próxima página e não pode ficar fora de ordem.
+        """
+        indice = self.posicoes.get(self.chave(linha))
+        if indice is None:
+            return
+        if self.ordem is not None and self.ordem(linha) != self.ordem(self.linhas[indice]):
+            self._reposicionar(indice, linha)
+            return
+        self.linhas[indice] = linha
+        pos = indice - self.inicio
+        if 0 <= pos < self.lista.size():
+            self.lista.delete(pos)
+            self.lista.insert(pos, self.formatar(linha))
+            if indice == self.selecao:
+                self.lista.selection_set(pos)
+
+    def remover(self, id):
+        """Tira a linha desse id (ex.: excluída no banco) sem buscar a lista de novo."""
+        indice = self.posicoes.pop(id, None)
+        if indice is None:
+            return
+        del self.linhas[indice]
+        self._reindexar(indice)
+        self.total -= 1
+        if self.selecao == indice:
+            self.selecao = None
+        elif self.selecao is not None and self.selecao > indice:
+            self.selecao -= 1
+        self._ir_para(self.inicio)
+
+    # ---- interno ----
+
+    def _visiveis(self):
+        """Quantas linhas cabem na altura atual do Listbox."""
+        altura_linha = (self._fonte.metrics("linespace") + 1
+                        + 2 * int(self.lista.cget("selectborderwidth")))
+        borda = 2 * (int(self.lista.cget("borderwidth"))
+                     + int(self.lista.cget("highlightthickness")))
+        return max(1, (self.lista.winfo_height() - borda) // altura_linha)
+
+    def _reindexar(self, desde):
+        for posicao in range(desde, len(self.linhas)):
+            self.posicoes[self.chave(self.linhas[posicao])] = posicao
+
+    def _reposicionar(self, indice, linha):
+        """Tira a linha de `indice` e põe `linha` no lugar que a ordem dela manda."""
+        selecionada = None if self.selecao is None else self.chave(self.linhas[self.selecao])
+        del self.linhas[indice]
+        del self.posicoes[self.chave(linha)]
+        novo = bisect.bisect([self.ordem(outra) for outra in self.linhas], self.ordem(linha))
+        if novo < len(self.linhas) or self._fim:
+            self.linhas.insert(novo, linha)
+        # senão fica depois da última carregada: volta com a página em que cair
+        self._reindexar(min(indice, novo))
+        self.selecao = self.posicoes.get(selecionada)
+        if self.selecao is not None and not (
+                self.inicio <= self.selecao < self.inicio + self._visiveis()):
+            self._ir_para(self.selecao)
+        else:
+            self._ir_para(self.inicio)
+
+    def _garantir(self, quantidade):
+        """Carrega páginas até ter `quantidade` linhas (ou acabar)."""
+        while len(self.linhas) < quantidade and not self._fim:
+            pagina = self.buscar_pagina(self.linhas[-1] if self.linhas else None,
+                                        self.tamanho_pagina)
+            for linha in pagina:
+                self.posicoes[self.chave(linha)] = len(self.linhas)
+                self.linhas.append(linha)
+            if len(pagina) < self.tamanho_pagina:
+                self._fim = True
+                self.total = len(self.linhas)
+
+    def _ir_para(self, inicio):
+        visiveis = self._visiveis()
+        inicio = max(0, min(inicio, self.total - visiveis))
+        self._garantir(inicio + visiveis)
+        self.inicio = max(0, min(inicio, len(self.linhas) - visiveis))
+        self._desenhar(visiveis)
+
+    def _desenhar(self, visiveis):
+        self.lista.delete(0, tk.END)
+        janela = self.linhas[self.inicio:self.inicio + visiveis]
+        if janela:
+            self.lista.insert(tk.END, *(self.formatar(linha) for linha in janela))
+        if self.selecao is not None and 0 <= self.selecao - self.inicio < len(janela):
+            self.lista.selection_set(self.selecao - self.inicio)
+        if self.total:
+            self.barra.set(self.inicio / self.total,
+                           min(1.0, (self.inicio + visiveis) / self.total))
+        else:
+            self.barra.set(0, 1)
+
+    def _rolar(self, acao, quantidade, unidade=None):
+        if acao == "moveto":
+            self._ir_para(int(float(quantidade) * self.total))
+        elif unidade == "pages":
+            self._ir_para(self.inicio + int(quantidade) * self._visiveis())
+        else:
+            self._ir_para(self.inicio + int(quantidade))
+
+    def _selecionar(self, indice):
+        self.selecao = indice
+        if self.ao_selecionar:
+            self.ao_selecionar(self.linhas[indice])
+
+    def _clicou(self, event=None):
+        selecionado = self.lista.curselection()
+        if selecionado:
+            self._selecionar(self.inicio + selecionado[0])
+
+    def _mover(self, passo):
+        if not self.linhas:
+            return "break"
+        indice = 0 if self.selecao is None else self.selecao + passo
+        self._garantir(indice + 1)
+        indice = max(0, min(indice, len(self.linhas) - 1))
+        visiveis = self._visiveis()
+        if indice < self.inicio:
+            self._ir_para(indice)
+        elif indice >= self.inicio + visiveis:
+            self._ir_para(indice - visiveis + 1)
+        self.selecao = indice
+        self._desenhar(visiveis)
+        self._selecionar(indice)
+        return "break"
@@ -1,8 +1,11 @@
+import os
 import tkinter as tk
-from admin import AdminApp
-from executar_teste import TesteApp
+from tkinter import messagebox
 from database import resource_path  # função para achar arquivos no exe
 
+# admin e executar_teste (PIL, reportlab...) só são importados
+# quando a tela correspondente é aberta, para a janela inicial abrir rápido.
+
 
 class MainApp:
     def __init__(self, root):
@@ -38,6 +41,13 @@ class MainApp:
 
     def abrir_admin(self):
         """Abre a tela de administração."""
+        if os.environ.get("SERVIDOR_TESTES"):
+            # Estação ligada a um servidor.py: o banco local não é o usado nos testes
+            messagebox.showinfo(
+                "Administração", "Esta estação usa o servidor "
+                f"{os.environ['SERVIDOR_TESTES']}.\nO cadastro é feito no PC do servidor.")
+            return
+        from admin import AdminApp
         self.limpar_tela()
         AdminApp(self.root, voltar=self.abrir_tela_inicial)
 
@@ -60,12 +70,18 @@ class MainApp:
     def abrir_teste(self):
         avaliador = self.avaliador_var.get().strip()
         if not avaliador:
-            tk.messagebox.showerror("Erro", "Informe o nome do avaliador!")
+            messagebox.showerror("Erro", "Informe o nome do avaliador!")
             return
+        from executar_teste import TesteApp
         TesteApp(self.root, voltar=self.abrir_tela_inicial, avaliador=avaliador)
 
 
 if __name__ == "__main__":
+    from medicoes import iniciar_perfil
+    iniciar_perfil()  # só com PERFIL_TESTES
     root = tk.Tk()
     app = MainApp(root)
+    if os.environ.get("MEDIR_INICIO"):
+        # benchmarks/bench_inicio.py: fecha assim que a tela inicial aparece
+        root.after_idle(root.destroy)
     root.mainloop()
@@ -1,4 +1,19 @@
 # -*- mode: python ; coding: utf-8 -*-
+#
+# Build padrão: um único main.exe (onefile).
+# Build em pasta (onedir), que abre mais rápido por não descompactar tudo
+# num diretório temporário a cada execução:
+#   set ONEDIR=1  (Linux/macOS: ONEDIR=1)  e  pyinstaller main.spec
+import os
+
+ONEDIR = os.environ.get("ONEDIR") == "1"
+
+# Módulos que o programa não usa mas que os hooks do PIL/reportlab puxam.
+# pandas/numpy só são usados pelo analise.py, que não entra no executável.
+EXCLUDES = [
+    'pandas', 'numpy', 'matplotlib', 'scipy', 'IPython', 'jinja2', 'pytest',
+    'PyQt5', 'PySide2', 'PySide6', 'PIL.ImageQt', 'tkinter.test',
+]
 
 
 a = Analysis(
@@ -10,29 +25,57 @@ a = Analysis(
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=EXCLUDES,
     noarchive=False,
     optimize=0,
 )
 pyz = PYZ(a.pure)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.datas,
-    [],
-    name='main',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=False,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-)
+if ONEDIR:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='main',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.datas,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        name='main',
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.datas,
+        [],
+        name='main',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+    )
@@ -0,0 +1,177 @@
+# medicoes.py - tempos das operações do programa, ligados também em produção
+#
+# Cada operação medida (abrir a conexão, consultas das telas, decodificar e
+# redimensionar imagens, gravar CSV, gerar PDF, pedidos ao servidor) vira um
+# evento num buffer circular em memória, com duração, bytes lidos/gravados
+# e se veio do cache. Registrar custa poucos microssegundos e não toca no
+# disco. No fim de cada sessão de teste, os eventos dela vão para um arquivo
+# JSON Lines em resultados/tempos (ver executar_teste.py), e
+# `python cli.py tempos` resume esses arquivos.
+#
+# Para investigar a fundo, a variável de ambiente PERFIL_TESTES liga, no
+# programa e no cli.py, o cProfile e/ou o tracemalloc (ver iniciar_perfil).
+import os
+import json
+import time
+import atexit
+import logging
+import itertools
+import threading
+import statistics
+from functools import wraps
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+ATIVO = True  # False desliga o registro de eventos
+TAMANHO_BUFFER = 10000  # Eventos guardados; os mais antigos saem primeiro
+PERFIL = os.environ.get("PERFIL_TESTES", "")  # "cprofile", "tracemalloc" ou "cprofile,tracemalloc"
+TOP_MEMORIA = 30  # Linhas de código que mais alocaram, no relatório do tracemalloc
+CAMPOS = ("seq", "instante", "nome", "ms", "bytes", "cache", "thread")
+
+log = logging.getLogger(__name__)
+
+_eventos = deque(maxlen=TAMANHO_BUFFER)  # append e list() são seguros entre threads
+_sequencia = itertools.count(1)
+
+
+def registrar(nome, ms, bytes_=None, cache=None):
+    """Guarda um evento já medido (ms = duração em milissegundos)."""
+    if ATIVO:
+        _eventos.append((next(_sequencia), time.time(), nome, round(ms, 3), bytes_, cache,
+                         threading.current_thread().name))
+
+
+@contextmanager
+def medir(nome):
+    """
+    Mede o bloco. O dicionário entregue pode receber "bytes" e "cache"
+    (True/False) durante o bloco:
+        with medir("miniatura") as m:
+            ...
+            m["cache"] = True
+    """
+    info = {}
+    inicio = time.perf_counter()
+    try:
+        yield info
+    finally:
+        registrar(nome, (time.perf_counter() - inicio) * 1000,
+                  info.get("bytes"), info.get("cache"))
+
+
+def medido(nome):
+    """Decorador: mede cada chamada da função com o nome dado."""
+    def decorar(funcao):
+        @wraps(funcao)
+        def medida(*args, **kwargs):
+            inicio = time.perf_counter()
+            try:
+                return funcao(*args, **kwargs)
+            finally:
+                registrar(nome, (time.perf_counter() - inicio) * 1000)
+        return medida
+    return decorar
+
+
+def marca():
+    """Número que separa os eventos de agora em diante (ver eventos)."""
+    return next(_sequencia)
+
+
+def eventos(desde=0):
+    """Eventos do buffer posteriores à marca `desde`, como dicionários."""
+    return [dict(zip(CAMPOS, evento)) for evento in list(_eventos) if evento[0] > desde]
+
+
+def exportar(arquivo, desde=0, **contexto):
+    """
+    Grava em JSON Lines os eventos posteriores à marca `desde`, um por
+    linha, com os campos de `contexto` (ex.: sessao_id) em cada um.
+    Retorna quantos gravou.
+    """
+    selecionados = eventos(desde)
+    os.makedirs(os.path.dirname(os.path.abspath(arquivo)), exist_ok=True)
+    with open(arquivo, "w", encoding="utf-8") as f:
+        for evento in selecionados:
+            f.write(json.dumps(dict(evento, **contexto), ensure_ascii=False) + "\n")
+    return len(selecionados)
+
+
+def ler(arquivos):
+    """Eventos gravados por exportar() em um ou mais arquivos."""
+    lidos = []
+    for arquivo in arquivos:
+        with open(arquivo, encoding="utf-8") as f:
+            lidos.extend(json.loads(linha) for linha in f if linha.strip())
+    return lidos
+
+
+def resumo(lista):
+    """Por nome de operação: quantidade, p50/p99/máximo e total em ms, bytes e acertos de cache."""
+    por_nome = {}
+    for evento in lista:
+        por_nome.setdefault(evento["nome"], []).append(evento)
+    resultado = {}
+    for nome, grupo in sorted(por_nome.items()):
+        tempos = sorted(evento["ms"] for evento in grupo)
+        com_cache = [evento["cache"] for evento in grupo if evento.get("cache") is not None]
+        resultado[nome] = {
+            "quantidade": len(tempos),
+            "p50_ms": round(statistics.median(tempos), 2),
+            "p99_ms": round(tempos[min(len(tempos) - 1, int(len(tempos) * 0.99))], 2),
+            "max_ms": round(tempos[-1], 2),
+            "total_ms": round(sum(tempos), 1),
+            "bytes": sum(evento.get("bytes") or 0 for evento in grupo),
+            "acertos_cache": (round(sum(com_cache) / len(com_cache), 3) if com_cache else None),
+        }
+    return resultado
+
+
+def iniciar_perfil(pasta=None):
+    """
+    Conforme PERFIL_TESTES, liga o cProfile (só a thread que chamou: a do
+    Tk no programa; o trabalho das outras threads aparece nos eventos) e/ou
+    o tracemalloc, e grava os resultados ao sair do processo em `pasta`
+    (padrão: resultados/perfil): perfil_<data>.prof, para abrir com pstats
+    ou snakeviz, memoria_<data>.txt, com o pico e as linhas que mais
+    alocaram, e eventos_<data>.jsonl, com todo o buffer de eventos (inclui
+    o que não pertence a uma sessão de teste, como a tela de administração).
+    """
+    modos = {modo.strip().lower() for modo in PERFIL.split(",") if modo.strip()}
+    if not modos:
+        return
+    desconhecidos = modos - {"cprofile", "tracemalloc"}
+    if desconhecidos:
+        log.warning("PERFIL_TESTES: modos desconhecidos ignorados: %s", ", ".join(sorted(desconhecidos)))
+    pasta = pasta or os.path.join(os.path.abspath("."), "resultados", "perfil")
+    carimbo = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    os.makedirs(pasta, exist_ok=True)
+    atexit.register(exportar, os.path.join(pasta, f"eventos_{carimbo}.jsonl"))
+
+    if "tracemalloc" in modos:
+        import tracemalloc
+
+        def gravar_memoria():
+            atual, pico = tracemalloc.get_traced_memory()
+            estatisticas = tracemalloc.take_snapshot().statistics("lineno")[:TOP_MEMORIA]
+            tracemalloc.stop()
+            with open(os.path.join(pasta, f"memoria_{carimbo}.txt"), "w", encoding="utf-8") as f:
+                f.write(f"Atual: {atual / 2 ** 20:.1f} MB  Pico: {pico / 2 ** 20:.1f} MB\n\n")
+                f.writelines(f"{estatistica}\n" for estatistica in estatisticas)
+
+        atexit.register(gravar_memoria)
+        tracemalloc.start()
+
+    # Registrado por último para parar primeiro (atexit é LIFO): o perfil
+    # não inclui a gravação do tracemalloc
+    if "cprofile" in modos:
+        import cProfile
+        perfil = cProfile.Profile()
+
+        def gravar_perfil():
+            perfil.disable()
+            perfil.dump_stats(os.path.join(pasta, f"perfil_{carimbo}.prof"))
+
+        atexit.register(gravar_perfil)
+        perfil.enable()
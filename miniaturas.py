@@ -0,0 +1,153 @@
+# miniaturas.py - cache persistente das imagens redimensionadas
+import time
+from io import BytesIO
+
+from PIL import Image
+
+from database import conectar, transacao, obter_hash, abrir_blob_conteudo
+from medicoes import medir
+
+LIMITE_CACHE_BYTES = 64 * 1024 * 1024  # Tamanho máximo da tabela miniaturas
+FORMATO_MINIATURA = "PNG"  # Padrão das telas; o PDF pede JPEG
+QUALIDADE_JPEG = 85
+# zlib do PNG: o nível 1 codifica ~4x mais rápido que o padrão (6) e o
+# arquivo fica só ~15% maior; continua sem perda (o defeito tem que aparecer)
+COMPRESSAO_PNG = 1
+# acessado_em só é regravado quando está mais velho que isso: um acerto no
+# cache não abre uma transação de escrita a cada questão, e para escolher o
+# que sai do cache essa resolução basta
+INTERVALO_ACESSO_S = 60
+
+
+def redimensionar(fonte, tamanho, ajustar=False):
+    """
+    Decodifica a imagem e redimensiona para `tamanho` (largura, altura).
+    `fonte` pode ser o BLOB em bytes ou um objeto tipo arquivo (por exemplo
+    o handle de database.abrir_blob_imagem).
+    Com ajustar=True mantém a proporção dentro da caixa (usado no PDF);
+    senão estica para o tamanho exato, como nas telas do programa.
+    """
+    if isinstance(fonte, (bytes, bytearray, memoryview)):
+        fonte = BytesIO(fonte)
+    imagem = Image.open(fonte)
+    # Para JPEG, decodifica já reduzido (escala DCT) quando a foto é grande
+    imagem.draft("RGB", (tamanho[0] * 2, tamanho[1] * 2))
+    if ajustar:
+        imagem.thumbnail(tamanho, Image.LANCZOS)
+        return imagem
+    return imagem.resize(tamanho, Image.LANCZOS)
+
+
+def _gerar(hash_conteudo, tamanho, ajustar):
+    """PIL.Image redimensionada do conteúdo, ou None se ele não existe."""
+    # Decodifica direto do handle do BLOB, sem copiar para bytes
+    with abrir_blob_conteudo(hash_conteudo) as blob:
+        if blob is None:
+            return None
+        with medir("imagem.redimensionar") as m:
+            m["bytes"] = len(blob)
+            imagem = redimensionar(blob, tamanho, ajustar)
+            imagem.load()
+    return imagem
+
+
+def _codificar(imagem, formato):
+    saida = BytesIO()
+    if formato == "JPEG":
+        if imagem.mode not in ("RGB", "L"):
+            imagem = imagem.convert("RGB")
+        imagem.save(saida, formato, quality=QUALIDADE_JPEG, optimize=True)
+    else:
+        imagem.save(saida, formato, compress_level=COMPRESSAO_PNG)
+    return saida.getvalue()
+
+
+def _remover_excedente(cursor):
+    """Remove as miniaturas menos usadas até caber em LIMITE_CACHE_BYTES."""
+    cursor.execute("""
+        DELETE FROM miniaturas WHERE rowid IN (
+            SELECT rowid FROM (
+                SELECT rowid, SUM(tamanho) OVER (ORDER BY acessado_em DESC) AS acumulado
+                FROM miniaturas
+            ) WHERE acumulado > ?
+        )
+    """, (LIMITE_CACHE_BYTES,))
+
+
+def obter_miniatura(imagem_id, tamanho, ajustar=False, formato=FORMATO_MINIATURA):
+    """
+    Retorna os bytes (PNG ou JPEG, conforme `formato`) da imagem
+    `imagem_id` redimensionada, gerando e
+    guardando no cache se ainda não existir. Retorna None se a imagem não
+    existe. O cache é por conteúdo (hash), então imagens iguais em testes
+    diferentes compartilham a miniatura; as entradas são removidas por
+    gatilho quando o conteúdo é apagado (ver database.criar_tabelas).
+    """
+    resultado = _obter(imagem_id, tamanho, ajustar, formato)
+    return None if resultado is None else resultado[0]
+
+
+def _obter(imagem_id, tamanho, ajustar, formato):
+    """
+    (bytes, PIL.Image) da miniatura, ou None. A PIL.Image só vem quando a
+    miniatura acabou de ser gerada (no acerto do cache é None).
+    """
+    # Medido por inteiro: cache = se a miniatura já existia
+    with medir("miniatura") as m:
+        hash_conteudo = obter_hash(imagem_id)
+        if hash_conteudo is None:
+            return None
+        largura, altura = tamanho
+        chave = (hash_conteudo, largura, altura, int(ajustar), formato)
+
+        cursor = conectar().cursor()
+        cursor.execute("""
+            SELECT dados, acessado_em FROM miniaturas
+            WHERE hash=? AND largura=? AND altura=? AND ajustar=? AND formato=?
+        """, chave)
+        row = cursor.fetchone()
+        if row:
+            dados, acessado_em = row
+            agora = time.time()
+            if agora - acessado_em > INTERVALO_ACESSO_S:
+                with transacao() as conn:
+                    conn.execute("""
+                        UPDATE miniaturas SET acessado_em=?
+                        WHERE hash=? AND largura=? AND altura=? AND ajustar=? AND formato=?
+                    """, (agora,) + chave)
+            m["cache"], m["bytes"] = True, len(dados)
+            return dados, None
+
+        m["cache"] = False
+        imagem = _gerar(hash_conteudo, tamanho, ajustar)
+        if imagem is None:
+            return None
+        dados = _codificar(imagem, formato)
+
+        with transacao() as conn:
+            cursor = conn.cursor()
+            # Só guarda se o conteúdo ainda existe (pode ter sido apagado agora)
+            cursor.execute("""
+                INSERT OR REPLACE INTO miniaturas
+                    (hash, largura, altura, ajustar, formato, dados, tamanho, acessado_em)
+                SELECT ?, ?, ?, ?, ?, ?, ?, ?
+                WHERE EXISTS (SELECT 1 FROM conteudos WHERE hash=?)
+            """, chave + (dados, len(dados), time.time(), hash_conteudo))
+            _remover_excedente(cursor)
+        return dados, imagem
+
+
+def abrir_miniatura(imagem_id, tamanho, ajustar=False):
+    """
+    Como obter_miniatura, mas já devolve a PIL.Image. Se a miniatura acabou
+    de ser gerada, devolve a própria imagem redimensionada, sem decodificar
+    de novo o PNG gravado no cache.
+    """
+    resultado = _obter(imagem_id, tamanho, ajustar, FORMATO_MINIATURA)
+    if resultado is None:
+        return None
+    dados, imagem = resultado
+    if imagem is None:
+        imagem = Image.open(BytesIO(dados))
+        imagem.load()
+    return imagem
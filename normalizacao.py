@@ -0,0 +1,259 @@
+# normalizacao.py - reduz as imagens para a resolução de exibição antes de gravar
+import os
+import sys
+import time
+import argparse
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+from database import (conectar, transacao, calcular_hash, criar_tabelas, abrir_blob_conteudo,
+                      get_db_path)
+
+# Padrão da opção "normalizar" ao adicionar imagens (tela de administração e
+# cli.py importar --normalizar): desligada, a imagem é gravada como veio
+NORMALIZAR_NA_IMPORTACAO = False
+GUARDAR_ORIGINAL = True  # Ao normalizar, guarda também o arquivo original (tabela originais)
+MAX_LADO = 1600  # Maior lado da versão guardada, em pixels
+FORMATO = "JPEG"  # JPEG ou WEBP
+QUALIDADE = 85
+# Segmentos JPEG de metadados: APP1 a APP13 (EXIF, XMP, ICC, IPTC...), APP15
+# e comentários. Ficam o APP0 (JFIF) e o APP14 (Adobe, usado na decodificação).
+MARCADORES_METADADOS = set(range(0xE1, 0xEE)) | {0xEF, 0xFE}
+
+
+def _abrir(fonte):
+    """PIL.Image de bytes, de um caminho ou de um objeto tipo arquivo (ex.: handle de BLOB)."""
+    return Image.open(BytesIO(fonte) if isinstance(fonte, (bytes, bytearray)) else fonte)
+
+
+def _tamanho(fonte):
+    if isinstance(fonte, (bytes, bytearray)):
+        return len(fonte)
+    if isinstance(fonte, (str, os.PathLike)):
+        return os.path.getsize(fonte)
+    return len(fonte)  # handle de BLOB
+
+
+def _ler(fonte):
+    if isinstance(fonte, (bytes, bytearray)):
+        return bytes(fonte)
+    if isinstance(fonte, (str, os.PathLike)):
+        with open(fonte, "rb") as f:
+            return f.read()
+    fonte.seek(0)
+    return fonte.read()
+
+
+def jpeg_sem_metadados(dados):
+    """
+    Os mesmos dados JPEG sem os segmentos de MARCADORES_METADADOS, sem
+    recodificar a imagem. None se não há o que tirar (ou não é um JPEG
+    que dê para percorrer).
+    """
+    if dados[:2] != b"\xff\xd8":
+        return None
+    partes = [dados[:2]]
+    removidos = 0
+    i = 2
+    while i + 4 <= len(dados):
+        if dados[i] != 0xFF:
+            return None
+        marcador = dados[i + 1]
+        if marcador == 0xFF:  # preenchimento
+            i += 1
+            continue
+        if marcador == 0xDA:  # início dos dados da imagem: o resto fica como está
+            partes.append(dados[i:])
+            break
+        fim = i + 2 + int.from_bytes(dados[i + 2:i + 4], "big")
+        if marcador in MARCADORES_METADADOS:
+            removidos += 1
+        else:
+            partes.append(dados[i:fim])
+        i = fim
+    else:
+        return None
+    return b"".join(partes) if removidos else None
+
+
+def normalizar(fonte, max_lado=MAX_LADO, formato=FORMATO, qualidade=QUALIDADE):
+    """
+    Gera a versão de exibição da imagem: aplica a orientação EXIF, reduz o
+    maior lado para `max_lado` e regrava em `formato` sem metadados.
+    `fonte` pode ser bytes, um caminho ou um handle de BLOB: o PIL lê do
+    arquivo o que precisa, sem cópia inteira em bytes.
+    Um JPEG que já está no tamanho certo não é recodificado (só perderia
+    qualidade): só perde os metadados (jpeg_sem_metadados).
+    Retorna None quando não compensa: a imagem já está no formato e no
+    tamanho certos e sem metadados, ou o resultado ficaria maior que o
+    original.
+    """
+    with _abrir(fonte) as imagem:
+        orientacao = imagem.getexif().get(0x0112, 1)
+        if imagem.format == formato and max(imagem.size) <= max_lado and orientacao == 1:
+            if formato == "JPEG":
+                return jpeg_sem_metadados(_ler(fonte))
+            if not any(chave in imagem.info for chave in ("exif", "xmp", "icc_profile")):
+                return None
+        return _normalizar(imagem, _tamanho(fonte), max_lado, formato, qualidade, orientacao)
+
+
+def _normalizar(imagem, tamanho_original, max_lado, formato, qualidade, orientacao):
+    imagem = ImageOps.exif_transpose(imagem)
+    if max(imagem.size) > max_lado:
+        imagem.thumbnail((max_lado, max_lado), Image.LANCZOS)
+    if imagem.mode in ("RGBA", "LA", "P"):
+        imagem = imagem.convert("RGBA")
+        fundo = Image.new("RGB", imagem.size, "white")
+        fundo.paste(imagem, mask=imagem.getchannel("A"))
+        imagem = fundo
+    elif imagem.mode not in ("RGB", "L"):
+        imagem = imagem.convert("RGB")
+
+    saida = BytesIO()
+    # Sem exif=/icc_profile=, o Pillow não copia os metadados
+    imagem.save(saida, formato, quality=qualidade, optimize=True)
+    novo = saida.getvalue()
+    if len(novo) >= tamanho_original and orientacao == 1:
+        return None
+    return novo
+
+
+def preparar_para_banco(fonte, normalizar_imagem=None, guardar_original=None):
+    """
+    Aplica normalizar() na importação, se `normalizar_imagem` (None: o
+    padrão NORMALIZAR_NA_IMPORTACAO). `fonte` são os bytes ou o caminho do
+    arquivo (arquivos grandes: ver importacao.LIMITE_EM_MEMORIA). Retorna
+    (dados_a_gravar, original), onde original é a fonte recebida (se
+    guardar_original, padrão GUARDAR_ORIGINAL) ou None;
+    database.adicionar_imagens aceita os dois tipos.
+    """
+    if normalizar_imagem is None:
+        normalizar_imagem = NORMALIZAR_NA_IMPORTACAO
+    if guardar_original is None:
+        guardar_original = GUARDAR_ORIGINAL
+    if not normalizar_imagem:
+        return fonte, None
+    novo = normalizar(fonte)
+    if novo is None:
+        return fonte, None
+    return novo, (fonte if guardar_original else None)
+
+
+def _tempo_decodificacao(fonte):
+    inicio = time.perf_counter()
+    with _abrir(fonte) as imagem:
+        imagem.load()
+    return time.perf_counter() - inicio
+
+
+def _bytes_guardados(conn):
+    """Bytes das imagens no banco: conteúdos e originais guardados."""
+    return conn.execute("""
+        SELECT (SELECT IFNULL(SUM(tamanho), 0) FROM conteudos)
+             + (SELECT IFNULL(SUM(tamanho), 0) FROM originais)
+    """).fetchone()[0]
+
+
+def _tamanho_arquivo(conn):
+    """Tamanho do arquivo do banco, com o WAL já passado para ele."""
+    conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    return os.path.getsize(get_db_path())
+
+
+def compactar_banco(max_lado=MAX_LADO, formato=FORMATO, qualidade=QUALIDADE,
+                    guardar_original=GUARDAR_ORIGINAL, progresso=None):
+    """
+    Regrava os conteúdos já existentes com normalizar() e troca as
+    referências em imagens para a versão nova; o conteúdo antigo sai pela
+    contagem de referências. Termina com VACUUM para devolver o espaço.
+    Retorna um dicionário com o total processado, regravados, os bytes das
+    imagens (conteúdos mais originais guardados) e o tamanho do arquivo do
+    banco antes e depois, e o tempo total de decodificação antes e depois.
+    Com guardar_original, os originais continuam no banco: o arquivo pode
+    até crescer (ex.: quando só os metadados saem).
+    """
+    criar_tabelas()
+    conn = conectar()
+    hashes = [row[0] for row in conn.execute("SELECT hash FROM conteudos")]
+    relatorio = {"conteudos": len(hashes), "regravados": 0,
+                 "bytes_antes": _bytes_guardados(conn), "bytes_depois": 0,
+                 "bytes_originais": 0,
+                 "arquivo_antes": _tamanho_arquivo(conn), "arquivo_depois": 0,
+                 "decodificacao_antes_s": 0.0, "decodificacao_depois_s": 0.0}
+
+    for i, hash_antigo in enumerate(hashes, 1):
+        # Decodifica direto do handle do BLOB: o conteúdo não é copiado para bytes
+        with abrir_blob_conteudo(hash_antigo) as blob:
+            if blob is None:
+                continue
+            try:
+                tempo_antes = _tempo_decodificacao(blob)
+                blob.seek(0)
+                novo = normalizar(blob, max_lado, formato, qualidade)
+            except Exception:
+                # imagem que o PIL não abre fica como está
+                tempo_antes, novo = 0.0, None
+
+        relatorio["decodificacao_antes_s"] += tempo_antes
+        if novo is None:
+            relatorio["decodificacao_depois_s"] += tempo_antes
+        else:
+            hash_novo = calcular_hash(novo)
+            with transacao() as t:
+                t.execute("""
+                    INSERT OR IGNORE INTO conteudos (hash, dados, tamanho) VALUES (?, ?, ?)
+                """, (hash_novo, novo, len(novo)))
+                if guardar_original:
+                    # Copiado dentro do SQLite, sem passar pelo Python
+                    t.execute("""
+                        INSERT OR IGNORE INTO originais (hash, dados, tamanho)
+                        SELECT ?, dados, tamanho FROM conteudos WHERE hash=?
+                    """, (hash_novo, hash_antigo))
+                # A versão regravada é a mesma foto: herda a assinatura (semelhanca.py)
+                t.execute("""
+                    INSERT OR IGNORE INTO assinaturas
+                        (hash, dhash, ahash, banda0, banda1, banda2, banda3, cinza)
+                    SELECT ?, dhash, ahash, banda0, banda1, banda2, banda3, cinza
+                    FROM assinaturas WHERE hash=?
+                """, (hash_novo, hash_antigo))
+                # Os gatilhos ajustam as referências e apagam o antigo
+                t.execute("UPDATE imagens SET hash=? WHERE hash=?",
+                          (hash_novo, hash_antigo))
+            relatorio["regravados"] += 1
+            relatorio["decodificacao_depois_s"] += _tempo_decodificacao(novo)
+
+        if progresso:
+            progresso(i, len(hashes))
+
+    relatorio["bytes_depois"] = _bytes_guardados(conn)
+    relatorio["bytes_originais"] = conn.execute(
+        "SELECT IFNULL(SUM(tamanho), 0) FROM originais").fetchone()[0]
+    conn.execute("VACUUM")
+    relatorio["arquivo_depois"] = _tamanho_arquivo(conn)
+    return relatorio
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Regrava as imagens do banco na resolução de exibição.")
+    parser.add_argument("--max-lado", type=int, default=MAX_LADO)
+    parser.add_argument("--formato", default=FORMATO, choices=["JPEG", "WEBP"])
+    parser.add_argument("--qualidade", type=int, default=QUALIDADE)
+    parser.add_argument("--sem-original", dest="guardar_original", action="store_false",
+                        help="não guarda o arquivo original das imagens regravadas")
+    args = parser.parse_args()
+
+    r = compactar_banco(args.max_lado, args.formato, args.qualidade, args.guardar_original,
+                        progresso=lambda i, n: print(f"\r{i}/{n}", end="", file=sys.stderr))
+    print(file=sys.stderr)
+    economia = r["bytes_antes"] - r["bytes_depois"]
+    print(f"Conteúdos: {r['conteudos']} (regravados: {r['regravados']})")
+    print(f"Bytes das imagens: {r['bytes_antes']} -> {r['bytes_depois']} "
+          f"(economia de {economia} bytes, "
+          f"{economia / r['bytes_antes'] * 100 if r['bytes_antes'] else 0:.1f}%; "
+          f"originais guardados: {r['bytes_originais']} bytes)")
+    print(f"Arquivo do banco: {r['arquivo_antes']} -> {r['arquivo_depois']} bytes")
+    print(f"Decodificação: {r['decodificacao_antes_s']:.2f} s -> "
+          f"{r['decodificacao_depois_s']:.2f} s")
@@ -0,0 +1,68 @@
+# questoes.py - carregamento sob demanda das imagens de um teste
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from backend import obter_backend
+
+JANELA_LEITURA = 3  # Quantas questões seguintes ficam pré-carregadas
+TAMANHO_QUESTAO = (400, 300)  # Tamanho de exibição da imagem na questão
+NUM_TRABALHADORES = 2  # Threads que decodificam/redimensionam em paralelo
+
+
+class CarregadorQuestoes:
+    """
+    Prepara em segundo plano as imagens da questão atual e das próximas
+    `janela` questões. As questões são tuplas (imagem_id, nome_arquivo,
+    resposta_correta), sem a imagem; cada uma é obtida do cache de
+    miniaturas (ou gerada a partir do BLOB), ou do servidor quando há um
+    (ver backend.py), numa thread de trabalho quando
+    entra na janela, e descartada quando sai dela. A thread do Tk só
+    recebe a imagem pronta.
+    """
+
+    def __init__(self, questoes, janela=JANELA_LEITURA, tamanho=TAMANHO_QUESTAO):
+        self.questoes = list(questoes)
+        self.janela = janela
+        self.tamanho = tamanho
+        self._futuros = OrderedDict()  # imagem_id -> Future com a PIL.Image
+        self._backend = obter_backend()
+        self._executor = ThreadPoolExecutor(
+            max_workers=NUM_TRABALHADORES, thread_name_prefix="questoes")
+
+    def __len__(self):
+        return len(self.questoes)
+
+    def __getitem__(self, index):
+        return self.questoes[index]
+
+    def _ajustar_janela(self, index):
+        ids_janela = [q[0] for q in self.questoes[index:index + self.janela + 1]]
+
+        # Descarta o que ficou para trás
+        for img_id in list(self._futuros):
+            if img_id not in ids_janela:
+                self._futuros.pop(img_id).cancel()
+
+        for img_id in ids_janela:
+            if img_id not in self._futuros:
+                self._futuros[img_id] = self._executor.submit(
+                    self._backend.abrir_miniatura, img_id, self.tamanho)
+
+    def obter(self, index):
+        """Retorna a PIL.Image pronta da questão `index` (espera se preciso)."""
+        self._ajustar_janela(index)
+        return self._futuros[self.questoes[index][0]].result()
+
+    def descartar(self, index):
+        """Tira a questão `index` do teste (imagem apagada ou inacessível)."""
+        img_id = self.questoes.pop(index)[0]
+        futuro = self._futuros.pop(img_id, None)
+        if futuro is not None:
+            futuro.cancel()
+
+    def encerrar(self):
+        """Cancela o que estiver pendente e libera as threads."""
+        for futuro in self._futuros.values():
+            futuro.cancel()
+        self._futuros.clear()
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,418 @@
+# relatorios.py - geração dos relatórios (CSV + PDF) em segundo plano
+# O reportlab é importado só na hora de gerar o PDF (ver gerar_pdf), para
+# não pesar na abertura do programa.
+import os
+import csv
+import json
+import time
+import queue
+import logging
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from io import BytesIO
+
+from database import conectar, transacao
+from backend import obter_backend
+from medicoes import medir
+
+# Miniatura do PDF: caixa de 6,5 x 5 cm, gerada na resolução de DPI_MINIATURA_PDF
+LARGURA_MINIATURA_CM = 6.5
+ALTURA_MINIATURA_CM = 5
+DPI_MINIATURA_PDF = 150
+TAMANHO_MINIATURA_PDF = (round(LARGURA_MINIATURA_CM / 2.54 * DPI_MINIATURA_PDF),
+                         round(ALTURA_MINIATURA_CM / 2.54 * DPI_MINIATURA_PDF))
+MAX_TENTATIVAS = 3  # Tentativas antes de deixar o relatório só no banco
+ESPERA_TENTATIVA_S = 5  # Espera antes de tentar de novo (multiplicada pela tentativa)
+CSV_DIARIO = False  # True: acrescenta ao resultados_AAAA-MM-DD.csv em vez de um CSV por sessão
+
+COLUNAS_CSV = ["Avaliador", "Imagem", "Resposta Usuario", "Resposta Correta"]
+# Arquivo diário e exportação do banco: uma linha por resposta, com a sessão
+COLUNAS_EXPORTACAO = ["Sessao", "Teste", "Avaliador", "Operador", "Matricula", "Turno",
+                      "Finalizado em", "Ordem", "Imagem", "Resposta Usuario",
+                      "Resposta Correta", "Correta", "Tempo (ms)"]
+
+log = logging.getLogger(__name__)
+
+
+def gerar_pdf(nome_usuario, matricula, turno, acertos, porcentagem, erros_imagens, pasta_resultados=None, avaliador=None,
+              nome_pdf=None, data_hora=None):
+    """
+    erros_imagens: lista de tuples (nome_arquivo, resposta_usuario, resposta_correta, miniatura_bytes)
+    nome_pdf: nome do arquivo (padrão: resultado_<nome>_<data e hora>.pdf)
+    data_hora: datetime do fim do teste, no cabeçalho e no nome (padrão: agora)
+    Miniaturas repetidas (a mesma imagem errada mais de uma vez) são
+    decodificadas uma vez e embutidas no PDF como um único objeto.
+    """
+    from reportlab.lib.utils import ImageReader
+    from reportlab.lib.units import cm
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+
+    if pasta_resultados is None:
+        pasta_resultados = os.path.join(os.path.abspath("."), "resultados")
+    os.makedirs(pasta_resultados, exist_ok=True)
+    data_hora = data_hora or datetime.now()
+
+    arquivo_pdf = os.path.join(
+        pasta_resultados,
+        nome_pdf or f"resultado_{nome_usuario}_{data_hora.strftime('%Y%m%d_%H%M%S')}.pdf"
+    )
+
+    c = canvas.Canvas(arquivo_pdf, pagesize=A4)
+    largura, altura = A4
+
+    # Cabeçalho
+    c.setFont("Helvetica-Bold", 16)
+    c.drawString(2 * cm, altura - 2 * cm, "Relatório do Teste de Imagens")
+
+    c.setFont("Helvetica", 11)
+    c.drawString(2 * cm, altura - 3 * cm, f"Avaliador: {avaliador or ''}")
+    c.drawString(2 * cm, altura - 3.7 * cm, f"Nome: {nome_usuario}")
+    c.drawString(2 * cm, altura - 4.4 * cm, f"Matrícula: {matricula}")
+    c.drawString(2 * cm, altura - 5.1 * cm, f"Turno: {turno}")
+    c.drawString(2 * cm, altura - 5.8 * cm,
+                 f"Data: {data_hora.strftime('%Y-%m-%d %H:%M:%S')}")
+
+    c.setFont("Helvetica-Bold", 12)
+    c.drawString(2 * cm, altura - 7 * cm, f"Acertos: {acertos}")
+    c.drawString(6 * cm, altura - 7 * cm, f"Porcentagem: {porcentagem:.2f}%")
+
+    # Espaço antes da seção de erros
+    y = altura - 8.5 * cm
+
+    if not erros_imagens:
+        c.setFont("Helvetica-Oblique", 11)
+        c.drawString(2 * cm, y, "Nenhuma imagem errada. Excelente desempenho!")
+        c.showPage()
+        c.save()
+        return arquivo_pdf
+
+    c.setFont("Helvetica-Bold", 13)
+    c.drawString(2 * cm, y, "Imagens incorretas")
+    y -= 1 * cm
+
+    # Para cada imagem errada, desenhar a miniatura e as legendas
+    thumb_max_w = LARGURA_MINIATURA_CM * cm
+    thumb_max_h = ALTURA_MINIATURA_CM * cm
+    gap_y = 0.6 * cm
+    leitores = {}  # miniatura_bytes -> ImageReader
+
+    for nome_arquivo, resposta_usuario, resposta_correta, miniatura in erros_imagens:
+        # Se não houver espaço vertical suficiente, cria nova página
+        if y < 4 * cm:
+            c.showPage()
+            y = altura - 2 * cm
+
+        # Colocar miniatura à esquerda
+        try:
+            img_reader = leitores.get(miniatura)
+            if img_reader is None:
+                img_reader = leitores[miniatura] = ImageReader(BytesIO(miniatura))
+            iw, ih = img_reader.getSize()
+            scale = min(thumb_max_w / iw, thumb_max_h / ih, 1.0)
+            w = iw * scale
+            h = ih * scale
+
+            x_img = 2 * cm
+            c.drawImage(img_reader, x_img, y - h, width=w, height=h,
+                        preserveAspectRatio=True, anchor='sw')
+        except Exception as e:
+            # Se falhar ao desenhar a imagem, apenas escreve o nome do arquivo
+            c.setFont("Helvetica-Oblique", 10)
+            c.drawString(
+                2 * cm, y, f"[Erro ao exibir miniatura] {nome_arquivo}")
+
+        # Texto à direita da miniatura (ou abaixo, caso miniatura falhe)
+        x_text = 2 * cm + thumb_max_w + 0.6 * cm
+        c.setFont("Helvetica", 10)
+        c.drawString(x_text, y - 0.5 * cm, f"Arquivo: {nome_arquivo}")
+        c.drawString(x_text, y - 1.2 * cm,
+                     f"Resposta do usuário: {resposta_usuario}")
+        c.drawString(x_text, y - 1.9 * cm,
+                     f"Resposta correta: {resposta_correta}")
+
+        # desce o ponteiro vertical
+        y -= (thumb_max_h + gap_y)
+
+    c.showPage()
+    c.save()
+    return arquivo_pdf
+
+
+@contextmanager
+def _escritor_csv(arquivo, colunas, anexar=False):
+    """
+    csv.writer no formato dos relatórios (';' e utf-8 com BOM). Com
+    anexar=True acrescenta ao arquivo e só escreve o cabeçalho se ele for novo.
+    """
+    pasta = os.path.dirname(os.path.abspath(arquivo))
+    os.makedirs(pasta, exist_ok=True)
+    tamanho_antes = os.path.getsize(arquivo) if anexar and os.path.exists(arquivo) else 0
+    novo = tamanho_antes == 0
+    # Ao acrescentar, o TextIOWrapper não repete o BOM no meio do arquivo
+    with medir("csv") as m:
+        with open(arquivo, "a" if anexar else "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f, delimiter=";", lineterminator=os.linesep)
+            if novo:
+                writer.writerow(colunas)
+            yield writer
+        m["bytes"] = os.path.getsize(arquivo) - tamanho_antes
+
+
+def gravar_csv(nome_csv, avaliador, respostas):
+    """respostas: lista de (imagem_id, nome_arquivo, resposta_usuario, resposta_correta)"""
+    with _escritor_csv(nome_csv, COLUNAS_CSV) as writer:
+        writer.writerows((avaliador, nome_arquivo, resposta_usuario, resposta_correta)
+                         for _, nome_arquivo, resposta_usuario, resposta_correta in respostas)
+
+
+def exportar_respostas(arquivo, filtro="", params=(), anexar=False):
+    """
+    Grava direto do banco, linha a linha, as respostas das sessões que
+    passam em `filtro` (condição SQL sobre `s`, a tabela sessoes).
+    Retorna (sessões, respostas) gravadas.
+    """
+    cursor = conectar().execute(f"""
+        SELECT s.id, t.nome, s.avaliador, s.operador, s.matricula, s.turno,
+               s.finalizado_em, r.ordem, r.nome_arquivo, r.resposta,
+               r.resposta_correta, r.correta, r.tempo_ms
+        FROM sessoes s
+        JOIN respostas r ON r.sessao_id = s.id
+        LEFT JOIN testes t ON t.id = s.teste_id
+        {"WHERE " + filtro if filtro else ""}
+        ORDER BY s.id, r.ordem
+    """, params)
+    sessoes = set()
+    linhas = 0
+    with _escritor_csv(arquivo, COLUNAS_EXPORTACAO, anexar) as writer:
+        for row in cursor:
+            writer.writerow(row)
+            sessoes.add(row[0])
+            linhas += 1
+    return len(sessoes), linhas
+
+
+# Sessões já gravadas em cada arquivo diário: caminho -> (tamanho, {ids}).
+# Só a thread da FilaRelatorios usa; o arquivo só é lido de novo se o
+# tamanho não for o que ela mesma deixou (apagado ou mexido por fora)
+_sessoes_nos_csv = {}
+
+
+def _sessoes_no_csv(arquivo):
+    """{ids (texto) da coluna Sessao} do arquivo diário."""
+    tamanho = os.path.getsize(arquivo) if os.path.exists(arquivo) else 0
+    guardado = _sessoes_nos_csv.get(arquivo)
+    if guardado and guardado[0] == tamanho:
+        return guardado[1]
+    ids = set()
+    if tamanho:
+        with open(arquivo, newline="", encoding="utf-8-sig") as f:
+            leitor = csv.reader(f, delimiter=";")
+            next(leitor, None)  # cabeçalho
+            ids = {linha[0] for linha in leitor if linha}
+    _sessoes_nos_csv[arquivo] = (tamanho, ids)
+    return ids
+
+
+def _sessao_no_csv(arquivo, sessao_id):
+    """Se o arquivo diário já tem as linhas da sessão (coluna Sessao)."""
+    return str(sessao_id) in _sessoes_no_csv(arquivo)
+
+
+def _anexar_sessao_csv(arquivo, sessao_id):
+    """Acrescenta a sessão ao arquivo diário e ao conjunto guardado dele."""
+    ids = _sessoes_no_csv(arquivo)
+    exportar_respostas(arquivo, "s.id = ?", (sessao_id,), anexar=True)
+    ids.add(str(sessao_id))
+    _sessoes_nos_csv[arquivo] = (os.path.getsize(arquivo), ids)
+
+
+def gerar_relatorio(dados):
+    """
+    Gera o CSV e o PDF de uma sessão. `dados` é o dicionário enviado à fila
+    (ver FilaRelatorios.enviar). Retorna (nome_csv, arquivo_pdf).
+    """
+    pasta = dados["pasta_resultados"]
+    os.makedirs(pasta, exist_ok=True)
+    # Nome e data vêm de dados["data_hora"], não da hora da geração: um pedido
+    # tentado de novo ou retomado depois de reabrir o programa sai igual, com
+    # o mesmo nome do CSV da sessão
+    arquivo_pdf = gerar_pdf_relatorio(
+        dados, nome_pdf=f"resultado_{dados['nome']}_{dados['data_hora']}.pdf")
+    # Com servidor, as sessões não estão no banco local: o arquivo diário
+    # sai no servidor (cli.py exportar) e aqui fica o CSV da sessão
+    if CSV_DIARIO and dados.get("sessao_id") and not obter_backend().remoto:
+        nome_csv = os.path.join(pasta, f"resultados_{dados['data_hora'][:10]}.csv")
+        # O pedido pode rodar de novo (nova tentativa, ou o programa fechou
+        # depois de acrescentar e antes de apagar o pendente): não duplica
+        if not _sessao_no_csv(nome_csv, dados["sessao_id"]):
+            _anexar_sessao_csv(nome_csv, dados["sessao_id"])
+    else:
+        nome_csv = os.path.join(
+            pasta, f"resultado_{dados['nome']}_{dados['data_hora']}.csv")
+        gravar_csv(nome_csv, dados["avaliador"], dados["respostas"])
+    return nome_csv, arquivo_pdf
+
+
+def _data_hora(dados):
+    """datetime de dados["data_hora"] (AAAA-MM-DD_HH-MM-SS), ou None se não houver."""
+    if not dados.get("data_hora"):
+        return None
+    return datetime.strptime(dados["data_hora"], "%Y-%m-%d_%H-%M-%S")
+
+
+def gerar_pdf_relatorio(dados, nome_pdf=None):
+    """
+    Só o PDF de gerar_relatorio(). A data é a da sessão (dados["data_hora"]),
+    não a da geração: um PDF refeito depois mostra quando o teste foi feito.
+    Retorna o caminho do arquivo.
+    """
+    # Miniaturas das imagens erradas para o PDF (vêm do cache ou do servidor)
+    backend = obter_backend()
+    erros_imagens = [
+        (nome_arquivo, resposta_usuario, resposta_correta,
+         backend.obter_miniatura(img_id, TAMANHO_MINIATURA_PDF, ajustar=True, formato="JPEG"))
+        for img_id, nome_arquivo, resposta_usuario, resposta_correta in dados["respostas"]
+        if resposta_usuario != resposta_correta
+    ]
+    with medir("pdf") as m:
+        arquivo_pdf = gerar_pdf(
+            nome_usuario=dados["nome"],
+            matricula=dados["matricula"],
+            turno=dados["turno"],
+            acertos=dados["acertos"],
+            porcentagem=dados["porcentagem"],
+            erros_imagens=erros_imagens,
+            pasta_resultados=dados["pasta_resultados"],
+            avaliador=dados["avaliador"],
+            nome_pdf=nome_pdf,
+            data_hora=_data_hora(dados)
+        )
+        m["bytes"] = os.path.getsize(arquivo_pdf)
+    return arquivo_pdf
+
+
+def dados_da_sessao(sessao_id, pasta_resultados):
+    """
+    Monta, a partir das tabelas sessoes/respostas, o mesmo dicionário que
+    o teste envia à fila; serve para refazer relatórios de sessões antigas.
+    Retorna None se a sessão não existe.
+    """
+    conn = conectar()
+    sessao = conn.execute("""
+        SELECT avaliador, operador, matricula, turno, finalizado_em, acertos, total
+        FROM sessoes WHERE id=?
+    """, (sessao_id,)).fetchone()
+    if not sessao:
+        return None
+    avaliador, operador, matricula, turno, finalizado_em, acertos, total = sessao
+    respostas = conn.execute("""
+        SELECT imagem_id, nome_arquivo, resposta, resposta_correta
+        FROM respostas WHERE sessao_id=? ORDER BY ordem
+    """, (sessao_id,)).fetchall()
+    return {
+        "sessao_id": sessao_id,
+        "nome": operador,
+        "matricula": matricula,
+        "turno": turno,
+        "avaliador": avaliador,
+        "acertos": acertos,
+        "porcentagem": acertos / total * 100 if total else 0.0,
+        "respostas": [list(r) for r in respostas],
+        "data_hora": finalizado_em.replace(" ", "_").replace(":", "-"),
+        "pasta_resultados": pasta_resultados,
+    }
+
+
+class FilaRelatorios:
+    """
+    Gera os relatórios numa thread própria, um por vez. Cada pedido é
+    gravado na tabela relatorios_pendentes antes de entrar na fila e só é
+    apagado depois que o CSV e o PDF ficam prontos; assim, se o programa
+    fechar no meio, o pedido é retomado na próxima abertura. Falhas são
+    tentadas de novo até MAX_TENTATIVAS e depois ficam registradas no banco,
+    e a cada abertura ganham mais uma tentativa (o problema pode ter sido
+    resolvido, como uma pasta sem espaço ou um PDF aberto em outro programa).
+    Os avisos de conclusão/falha vão para `notificacoes`, como tuplas
+    (relatorio_id, dados, resultado, erro), para a interface consumir.
+    """
+
+    def __init__(self):
+        self._fila = queue.Queue()
+        self.notificacoes = queue.Queue()
+        self._thread = threading.Thread(
+            target=self._trabalhar, name="relatorios", daemon=True)
+        self._thread.start()
+        self.retomar_pendentes()
+
+    def enviar(self, dados):
+        """Grava o pedido no banco e coloca na fila. Retorna o id."""
+        with transacao() as conn:
+            cursor = conn.execute("""
+                INSERT INTO relatorios_pendentes (dados, criado_em) VALUES (?, ?)
+            """, (json.dumps(dados), time.time()))
+        relatorio_id = cursor.lastrowid
+        self._fila.put(relatorio_id)
+        return relatorio_id
+
+    def retomar_pendentes(self):
+        """
+        Coloca na fila os pedidos que ficaram sem concluir, inclusive os que
+        esgotaram as tentativas: esses ganham mais uma e, se falharem de
+        novo, voltam a aparecer em `notificacoes`.
+        """
+        with transacao() as conn:
+            conn.execute("""
+                UPDATE relatorios_pendentes SET tentativas=? WHERE tentativas >= ?
+            """, (MAX_TENTATIVAS - 1, MAX_TENTATIVAS))
+            ids = conn.execute("SELECT id FROM relatorios_pendentes ORDER BY id").fetchall()
+        for (relatorio_id,) in ids:
+            self._fila.put(relatorio_id)
+
+    def _trabalhar(self):
+        while True:
+            relatorio_id = self._fila.get()
+            row = conectar().execute(
+                "SELECT dados, tentativas FROM relatorios_pendentes WHERE id=?",
+                (relatorio_id,)).fetchone()
+            if not row:
+                continue
+            dados = json.loads(row[0])
+            try:
+                resultado = gerar_relatorio(dados)
+            except Exception as e:
+                tentativas = row[1] + 1
+                log.exception("Falha ao gerar relatório %d (tentativa %d)",
+                              relatorio_id, tentativas)
+                with transacao() as conn:
+                    conn.execute("""
+                        UPDATE relatorios_pendentes SET tentativas=?, ultimo_erro=?
+                        WHERE id=?
+                    """, (tentativas, str(e), relatorio_id))
+                if tentativas < MAX_TENTATIVAS:
+                    # O pedido está no banco: fechar o programa antes da
+                    # espera não o perde (retomar_pendentes)
+                    espera = threading.Timer(ESPERA_TENTATIVA_S * tentativas,
+                                             self._fila.put, (relatorio_id,))
+                    espera.daemon = True
+                    espera.start()
+                else:
+                    self.notificacoes.put((relatorio_id, dados, None, e))
+                continue
+
+            with transacao() as conn:
+                conn.execute(
+                    "DELETE FROM relatorios_pendentes WHERE id=?", (relatorio_id,))
+            self.notificacoes.put((relatorio_id, dados, resultado, None))
+
+
+_fila = None
+
+
+def obter_fila():
+    """Fila única do processo (criada na primeira chamada)."""
+    global _fila
+    if _fila is None:
+        _fila = FilaRelatorios()
+    return _fila
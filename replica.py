@@ -0,0 +1,295 @@
+# replica.py - cópia local dos testes e imagens do servidor, nas estações
+#
+# Com SERVIDOR_TESTES (ver backend.py), a estação lê testes e imagens de um
+# banco próprio (replica.db, na pasta do programa) em vez do servidor:
+# abrir o programa e começar um teste nunca esperam pela rede. Uma thread
+# mantém a cópia em dia pedindo ao servidor só o que mudou depois da última
+# versão recebida (database.alteracoes_desde) e baixando só os conteúdos
+# (pelo hash) que a cópia ainda não tem. Os resultados entram numa fila no
+# mesmo banco (envios_pendentes) e seguem em lotes quando o servidor responde;
+# uma sessão recusada (HTTP 4xx, ou erro em MAX_TENTATIVAS_ENVIO envios) sai
+# da fila e fica guardada até reenviar_recusadas.
+import os
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+
+import database
+from database import conectar, transacao, gravar_conteudo
+from backend import BackendLocal, BackendRemoto, ErroServidor
+
+ARQUIVO_REPLICA = "replica.db"
+INTERVALO_SINCRONIZACAO_S = 30  # Entre uma rodada de envio/sincronização e a próxima
+LIMITE_PAGINA = 500  # Imagens alteradas por pedido de sincronização
+TAMANHO_LOTE_ENVIO = 50  # Sessões por pedido de envio
+MAX_TENTATIVAS_ENVIO = 20  # Envios com erro do servidor antes de desistir da sessão
+
+log = logging.getLogger(__name__)
+
+
+def _estado(chave, padrao=None):
+    row = conectar().execute(
+        "SELECT valor FROM replica_estado WHERE chave=?", (chave,)).fetchone()
+    return row[0] if row else padrao
+
+
+def _gravar_estado(conn, chave, valor):
+    conn.execute("INSERT OR REPLACE INTO replica_estado (chave, valor) VALUES (?, ?)",
+                 (chave, valor))
+
+
+def _baixar_conteudos(cliente, hashes):
+    """
+    Baixa e grava os conteúdos que a réplica ainda não tem. Cada um vai
+    para um arquivo temporário e dele para o banco em pedaços (ver
+    database.gravar_conteudo, que confere o hash): nem uma foto grande
+    passa inteira pela memória, nem a transação fica aberta esperando a rede.
+    """
+    if not hashes:
+        return
+    existentes = {row[0] for row in conectar().execute(
+        f"SELECT hash FROM conteudos WHERE hash IN ({','.join('?' * len(hashes))})",
+        list(hashes))}
+    pasta = os.path.dirname(os.path.abspath(database.get_db_path()))
+    for hash_conteudo in hashes - existentes:
+        descritor, temporario = tempfile.mkstemp(prefix="conteudo_", dir=pasta)
+        try:
+            with os.fdopen(descritor, "wb") as destino:
+                cliente.baixar_conteudo(hash_conteudo, destino)
+            gravar_conteudo(hash_conteudo, temporario)
+        except ValueError:
+            raise ErroServidor(f"Conteúdo {hash_conteudo} chegou incompleto")
+        finally:
+            os.remove(temporario)
+
+
+def _aplicar(alteracoes, hashes):
+    """Grava uma resposta de /sincronizar numa transação, com a nova versão."""
+    testes = alteracoes["testes"]
+    imagens = [imagem[1:] for imagem in alteracoes["imagens"]]  # sem a versão
+    fixar = [(h,) for h in hashes]
+    with transacao() as conn:
+        # Uma referência extra aos conteúdos da página enquanto as linhas
+        # mudam: o gatilho apagaria um conteúdo que outra linha ainda vai usar
+        conn.executemany(
+            "UPDATE conteudos SET referencias = referencias + 1 WHERE hash=?", fixar)
+
+        # Testes excluídos (as imagens saem junto) e depois os alterados, com
+        # nomes provisórios antes: uma troca de nomes não esbarra no UNIQUE
+        conn.executemany("DELETE FROM testes WHERE id=?",
+                         [(teste_id,) for teste_id in alteracoes["testes_excluidos"]])
+        conn.executemany("UPDATE testes SET nome = char(0) || id WHERE id=?",
+                         [(t[0],) for t in testes])
+        conn.executemany("""
+            INSERT INTO testes (id, nome, descricao, num_questoes, proporcao_ok)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET nome=excluded.nome, descricao=excluded.descricao,
+                num_questoes=excluded.num_questoes, proporcao_ok=excluded.proporcao_ok
+        """, testes)
+
+        conn.executemany("""
+            INSERT INTO imagens (id, teste_id, nome_arquivo, hash, resposta_correta)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(id) DO UPDATE SET teste_id=excluded.teste_id,
+                nome_arquivo=excluded.nome_arquivo, hash=excluded.hash,
+                resposta_correta=excluded.resposta_correta
+        """, imagens)
+        conn.executemany("DELETE FROM imagens WHERE id=?",
+                         [(imagem_id,) for _, imagem_id in alteracoes["imagens_excluidas"]])
+
+        # Tira a referência extra; conteúdo baixado que ficou sem imagem sai
+        conn.executemany(
+            "UPDATE conteudos SET referencias = referencias - 1 WHERE hash=?", fixar)
+        conn.executemany("DELETE FROM conteudos WHERE hash=? AND referencias <= 0", fixar)
+        _gravar_estado(conn, "versao", alteracoes["versao"])
+
+
+def sincronizar(cliente, limite=LIMITE_PAGINA):
+    """
+    Traz do servidor (um BackendRemoto) o que mudou, até ficar em dia.
+    Retorna quantas alterações aplicou. Se a réplica era de outro servidor,
+    começa do zero.
+    """
+    if _estado("servidor") != cliente.url:
+        with transacao() as conn:
+            conn.execute("DELETE FROM testes")
+            _gravar_estado(conn, "servidor", cliente.url)
+            _gravar_estado(conn, "versao", -1)
+    aplicadas = 0
+    primeira = True
+    while True:
+        desde = int(_estado("versao", -1))
+        alteracoes = cliente.sincronizar(desde, limite)
+        hashes = {imagem[4] for imagem in alteracoes["imagens"]}
+        _baixar_conteudos(cliente, hashes)
+        _aplicar(alteracoes, hashes)
+        aplicadas += len(alteracoes["imagens"]) + len(alteracoes["imagens_excluidas"])
+        if primeira:  # os testes se repetem em todas as páginas
+            aplicadas += len(alteracoes["testes"]) + len(alteracoes["testes_excluidos"])
+            primeira = False
+        if not alteracoes["mais"]:
+            return aplicadas
+
+
+def enfileirar_sessao(sessao, respostas):
+    """Guarda a sessão para envio. Retorna o id na fila."""
+    with transacao() as conn:
+        cursor = conn.execute("""
+            INSERT INTO envios_pendentes (dados, criado_em) VALUES (?, ?)
+        """, (json.dumps({"sessao": sessao, "respostas": [list(r) for r in respostas]}),
+              time.time()))
+    return cursor.lastrowid
+
+
+def _marcar_falha(ids, erro):
+    with transacao() as conn:
+        conn.executemany("""
+            UPDATE envios_pendentes SET tentativas = tentativas + 1, ultimo_erro=? WHERE id=?
+        """, [(str(erro), envio_id) for envio_id in ids])
+
+
+def _recusar(envio_id, erro):
+    """
+    Tira da fila a sessão que o servidor recusou de vez (4xx) ou que já
+    falhou MAX_TENTATIVAS_ENVIO vezes: reenviar não adianta e ela seguraria
+    a fila a cada rodada. Os dados continuam em envios_pendentes.
+    """
+    _marcar_falha([envio_id], erro)
+    with transacao() as conn:
+        tentativas = conn.execute(
+            "SELECT tentativas FROM envios_pendentes WHERE id=?", (envio_id,)).fetchone()[0]
+        if not 400 <= erro.status < 500 and tentativas < MAX_TENTATIVAS_ENVIO:
+            return False
+        conn.execute("UPDATE envios_pendentes SET recusado_em=? WHERE id=?",
+                     (time.time(), envio_id))
+    log.error("Sessão %d recusada pelo servidor após %d tentativa(s), fora da fila "
+              "de envio (ver replica.reenviar_recusadas): %s", envio_id, tentativas, erro)
+    return True
+
+
+def _enviar(cliente, envios):
+    cliente.registrar_sessoes([(d["sessao"], d["respostas"]) for _, d in envios])
+    with transacao() as conn:
+        conn.executemany("DELETE FROM envios_pendentes WHERE id=?",
+                         [(envio_id,) for envio_id, _ in envios])
+
+
+def enviar_pendentes(cliente, tamanho_lote=TAMANHO_LOTE_ENVIO):
+    """
+    Envia a fila em lotes (o uid de cada sessão evita duplicar no servidor
+    se um envio for repetido). Um lote recusado pelo servidor é reenviado
+    uma sessão por vez, para que uma sessão com problema não segure as
+    outras, e a que o servidor recusar de vez sai da fila (ver _recusar);
+    sem resposta do servidor, para e tenta na próxima rodada.
+    Retorna quantas sessões enviou.
+    """
+    pendentes = [(envio_id, json.loads(dados)) for envio_id, dados in conectar().execute(
+        "SELECT id, dados FROM envios_pendentes WHERE recusado_em IS NULL "
+        "ORDER BY tentativas, id")]
+    enviados = 0
+    for inicio in range(0, len(pendentes), tamanho_lote):
+        lote = pendentes[inicio:inicio + tamanho_lote]
+        try:
+            _enviar(cliente, lote)
+            enviados += len(lote)
+            continue
+        except ErroServidor as e:
+            if e.status is None:
+                _marcar_falha([envio_id for envio_id, _ in lote], e)
+                raise
+        for envio in lote:
+            try:
+                _enviar(cliente, [envio])
+                enviados += 1
+            except ErroServidor as e:
+                if e.status is None:
+                    _marcar_falha([envio[0]], e)
+                    raise
+                if not _recusar(envio[0], e):
+                    log.error("Sessão %d recusada pelo servidor: %s", envio[0], e)
+    return enviados
+
+
+def contar_pendentes():
+    """Quantas sessões ainda estão na fila de envio."""
+    return conectar().execute(
+        "SELECT COUNT(*) FROM envios_pendentes WHERE recusado_em IS NULL").fetchone()[0]
+
+
+def listar_recusadas():
+    """[(id, tentativas, ultimo_erro, criado_em)] das sessões fora da fila."""
+    return conectar().execute("""
+        SELECT id, tentativas, ultimo_erro, criado_em FROM envios_pendentes
+        WHERE recusado_em IS NOT NULL ORDER BY id
+    """).fetchall()
+
+
+def reenviar_recusadas(ids=None):
+    """
+    Devolve à fila as sessões recusadas (todas, ou só as de `ids`), depois
+    de corrigido o problema no servidor. Retorna quantas voltaram.
+    """
+    with transacao() as conn:
+        if ids is None:
+            cursor = conn.execute("""
+                UPDATE envios_pendentes SET recusado_em=NULL, tentativas=0
+                WHERE recusado_em IS NOT NULL
+            """)
+        else:
+            cursor = conn.executemany("""
+                UPDATE envios_pendentes SET recusado_em=NULL, tentativas=0
+                WHERE recusado_em IS NOT NULL AND id=?
+            """, [(envio_id,) for envio_id in ids])
+        return cursor.rowcount
+
+
+class BackendReplica(BackendLocal):
+    """
+    Lê testes e imagens da réplica local (como o BackendLocal) e manda os
+    resultados pela fila. Uma thread envia a fila e sincroniza a réplica a
+    cada INTERVALO_SINCRONIZACAO_S, ou logo que uma sessão termina.
+    """
+
+    remoto = True
+
+    def __init__(self, url):
+        database.definir_nome_banco(ARQUIVO_REPLICA)
+        database.criar_tabelas()
+        self.cliente = BackendRemoto(url)
+        self.alteracoes = 0  # soma 1 a cada sincronização que mudou algo
+        self.ultima_sincronizacao = None  # time.time() da última que deu certo
+        self.erro = None  # último problema de rede, se houver
+        self._acordar = threading.Event()
+        threading.Thread(target=self._trabalhar, name="replica", daemon=True).start()
+
+    def sortear_questoes(self, teste_id, historico_ate=None):
+        # A réplica não tem o histórico de respostas das outras estações:
+        # sorteio sem pesos, registrado assim na sessão (ver registrar_sessao)
+        from sorteio import sortear_questoes
+        return sortear_questoes(teste_id, historico_ate=historico_ate, ponderar=False)
+
+    def registrar_sessao(self, sessao, respostas):
+        """Coloca a sessão na fila de envio. Não há id do servidor ainda: retorna None."""
+        enfileirar_sessao(dict(sessao, ponderado=0, uid=uuid.uuid4().hex), respostas)
+        self._acordar.set()
+        return None
+
+    def _trabalhar(self):
+        while True:
+            try:
+                enviar_pendentes(self.cliente)
+                if sincronizar(self.cliente):
+                    self.alteracoes += 1
+                self.ultima_sincronizacao = time.time()
+                self.erro = None
+            except ErroServidor as e:
+                if self.erro is None:
+                    log.warning("Servidor indisponível, usando a cópia local: %s", e)
+                self.erro = str(e)
+            except Exception:
+                log.exception("Falha na sincronização da réplica")
+            self._acordar.wait(INTERVALO_SINCRONIZACAO_S)
+            self._acordar.clear()
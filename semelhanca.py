@@ -0,0 +1,458 @@
+# semelhanca.py - hash perceptual das imagens, para achar fotos repetidas
+#
+# A mesma foto gravada duas vezes (com outro nome, outra compressão ou outro
+# tamanho) tem dhash quase igual: poucos dos 64 bits mudam. Para não comparar
+# cada foto com todas, o dhash é dividido em 4 bandas de 16 bits: se duas
+# fotos diferem em até 7 bits, alguma banda difere em no máximo 1 bit, então
+# basta procurar cada banda e as 16 variações dela com um bit trocado.
+#
+# O dhash só escolhe as candidatas: fotos diferentes da mesma peça (que
+# mudam numa região pequena, ex.: a peça com e sem defeito) também ficam a
+# poucos bits. Cada candidata é confirmada pela miniatura em cinza de 64x64:
+# a mesma foto recomprimida ou redimensionada não tem nenhum pixel muito
+# diferente, e a região que mudou entre duas fotos da peça tem. Como essa
+# região é pequena, nenhum hash mais grosso que a miniatura separa essas
+# fotos: as candidatas de uma busca são conferidas todas de uma vez, com as
+# miniaturas em memória (IndiceSemelhanca), e cada miniatura sai do banco
+# uma vez só. Ver benchmarks/bench_semelhanca.py.
+import os
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image, ImageChops
+
+from database import conectar, transacao, abrir_blob_conteudo
+
+DISTANCIA_MAXIMA = 3  # Bits diferentes (de 64) para ser candidata (até 7)
+LADO_CINZA = 64  # Lado da miniatura em cinza usada na confirmação
+# Maior diferença (de 255) aceita num pixel da miniatura. Nas fotos de
+# imagens/Teste 1, a mesma foto em JPEG de qualidade 30 a 200x200 chega a
+# 54; fotos diferentes da peça começam em 79. Não há um valor que sirva
+# para qualquer foto: com 300 fotos geradas com marcas de borda dura
+# (benchmarks/bench_semelhanca.py --calibrar 300), as cópias reduzidas a
+# 37% em JPEG 30 chegam a 89 e as fotos diferentes começam em 101. Meça
+# com --calibrar nas fotos do teste e ajuste por DIFERENCA_MAXIMA_TESTES
+# ou pelo parâmetro `diferenca` das buscas (cli.py duplicatas --diferenca).
+DIFERENCA_MAXIMA = int(os.environ.get("DIFERENCA_MAXIMA_TESTES", 64))
+NUM_BANDAS = 4
+BITS_BANDA = 16
+NUM_TRABALHADORES = 4  # Threads que calculam as assinaturas que faltam
+TAMANHO_LOTE = 500  # Assinaturas gravadas por transação
+LINHAS_POR_COMPARACAO = 2048  # Miniaturas comparadas por operação do numpy
+
+_BITS = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _com_sinal(valor):
+    """O SQLite guarda inteiros de 64 bits com sinal."""
+    return valor - (1 << 64) if valor >= 1 << 63 else valor
+
+
+def _sem_sinal(valor):
+    return valor & 0xFFFFFFFFFFFFFFFF
+
+
+def _bandas(dhash):
+    return [(dhash >> (BITS_BANDA * i)) & 0xFFFF for i in range(NUM_BANDAS)]
+
+
+def _vizinhas(banda):
+    """A banda e as variações dela com um bit trocado."""
+    return [banda] + [banda ^ (1 << bit) for bit in range(BITS_BANDA)]
+
+
+def distancia(a, b):
+    """Bits diferentes entre dois hashes."""
+    return (_sem_sinal(a) ^ _sem_sinal(b)).bit_count()
+
+
+def calcular_assinatura(fonte):
+    """
+    Assinatura da imagem em `fonte` (bytes, caminho ou arquivo), na ordem
+    das colunas de assinaturas: (dhash, ahash, banda0, ..., banda3, cinza).
+    dHash: em 9x8 tons de cinza, se cada pixel é mais claro que o da direita.
+    aHash: em 8x8, se cada pixel é mais claro que a média.
+    cinza: os pixels da miniatura em cinza (ver mesma_foto).
+    """
+    with Image.open(BytesIO(fonte) if isinstance(fonte, bytes) else fonte) as imagem:
+        # JPEG: decodifica já reduzido, mas com folga para a média do BOX
+        imagem.draft("L", (LADO_CINZA * 4, LADO_CINZA * 4))
+        cinza = imagem.convert("L")
+
+    pixels = cinza.resize((9, 8), Image.BOX).tobytes()
+    dhash = 0
+    for linha in range(8):
+        for coluna in range(8):
+            i = linha * 9 + coluna
+            dhash = (dhash << 1) | (pixels[i] > pixels[i + 1])
+
+    pixels = cinza.resize((8, 8), Image.BOX).tobytes()
+    media = sum(pixels) / len(pixels)
+    ahash = 0
+    for pixel in pixels:
+        ahash = (ahash << 1) | (pixel > media)
+
+    return (_com_sinal(dhash), _com_sinal(ahash), *_bandas(dhash),
+            cinza.resize((LADO_CINZA, LADO_CINZA), Image.BOX).tobytes())
+
+
+def mesma_foto(cinza_a, cinza_b, maximo=None):
+    """Se nenhum pixel das duas miniaturas em cinza difere mais que `maximo` (DIFERENCA_MAXIMA)."""
+    if maximo is None:
+        maximo = DIFERENCA_MAXIMA
+    a = Image.frombytes("L", (LADO_CINZA, LADO_CINZA), cinza_a)
+    b = Image.frombytes("L", (LADO_CINZA, LADO_CINZA), cinza_b)
+    return ImageChops.difference(a, b).getextrema()[1] <= maximo
+
+
+def _cinza(hash_conteudo):
+    """
+    Miniatura em cinza de um conteúdo do banco. As assinaturas gravadas
+    antes da coluna existir são completadas aqui, na primeira vez. None se
+    o PIL não abre o conteúdo.
+    """
+    row = conectar().execute(
+        "SELECT cinza FROM assinaturas WHERE hash=?", (hash_conteudo,)).fetchone()
+    if row and row[0] is not None:
+        return row[0]
+    _, assinatura = _assinar_conteudo(hash_conteudo)
+    if assinatura is None:
+        return None
+    _gravar_assinaturas([(hash_conteudo,) + assinatura])
+    return assinatura[-1]
+
+
+def _cinzas_do_banco(hashes):
+    """{hash: miniatura em cinza (ou None)} de vários conteúdos, lidos de uma vez."""
+    conn = conectar()
+    cinzas = {}
+    for inicio in range(0, len(hashes), 500):
+        parte = hashes[inicio:inicio + 500]
+        cinzas.update(conn.execute(
+            f"SELECT hash, cinza FROM assinaturas WHERE hash IN ({','.join('?' * len(parte))})",
+            parte))
+    for hash_conteudo in hashes:
+        if cinzas.get(hash_conteudo) is None:
+            cinzas[hash_conteudo] = _cinza(hash_conteudo)
+    return cinzas
+
+
+def _contar_bits(valores):
+    """Bits ligados de cada valor de um array de uint64."""
+    if hasattr(np, "bitwise_count"):  # numpy 2
+        return np.bitwise_count(valores)
+    return _BITS[np.ascontiguousarray(valores).view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+def _reduzir(cinzas):
+    """
+    Médias dos blocos 4x4 das miniaturas (16x16). Se nenhum pixel de duas
+    miniaturas difere mais que d, nenhuma média difere mais que d (+1 do
+    arredondamento): comparar as reduzidas antes descarta sem perder nada.
+    """
+    lado = LADO_CINZA // 4
+    blocos = cinzas.reshape(-1, lado, 4, lado, 4).astype(np.uint16).sum(axis=(2, 4))
+    return ((blocos + 8) // 16).astype(np.uint8).reshape(-1, lado * lado)
+
+
+def _maiores_diferencas(cinzas, consulta):
+    """Maior diferença de pixel de cada linha de `cinzas` para `consulta`."""
+    return (np.maximum(cinzas, consulta) - np.minimum(cinzas, consulta)).max(axis=1)
+
+
+def _ampliar(array, linhas, valor=0):
+    novo = np.full((linhas,) + array.shape[1:], valor, dtype=array.dtype)
+    novo[:len(array)] = array
+    return novo
+
+
+class IndiceSemelhanca:
+    """
+    Índice em memória por bandas (o mesmo esquema das colunas banda0..3),
+    para comparar muitas assinaturas de uma vez. As chaves são livres
+    (hash do conteúdo, nome do arquivo...). Os hashes e as miniaturas em
+    cinza ficam em arrays do numpy, e as candidatas de uma busca são
+    conferidas de uma vez, sem laço em Python por candidata.
+    carregar_cinzas(chaves) -> {chave: cinza}: de onde vêm as miniaturas
+    das assinaturas adicionadas sem ela (ex.: _cinzas_do_banco); cada uma
+    é carregada uma vez, quando vira candidata pela primeira vez.
+    """
+
+    def __init__(self, carregar_cinzas=None):
+        self._bandas = [{} for _ in range(NUM_BANDAS)]  # valor da banda -> [linhas]
+        self._chaves = []  # linha -> chave
+        self._linhas = {}  # chave -> linha
+        self._hashes = np.zeros((0, 2), dtype=np.uint64)  # (dhash, ahash) sem sinal
+        # Linha -> posição em _cinzas; -1: ainda não carregada, -2: não tem
+        self._posicao_cinza = np.zeros(0, dtype=np.int64)
+        self._cinzas = np.zeros((0, LADO_CINZA * LADO_CINZA), dtype=np.uint8)
+        self._reduzidas = np.zeros((0, (LADO_CINZA // 4) ** 2), dtype=np.uint8)  # _reduzir
+        self._num_cinzas = 0
+        self._carregar_cinzas = carregar_cinzas
+
+    def __len__(self):
+        return len(self._chaves)
+
+    def adicionar(self, chave, assinatura):
+        linha = len(self._chaves)
+        if linha == len(self._hashes):
+            self._hashes = _ampliar(self._hashes, max(64, 2 * linha))
+            self._posicao_cinza = _ampliar(self._posicao_cinza, len(self._hashes), -1)
+        dhash = _sem_sinal(assinatura[0])
+        self._hashes[linha] = (dhash, _sem_sinal(assinatura[1]))
+        self._chaves.append(chave)
+        self._linhas[chave] = linha
+        if len(assinatura) > 6 and assinatura[6] is not None:
+            self._guardar_cinza(linha, assinatura[6])
+        for indice, banda in zip(self._bandas, _bandas(dhash)):
+            indice.setdefault(banda, []).append(linha)
+
+    def _guardar_cinza(self, linha, cinza):
+        if cinza is None:
+            self._posicao_cinza[linha] = -2
+            return
+        if self._num_cinzas == len(self._cinzas):
+            self._cinzas = _ampliar(self._cinzas, max(64, 2 * self._num_cinzas))
+            self._reduzidas = _ampliar(self._reduzidas, len(self._cinzas))
+        self._cinzas[self._num_cinzas] = np.frombuffer(cinza, dtype=np.uint8)
+        self._reduzidas[self._num_cinzas] = _reduzir(self._cinzas[self._num_cinzas])
+        self._posicao_cinza[linha] = self._num_cinzas
+        self._num_cinzas += 1
+
+    def _completar(self, linhas):
+        """Carrega as miniaturas que faltam dessas linhas (ver carregar_cinzas)."""
+        faltam = linhas[self._posicao_cinza[linhas] == -1]
+        if not len(faltam):
+            return
+        if self._carregar_cinzas is None:
+            self._posicao_cinza[faltam] = -2
+            return
+        cinzas = self._carregar_cinzas([self._chaves[linha] for linha in faltam.tolist()])
+        for linha in faltam.tolist():
+            self._guardar_cinza(linha, cinzas.get(self._chaves[linha]))
+
+    def cinza(self, chave):
+        """Miniatura em cinza de uma chave já adicionada, ou None."""
+        linha = self._linhas[chave]
+        self._completar(np.array([linha]))
+        posicao = self._posicao_cinza[linha]
+        return self._cinzas[posicao].tobytes() if posicao >= 0 else None
+
+    def _candidatas(self, dhash, ahash, maximo):
+        """(linhas, distâncias) com dhash e ahash a até `maximo` bits."""
+        dhash, ahash = _sem_sinal(dhash), _sem_sinal(ahash)
+        listas = [indice[vizinha] for indice, banda in zip(self._bandas, _bandas(dhash))
+                  for vizinha in _vizinhas(banda) if vizinha in indice]
+        total = len(self._chaves)
+        if sum(map(len, listas)) > total // 4:
+            # Fotos da mesma peça: quase todas são candidatas, e comparar
+            # os hashes de todas sai mais barato que juntar as listas
+            linhas = np.arange(total)
+        else:
+            # a mesma linha pode aparecer por mais de uma banda
+            linhas = np.unique(np.fromiter(
+                (linha for lista in listas for linha in lista), dtype=np.int64))
+        hashes = self._hashes[linhas]
+        distancias = _contar_bits(hashes[:, 0] ^ np.uint64(dhash))
+        perto = (distancias <= maximo) & (_contar_bits(hashes[:, 1] ^ np.uint64(ahash)) <= maximo)
+        return linhas[perto], distancias[perto]
+
+    def _conferir(self, linhas, cinza, diferenca):
+        """Quais das linhas são a mesma foto que a miniatura `cinza` (ver mesma_foto)."""
+        if diferenca is None:
+            diferenca = DIFERENCA_MAXIMA
+        self._completar(linhas)
+        posicoes = self._posicao_cinza[linhas]
+        mesma = np.zeros(len(linhas), dtype=bool)
+        consulta = np.frombuffer(cinza, dtype=np.uint8)
+        reduzida = _reduzir(consulta)[0]
+        for inicio in range(0, len(linhas), LINHAS_POR_COMPARACAO):
+            parte = posicoes[inicio:inicio + LINHAS_POR_COMPARACAO]
+            indices = np.flatnonzero(parte >= 0)
+            perto = _maiores_diferencas(self._reduzidas[parte[indices]], reduzida) <= diferenca + 1
+            indices = indices[perto]
+            maiores = _maiores_diferencas(self._cinzas[parte[indices]], consulta)
+            mesma[inicio + indices[maiores <= diferenca]] = True
+        return mesma
+
+    def procurar(self, assinatura, maximo=DISTANCIA_MAXIMA, diferenca=None):
+        """
+        [(chave, distância)] das assinaturas parecidas já adicionadas. Se a
+        assinatura tem a miniatura (a de calcular_assinatura tem), as
+        candidatas são confirmadas como em mesma_foto; só com (dhash, ahash),
+        a confirmação fica com quem chama.
+        """
+        linhas, distancias = self._candidatas(assinatura[0], assinatura[1], maximo)
+        if len(assinatura) > 6 and len(linhas):
+            mesma = self._conferir(linhas, assinatura[6], diferenca)
+            linhas, distancias = linhas[mesma], distancias[mesma]
+        return [(self._chaves[linha], d) for linha, d in zip(linhas.tolist(), distancias.tolist())]
+
+    def procurar_chave(self, chave, maximo=DISTANCIA_MAXIMA, diferenca=None):
+        """Como procurar, para uma chave já adicionada (sem ela mesma), com a miniatura dela."""
+        linha = self._linhas[chave]
+        dhash, ahash = self._hashes[linha].tolist()
+        linhas, distancias = self._candidatas(dhash, ahash, maximo)
+        outras = linhas != linha
+        linhas, distancias = linhas[outras], distancias[outras]
+        cinza = self.cinza(chave) if len(linhas) else None
+        if cinza is None:
+            return []
+        mesma = self._conferir(linhas, cinza, diferenca)
+        return [(self._chaves[linha], d)
+                for linha, d in zip(linhas[mesma].tolist(), distancias[mesma].tolist())]
+
+
+def indice_do_banco():
+    """
+    IndiceSemelhanca de todas as assinaturas gravadas (chave: hash do
+    conteúdo); as miniaturas são lidas do banco só quando viram candidatas.
+    Para muitas buscas seguidas, como numa importação (ver imagens_semelhantes).
+    """
+    indice = IndiceSemelhanca(_cinzas_do_banco)
+    for hash_conteudo, dhash, ahash in conectar().execute(
+            "SELECT hash, dhash, ahash FROM assinaturas"):
+        indice.adicionar(hash_conteudo, (dhash, ahash))
+    return indice
+
+
+def imagens_semelhantes(assinatura, maximo=DISTANCIA_MAXIMA, diferenca=None, indice=None):
+    """
+    Imagens do banco parecidas com a assinatura e, se a assinatura tem a
+    miniatura, confirmadas como em mesma_foto:
+    [(imagem_id, teste_id, nome_arquivo, resposta_correta, distância)].
+    As candidatas vêm de `indice` (ver indice_do_banco) ou, sem ele, dos
+    índices das bandas no banco.
+    """
+    if indice is None:
+        bandas = _bandas(_sem_sinal(assinatura[0]))
+        condicoes, params = [], []
+        for numero, banda in enumerate(bandas):
+            vizinhas = _vizinhas(banda)
+            condicoes.append(f"banda{numero} IN ({','.join('?' * len(vizinhas))})")
+            params.extend(vizinhas)
+        # Cada banda usa o seu índice; o OR vira a união das quatro buscas
+        indice = IndiceSemelhanca(_cinzas_do_banco)
+        for hash_conteudo, dhash, ahash in conectar().execute(f"""
+                SELECT hash, dhash, ahash FROM assinaturas WHERE {" OR ".join(condicoes)}
+                """, params):
+            indice.adicionar(hash_conteudo, (dhash, ahash))
+
+    distancias = dict(indice.procurar(assinatura, maximo, diferenca))
+    if not distancias:
+        return []
+    rows = conectar().execute(f"""
+        SELECT id, teste_id, nome_arquivo, resposta_correta, hash FROM imagens
+        WHERE hash IN ({",".join("?" * len(distancias))})
+    """, list(distancias)).fetchall()
+    return [(id, teste_id, nome, resposta, distancias[hash_conteudo])
+            for id, teste_id, nome, resposta, hash_conteudo in rows]
+
+
+def _assinar_conteudo(hash_conteudo):
+    with abrir_blob_conteudo(hash_conteudo) as blob:
+        if blob is None:
+            return hash_conteudo, None
+        try:
+            return hash_conteudo, calcular_assinatura(blob)
+        except Exception:
+            return hash_conteudo, None  # imagem que o PIL não abre fica sem
+
+
+def _gravar_assinaturas(linhas):
+    """Grava [(hash, *assinatura)], substituindo as que já existem."""
+    with transacao() as conn:
+        conn.executemany("""
+            INSERT OR REPLACE INTO assinaturas
+                (hash, dhash, ahash, banda0, banda1, banda2, banda3, cinza)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, linhas)
+
+
+def indexar_pendentes(progresso=None, trabalhadores=NUM_TRABALHADORES):
+    """
+    Calcula a assinatura dos conteúdos que ainda não têm (gravados antes
+    desta tabela existir ou por compactar_banco) ou que não têm a
+    miniatura em cinza (gravados antes dela existir). Retorna quantos calculou.
+    """
+    hashes = [row[0] for row in conectar().execute("""
+        SELECT c.hash FROM conteudos c
+        LEFT JOIN assinaturas a ON a.hash = c.hash
+        WHERE a.hash IS NULL OR a.cinza IS NULL
+    """)]
+    feitas = 0
+    lote = []
+
+    def gravar():
+        _gravar_assinaturas(lote)
+        lote.clear()
+
+    with ThreadPoolExecutor(max_workers=trabalhadores) as executor:
+        for i, (hash_conteudo, assinatura) in enumerate(
+                executor.map(_assinar_conteudo, hashes), 1):
+            if assinatura is not None:
+                lote.append((hash_conteudo,) + assinatura)
+                feitas += 1
+            if len(lote) >= TAMANHO_LOTE:
+                gravar()
+            if progresso:
+                progresso(i, len(hashes))
+    if lote:
+        gravar()
+    return feitas
+
+
+def relatorio_duplicatas(maximo=DISTANCIA_MAXIMA, teste_id=None, progresso=None,
+                         diferenca=None):
+    """
+    Agrupa as imagens do banco que são a mesma foto (conteúdo idêntico ou
+    assinatura parecida). Com teste_id, só olha as imagens desse teste.
+    Retorna uma lista de grupos, os com respostas OK e NOK misturadas
+    primeiro: {"conflito": bool, "imagens": [(id, teste, nome_arquivo, resposta)]}.
+    """
+    indexar_pendentes(progresso)
+    conn = conectar()
+    filtro = "WHERE i.teste_id = ?" if teste_id is not None else ""
+    params = (teste_id,) if teste_id is not None else ()
+    imagens_por_hash = {}
+    for id, teste, nome, resposta, hash_conteudo in conn.execute(f"""
+            SELECT i.id, t.nome, i.nome_arquivo, i.resposta_correta, i.hash
+            FROM imagens i JOIN testes t ON t.id = i.teste_id {filtro}
+            """, params):
+        imagens_por_hash.setdefault(hash_conteudo, []).append((id, teste, nome, resposta))
+
+    # União dos conteúdos parecidos (cada par é achado uma vez: só se
+    # procura entre os já adicionados)
+    pai = {}  # só para quem não é raiz
+
+    def raiz(h):
+        caminho = []
+        while h in pai:
+            caminho.append(h)
+            h = pai[h]
+        for c in caminho:
+            pai[c] = h
+        return h
+
+    # As miniaturas só são lidas do banco quando viram candidatas
+    indice = IndiceSemelhanca(_cinzas_do_banco)
+    for hash_conteudo, dhash, ahash in conn.execute(
+            "SELECT hash, dhash, ahash FROM assinaturas").fetchall():
+        if hash_conteudo not in imagens_por_hash:
+            continue
+        indice.adicionar(hash_conteudo, (dhash, ahash))
+        for outro, _ in indice.procurar_chave(hash_conteudo, maximo, diferenca):
+            a, b = raiz(outro), raiz(hash_conteudo)
+            if a != b:
+                pai[a] = b
+
+    grupos = {}
+    for hash_conteudo, imagens in imagens_por_hash.items():
+        grupos.setdefault(raiz(hash_conteudo), []).extend(imagens)
+    resultado = [
+        {"conflito": len({img[3] for img in imagens}) > 1, "imagens": sorted(imagens)}
+        for imagens in grupos.values() if len(imagens) > 1
+    ]
+    resultado.sort(key=lambda g: (not g["conflito"], -len(g["imagens"])))
+    return resultado
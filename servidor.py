@@ -0,0 +1,465 @@
+# servidor.py - serviço HTTP/JSON que é o único dono do testes.db
+#
+# Uso: python servidor.py [--banco testes.db] [--host 0.0.0.0] [--porta 8765]
+# Nas estações: SERVIDOR_TESTES=http://<este PC>:8765 (ver backend.py).
+#
+#   GET  /saude
+#   GET  /testes?depois=NOME&limite=N&busca=TEXTO     {"testes": [[id, nome, descricao]]}
+#   GET  /testes/contagem?busca=TEXTO                 {"total": n}
+#   GET  /testes/ID/questoes?historico_ate=&semente=  {"questoes": [[id, nome, resposta]], "semente": s,
+#                                                      "sorteio": {...}}  (ver sorteio.sortear_questoes)
+#   GET  /imagens/ID                                  a imagem original (aceita Range)
+#   GET  /imagens/ID/miniatura?largura=&altura=&ajustar=0|1&formato=PNG|JPEG
+#   POST /sessoes  {"sessao": {...}, "respostas": [[imagem_id, nome, resposta, correta, tempo_ms]]}
+#   POST /sessoes/lote  {"sessoes": [{"sessao": ..., "respostas": ...}]}   {"ids": [...]}
+#   GET  /sincronizar?desde=VERSAO&limite=N   alterações para as réplicas (database.alteracoes_desde)
+#   GET  /conteudos/HASH                      bytes de um conteúdo (nunca mudam)
+#
+# Imagens e conteúdos saem do BLOB em pedaços de database.TAMANHO_PEDACO,
+# cada um lido no pool e escrito na conexão antes do próximo: uma foto
+# grande não passa inteira pela memória do servidor.
+#
+# As imagens levam ETag (o hash do conteúdo): um GET com If-None-Match
+# igual recebe 304 sem corpo. O HTTP é o mínimo do 1.1 (keep-alive,
+# Content-Length), só com a biblioteca padrão. O acesso ao banco roda num
+# pool de threads, cada uma com a sua conexão (database.conectar).
+import sys
+import json
+import asyncio
+import logging
+import argparse
+from urllib.parse import urlsplit, parse_qs
+from concurrent.futures import ThreadPoolExecutor
+from email.utils import formatdate
+
+import database
+
+PORTA = 8765
+NUM_TRABALHADORES = 8  # Threads com conexão ao banco
+MAX_CORPO = 16 * 1024 * 1024  # Maior corpo de POST aceito
+MAX_CABECALHO = 64 * 1024
+ESPERA_OCIOSA_S = 60  # Fecha conexões keep-alive paradas há mais tempo
+MAX_AGE_IMAGENS = 3600  # Cache-Control das imagens (o ETag confirma depois disso)
+
+log = logging.getLogger(__name__)
+
+MOTIVOS = {200: "OK", 201: "Created", 206: "Partial Content", 304: "Not Modified",
+           400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+           413: "Payload Too Large", 416: "Range Not Satisfiable",
+           500: "Internal Server Error"}
+
+
+class ErroHttp(Exception):
+    def __init__(self, status, mensagem):
+        super().__init__(mensagem)
+        self.status = status
+
+
+class Resposta:
+    """
+    Corpo em `corpo` (bytes) ou, para os BLOBs, em `pedacos`: iterador
+    assíncrono de bytes, com o total em `tamanho`.
+    """
+
+    def __init__(self, status=200, corpo=b"", tipo="application/json", cabecalhos=None,
+                 pedacos=None, tamanho=None):
+        self.status = status
+        self.corpo = corpo
+        self.tipo = tipo
+        self.cabecalhos = cabecalhos or {}
+        self.pedacos = pedacos
+        self.tamanho = len(corpo) if pedacos is None else tamanho
+
+
+def _json(dados, status=200):
+    return Resposta(status, json.dumps(dados, ensure_ascii=False).encode("utf-8"),
+                    "application/json; charset=utf-8")
+
+
+def _inteiro(query, nome, padrao=None):
+    """Parâmetro inteiro da query string (ErroHttp 400 se não for número)."""
+    valor = query.get(nome)
+    if not valor:
+        return padrao
+    try:
+        return int(valor)
+    except ValueError:
+        raise ErroHttp(400, f"Parâmetro {nome} deve ser um número: {valor}")
+
+
+def _tipo_imagem(inicio):
+    """Content-Type pelos primeiros bytes (o banco não guarda o formato)."""
+    if inicio.startswith(b"\xff\xd8"):
+        return "image/jpeg"
+    if inicio.startswith(b"\x89PNG"):
+        return "image/png"
+    if inicio[:6] in (b"GIF87a", b"GIF89a"):
+        return "image/gif"
+    if inicio.startswith(b"BM"):
+        return "image/bmp"
+    if inicio[:4] in (b"II*\x00", b"MM\x00*"):
+        return "image/tiff"
+    if inicio.startswith(b"RIFF") and inicio[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+
+def _intervalo(cabecalho, tamanho):
+    """(início, fim inclusivo) de um Range "bytes=a-b"; None se ausente ou inválido."""
+    if not cabecalho or not cabecalho.startswith("bytes=") or "," in cabecalho:
+        return None
+    inicio, _, fim = cabecalho[6:].strip().partition("-")
+    try:
+        if not inicio:  # bytes=-N: os últimos N
+            inicio, fim = max(0, tamanho - int(fim)), tamanho - 1
+        else:
+            inicio, fim = int(inicio), min(int(fim) if fim else tamanho - 1, tamanho - 1)
+    except ValueError:
+        return None
+    if inicio > fim:
+        raise ErroHttp(416, "Intervalo fora da imagem")
+    return inicio, fim
+
+
+# ---- acesso ao banco (rodam nas threads do pool) ----
+
+def _ler_original(imagem_id, faixa, etag_cliente):
+    """
+    (hash, etag, tipo, tamanho total, primeiro pedaço, intervalo) da imagem,
+    com o pedaço None se o cliente já tem essa versão; None se a imagem não
+    existe. O resto do intervalo vem depois por _ler_pedaco.
+    """
+    hash_conteudo = database.obter_hash(imagem_id)
+    if hash_conteudo is None:
+        return None
+    with database.abrir_blob_conteudo(hash_conteudo) as blob:
+        if blob is None:
+            return None
+        etag = f'"{hash_conteudo}"'
+        tamanho = len(blob)
+        tipo = _tipo_imagem(blob.read(12))
+        if etag == etag_cliente:
+            return hash_conteudo, etag, tipo, tamanho, None, None
+        intervalo = _intervalo(faixa, tamanho)
+        inicio, fim = intervalo if intervalo else (0, tamanho - 1)
+        blob.seek(inicio)
+        pedaco = blob.read(min(database.TAMANHO_PEDACO, fim - inicio + 1))
+        return hash_conteudo, etag, tipo, tamanho, pedaco, (inicio, fim) if intervalo else None
+
+
+def _ler_miniatura(imagem_id, tamanho, ajustar, formato, etag_cliente):
+    """(etag, bytes) da miniatura, como _ler_original."""
+    from miniaturas import obter_miniatura
+    hash_conteudo = database.obter_hash(imagem_id)
+    if hash_conteudo is None:
+        return None
+    etag = f'"{hash_conteudo}-{tamanho[0]}x{tamanho[1]}-{int(ajustar)}-{formato}"'
+    if etag == etag_cliente:
+        return etag, None
+    dados = obter_miniatura(imagem_id, tamanho, ajustar, formato)
+    return (etag, dados) if dados is not None else None
+
+
+def _ler_conteudo(hash_conteudo):
+    """(tamanho, tipo, primeiro pedaço) do conteúdo; None se não existe."""
+    with database.abrir_blob_conteudo(hash_conteudo) as blob:
+        if blob is None:
+            return None
+        pedaco = blob.read(database.TAMANHO_PEDACO)
+        return len(blob), _tipo_imagem(pedaco[:12]), pedaco
+
+
+def _ler_pedaco(hash_conteudo, inicio, tamanho):
+    """Até `tamanho` bytes do conteúdo a partir de `inicio`; None se ele sumiu."""
+    with database.abrir_blob_conteudo(hash_conteudo) as blob:
+        if blob is None:
+            return None
+        blob.seek(inicio)
+        return blob.read(tamanho)
+
+
+def _corpo_json(pedido):
+    try:
+        corpo = json.loads(pedido["corpo"])
+    except ValueError:
+        raise ErroHttp(400, "Corpo não é JSON")
+    if not isinstance(corpo, dict):
+        raise ErroHttp(400, "Corpo deve ser um objeto JSON")
+    return corpo
+
+
+def _sessao_do_corpo(corpo):
+    """(sessao, respostas) de {"sessao": {...}, "respostas": [[...]]}."""
+    try:
+        sessao, respostas = corpo["sessao"], [tuple(r) for r in corpo["respostas"]]
+    except (KeyError, TypeError):
+        raise ErroHttp(400, "Sessão deve ser {\"sessao\": {...}, \"respostas\": [...]}")
+    if not isinstance(sessao, dict):
+        raise ErroHttp(400, "Sessão deve ser um objeto JSON")
+    return sessao, respostas
+
+
+class Servidor:
+    def __init__(self, trabalhadores=NUM_TRABALHADORES):
+        self.executor = ThreadPoolExecutor(max_workers=trabalhadores,
+                                           thread_name_prefix="servidor")
+        # Partes do caminho: texto fixo, ou int/str para os parâmetros
+        self.rotas = [
+            ("GET", ("saude",), self.saude),
+            ("GET", ("testes",), self.listar_testes),
+            ("GET", ("testes", "contagem"), self.contar_testes),
+            ("GET", ("testes", int, "questoes"), self.sortear),
+            ("GET", ("imagens", int), self.imagem),
+            ("GET", ("imagens", int, "miniatura"), self.miniatura),
+            ("POST", ("sessoes",), self.registrar_sessao),
+            ("POST", ("sessoes", "lote"), self.registrar_lote),
+            ("GET", ("sincronizar",), self.sincronizar),
+            ("GET", ("conteudos", str), self.conteudo),
+        ]
+
+    def _no_pool(self, funcao, *args):
+        return asyncio.get_running_loop().run_in_executor(self.executor, funcao, *args)
+
+    # ---- rotas ----
+
+    async def saude(self, pedido):
+        return _json({"ok": True})
+
+    async def listar_testes(self, pedido):
+        q = pedido["query"]
+        limite = min(_inteiro(q, "limite", 200), 1000)
+        testes = await self._no_pool(database.listar_testes_pagina,
+                                     q.get("depois"), limite, q.get("busca", ""))
+        return _json({"testes": testes})
+
+    async def contar_testes(self, pedido):
+        total = await self._no_pool(database.contar_testes, pedido["query"].get("busca", ""))
+        return _json({"total": total})
+
+    async def sortear(self, pedido, teste_id):
+        from sorteio import sortear_questoes
+        q = pedido["query"]
+        semente = _inteiro(q, "semente")
+        questoes, sorteio = await self._no_pool(
+            lambda: sortear_questoes(teste_id, semente,
+                                     historico_ate=q.get("historico_ate") or None))
+        return _json({"questoes": questoes, "semente": sorteio["semente"], "sorteio": sorteio})
+
+    async def _pedacos(self, hash_conteudo, primeiro, inicio, fim):
+        """O primeiro pedaço (já lido) e os seguintes até `fim`, um por vez."""
+        yield primeiro
+        posicao = inicio + len(primeiro)
+        while posicao <= fim:
+            pedaco = await self._no_pool(_ler_pedaco, hash_conteudo, posicao,
+                                         min(database.TAMANHO_PEDACO, fim - posicao + 1))
+            if not pedaco:
+                # O cabeçalho já foi: só resta fechar a conexão sem completar
+                raise ConnectionError(f"Conteúdo {hash_conteudo} removido durante o envio")
+            yield pedaco
+            posicao += len(pedaco)
+
+    def _cabecalhos_cache(self, etag):
+        return {"ETag": etag, "Cache-Control": f"max-age={MAX_AGE_IMAGENS}"}
+
+    async def imagem(self, pedido, imagem_id):
+        cabecalhos = pedido["cabecalhos"]
+        lido = await self._no_pool(_ler_original, imagem_id, cabecalhos.get("range"),
+                                   cabecalhos.get("if-none-match"))
+        if lido is None:
+            raise ErroHttp(404, "Imagem não encontrada")
+        hash_conteudo, etag, tipo, tamanho, primeiro, intervalo = lido
+        resposta = dict(self._cabecalhos_cache(etag), **{"Accept-Ranges": "bytes"})
+        if primeiro is None:
+            return Resposta(304, cabecalhos=resposta)
+        inicio, fim = intervalo or (0, tamanho - 1)
+        pedacos = self._pedacos(hash_conteudo, primeiro, inicio, fim)
+        if intervalo:
+            resposta["Content-Range"] = f"bytes {inicio}-{fim}/{tamanho}"
+            return Resposta(206, tipo=tipo, cabecalhos=resposta,
+                            pedacos=pedacos, tamanho=fim - inicio + 1)
+        return Resposta(200, tipo=tipo, cabecalhos=resposta, pedacos=pedacos, tamanho=tamanho)
+
+    async def miniatura(self, pedido, imagem_id):
+        q = pedido["query"]
+        tamanho = (_inteiro(q, "largura", 400), _inteiro(q, "altura", 300))
+        if not (0 < tamanho[0] <= 4000 and 0 < tamanho[1] <= 4000):
+            raise ErroHttp(400, "Tamanho inválido")
+        ajustar = q.get("ajustar") == "1"
+        formato = q.get("formato", "PNG").upper()
+        if formato not in ("PNG", "JPEG"):
+            raise ErroHttp(400, "Formato deve ser PNG ou JPEG")
+        lido = await self._no_pool(_ler_miniatura, imagem_id, tamanho, ajustar, formato,
+                                   pedido["cabecalhos"].get("if-none-match"))
+        if lido is None:
+            raise ErroHttp(404, "Imagem não encontrada")
+        etag, dados = lido
+        if dados is None:
+            return Resposta(304, cabecalhos=self._cabecalhos_cache(etag))
+        return Resposta(200, dados, f"image/{formato.lower()}", self._cabecalhos_cache(etag))
+
+    async def registrar_sessao(self, pedido):
+        sessao, respostas = _sessao_do_corpo(_corpo_json(pedido))
+        sessao_id = await self._no_pool(database.registrar_sessao, sessao, respostas)
+        return _json({"id": sessao_id}, 201)
+
+    async def registrar_lote(self, pedido):
+        """Sessões guardadas nas estações enquanto estavam sem rede (ver replica.py)."""
+        corpo = _corpo_json(pedido)
+        if not isinstance(corpo.get("sessoes"), list):
+            raise ErroHttp(400, "Corpo deve ser {\"sessoes\": [...]}")
+        lote = [_sessao_do_corpo(item) for item in corpo["sessoes"]]
+        ids = await self._no_pool(
+            lambda: [database.registrar_sessao(sessao, respostas) for sessao, respostas in lote])
+        return _json({"ids": ids}, 201)
+
+    async def sincronizar(self, pedido):
+        q = pedido["query"]
+        alteracoes = await self._no_pool(database.alteracoes_desde, _inteiro(q, "desde", -1),
+                                         min(_inteiro(q, "limite", 500), 5000))
+        return _json(alteracoes)
+
+    async def conteudo(self, pedido, hash_conteudo):
+        etag = f'"{hash_conteudo}"'
+        # Endereçado pelo hash: o mesmo endereço nunca muda de bytes
+        cabecalhos = {"ETag": etag, "Cache-Control": "max-age=31536000, immutable"}
+        if pedido["cabecalhos"].get("if-none-match") == etag:
+            return Resposta(304, cabecalhos=cabecalhos)
+        lido = await self._no_pool(_ler_conteudo, hash_conteudo)
+        if lido is None:
+            raise ErroHttp(404, "Conteúdo não encontrado")
+        tamanho, tipo, primeiro = lido
+        return Resposta(200, tipo=tipo, cabecalhos=cabecalhos, tamanho=tamanho,
+                        pedacos=self._pedacos(hash_conteudo, primeiro, 0, tamanho - 1))
+
+    # ---- HTTP ----
+
+    def _rota(self, metodo, partes):
+        metodo_errado = False
+        for metodo_rota, padrao, funcao in self.rotas:
+            if len(padrao) != len(partes) or not all(
+                    p == parte if isinstance(p, str) else (p is str or parte.isdigit())
+                    for p, parte in zip(padrao, partes)):
+                continue
+            if metodo_rota != metodo:
+                metodo_errado = True
+                continue
+            args = [p(parte) for p, parte in zip(padrao, partes) if not isinstance(p, str)]
+            return funcao, args
+        raise ErroHttp(405 if metodo_errado else 404,
+                       "Método não permitido" if metodo_errado else "Caminho não encontrado")
+
+    async def _ler_pedido(self, reader):
+        """O próximo pedido da conexão, ou None se o cliente fechou."""
+        try:
+            cabecalho = await reader.readuntil(b"\r\n\r\n")
+        except asyncio.IncompleteReadError:
+            return None
+        except asyncio.LimitOverrunError:
+            raise ErroHttp(400, "Cabeçalho grande demais")
+        linhas = cabecalho.decode("latin-1").split("\r\n")
+        try:
+            metodo, alvo, versao = linhas[0].split(" ")
+        except ValueError:
+            raise ErroHttp(400, "Linha de pedido inválida")
+        cabecalhos = {}
+        for linha in linhas[1:]:
+            if ":" in linha:
+                nome, _, valor = linha.partition(":")
+                cabecalhos[nome.strip().lower()] = valor.strip()
+        try:
+            tamanho = int(cabecalhos.get("content-length") or 0)
+        except ValueError:
+            raise ErroHttp(400, "Content-Length inválido")
+        if tamanho > MAX_CORPO:
+            raise ErroHttp(413, "Corpo grande demais")
+        corpo = await reader.readexactly(tamanho) if tamanho else b""
+        url = urlsplit(alvo)
+        return {
+            "metodo": metodo,
+            "partes": tuple(p for p in url.path.split("/") if p),
+            "query": {k: v[-1] for k, v in parse_qs(url.query).items()},
+            "cabecalhos": cabecalhos,
+            "corpo": corpo,
+            "manter": (cabecalhos.get("connection", "").lower() != "close"
+                       and versao == "HTTP/1.1"),
+        }
+
+    async def _responder(self, writer, resposta, manter):
+        cabecalhos = {
+            "Date": formatdate(usegmt=True),
+            "Content-Length": str(resposta.tamanho),
+            "Connection": "keep-alive" if manter else "close",
+        }
+        if resposta.status != 304:
+            cabecalhos["Content-Type"] = resposta.tipo
+        cabecalhos.update(resposta.cabecalhos)
+        inicio = f"HTTP/1.1 {resposta.status} {MOTIVOS.get(resposta.status, '')}\r\n"
+        inicio += "".join(f"{k}: {v}\r\n" for k, v in cabecalhos.items()) + "\r\n"
+        writer.write(inicio.encode("latin-1"))
+        if resposta.status != 304 and resposta.pedacos is not None:
+            # drain a cada pedaço: um cliente lento não acumula o BLOB no buffer
+            async for pedaco in resposta.pedacos:
+                writer.write(pedaco)
+                await writer.drain()
+        elif resposta.status != 304:
+            writer.write(resposta.corpo)
+        await writer.drain()
+
+    async def atender(self, reader, writer):
+        """Atende os pedidos de uma conexão até o cliente fechar."""
+        try:
+            while True:
+                manter = False
+                try:
+                    pedido = await asyncio.wait_for(self._ler_pedido(reader), ESPERA_OCIOSA_S)
+                    if pedido is None:
+                        break
+                    manter = pedido["manter"]
+                    funcao, args = self._rota(pedido["metodo"], pedido["partes"])
+                    resposta = await funcao(pedido, *args)
+                except ErroHttp as e:
+                    resposta = _json({"erro": str(e)}, e.status)
+                except asyncio.TimeoutError:
+                    break
+                except Exception as e:
+                    log.exception("Erro ao atender pedido")
+                    resposta = _json({"erro": str(e)}, 500)
+                await self._responder(writer, resposta, manter)
+                if not manter:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def rodar(self, host, porta, pronto=None):
+        servidor = await asyncio.start_server(self.atender, host, porta, limit=MAX_CABECALHO)
+        enderecos = ", ".join(str(s.getsockname()[:2]) for s in servidor.sockets)
+        log.info("Servidor de testes em %s (banco: %s)", enderecos, database.get_db_path())
+        if pronto:
+            pronto(servidor.sockets[0].getsockname()[1])
+        async with servidor:
+            await servidor.serve_forever()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servidor do banco de testes para várias estações.")
+    parser.add_argument("--banco", help="arquivo do banco (padrão: o mesmo do programa)")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--porta", type=int, default=PORTA)
+    parser.add_argument("--trabalhadores", type=int, default=NUM_TRABALHADORES,
+                        help="threads com conexão ao banco")
+    args = parser.parse_args(argv)
+    if args.banco:
+        database.definir_db_path(args.banco)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+    database.criar_tabelas()
+    try:
+        asyncio.run(Servidor(args.trabalhadores).rodar(args.host, args.porta))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
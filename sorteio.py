@@ -0,0 +1,181 @@
+# sorteio.py - escolha das questões de uma sessão
+#
+# Trabalha só com ids (nada de BLOB) e sem percorrer todas as imagens do
+# teste: cada questão é um id sorteado entre o menor e o maior do grupo
+# (OK ou NOK), conferido no índice; ids que não são do grupo são sorteados
+# de novo, o que mantém a escolha uniforme. O custo é proporcional ao
+# número de questões, não ao tamanho do teste.
+import random
+
+from database import conectar
+from medicoes import medido
+
+NUM_QUESTOES = 10  # Padrão quando o teste não define num_questoes
+PESO_DIFICEIS = 2.0  # Imagem que todos erram sai até 1 + PESO_DIFICEIS vezes mais (0 = desliga)
+MIN_RESPOSTAS = 5  # Respostas para a taxa de erro de uma imagem valer por inteiro
+MAX_TENTATIVAS = 50  # Sorteios por questão antes de listar os ids do grupo
+
+
+def configuracao(teste_id):
+    """(num_questoes, proporcao_ok) do teste, com os padrões aplicados."""
+    row = conectar().execute(
+        "SELECT num_questoes, proporcao_ok FROM testes WHERE id=?", (teste_id,)).fetchone()
+    if not row:
+        return NUM_QUESTOES, None
+    return row[0] or NUM_QUESTOES, row[1]
+
+
+def _peso(imagem_id, historico_ate):
+    """
+    1 para imagens sem histórico, até 1 + PESO_DIFICEIS para as que todos
+    erram. Com historico_ate, só contam as sessões finalizadas antes dessa
+    data/hora.
+    """
+    if historico_ate is None:
+        total, erros = conectar().execute(
+            "SELECT COUNT(*), TOTAL(1 - correta) FROM respostas WHERE imagem_id=?",
+            (imagem_id,)).fetchone()
+    else:
+        total, erros = conectar().execute("""
+            SELECT COUNT(*), TOTAL(1 - r.correta)
+            FROM respostas r JOIN sessoes s ON s.id = r.sessao_id
+            WHERE r.imagem_id=? AND s.finalizado_em < ?
+        """, (imagem_id, historico_ate)).fetchone()
+    if not total:
+        return 1.0
+    return 1.0 + PESO_DIFICEIS * min(1.0, total / MIN_RESPOSTAS) * erros / total
+
+
+class _Grupo:
+    """Imagens de um teste com uma resposta (OK ou NOK), com id até ate_imagem."""
+
+    def __init__(self, teste_id, resposta, ate_imagem):
+        self.teste_id = teste_id
+        self.resposta = resposta
+        self.ate_imagem = ate_imagem
+        self.menor, self.maior, self.quantidade = conectar().execute("""
+            SELECT MIN(id), MAX(id), COUNT(*) FROM imagens
+            WHERE teste_id=? AND resposta_correta=? AND id<=?
+        """, (teste_id, resposta, ate_imagem)).fetchone()
+
+    def buscar(self, imagem_id):
+        return conectar().execute("""
+            SELECT id, nome_arquivo, resposta_correta FROM imagens
+            WHERE id=? AND teste_id=? AND resposta_correta=?
+        """, (imagem_id, self.teste_id, self.resposta)).fetchone()
+
+    def todas(self):
+        return conectar().execute("""
+            SELECT id, nome_arquivo, resposta_correta FROM imagens
+            WHERE teste_id=? AND resposta_correta=? AND id<=? ORDER BY id
+        """, (self.teste_id, self.resposta, self.ate_imagem)).fetchall()
+
+    def sortear(self, rng, k, historico_ate, ponderar=True):
+        """k imagens sem repetir (ou cópias iguais de todas, se k > quantidade)."""
+        if k <= 0 or not self.quantidade:
+            return []
+        if k >= self.quantidade:
+            # Menos imagens que questões: todas aparecem o mesmo número de
+            # vezes (mais uma para parte delas)
+            todas = self.todas()
+            copias, resto = divmod(k, len(todas))
+            return todas * copias + rng.sample(todas, resto)
+
+        peso_maximo = 1.0 + PESO_DIFICEIS
+        escolhidas, vistas = [], set()
+        candidatas = None  # lista do grupo, se o sorteio por id falhar demais
+        tentativas = 0
+        while len(escolhidas) < k:
+            tentativas += 1
+            if candidatas is None and tentativas > MAX_TENTATIVAS * k:
+                # ids muito espalhados (teste com poucas imagens no meio de
+                # muitas outras): sorteia da lista do grupo
+                candidatas = self.todas()
+            if candidatas is None:
+                # maior <= ate_imagem: buscar não precisa conferir o limite
+                imagem = self.buscar(rng.randint(self.menor, self.maior))
+            else:
+                imagem = rng.choice(candidatas)
+            if imagem is None or imagem[0] in vistas:
+                continue
+            # Aceita com probabilidade proporcional ao peso (mais difíceis saem mais)
+            if ponderar and PESO_DIFICEIS and \
+                    rng.random() * peso_maximo > _peso(imagem[0], historico_ate):
+                continue
+            vistas.add(imagem[0])
+            escolhidas.append(imagem)
+        return escolhidas
+
+
+@medido("sorteio")
+def sortear_questoes(teste_id, semente=None, quantidade=None, historico_ate=None,
+                     ponderar=True, questoes_ok=None, ate_imagem=None):
+    """
+    Sorteia as questões de uma sessão: [(imagem_id, nome_arquivo, resposta_correta)]
+    e o sorteio, {"semente", "sorteadas", "sorteadas_ok", "ate_imagem"}, que
+    vai para a sessão (colunas de mesmo nome). A proporção de OK segue
+    testes.proporcao_ok (ou a do próprio teste, se NULL), e imagens mais
+    erradas no histórico saem mais. historico_ate ("AAAA-MM-DD HH:MM:SS", o
+    início da sessão) limita o histórico usado nos pesos. Com a mesma
+    semente, o mesmo historico_ate e quantidade, questoes_ok e ate_imagem
+    (o maior id de imagem considerado) do sorteio, ele se repete mesmo
+    depois de o teste ser editado ou ganhar imagens (ver repetir_sorteio).
+    Com ponderar=False todas as imagens têm a mesma chance (réplica sem o
+    histórico do servidor).
+    """
+    if semente is None:
+        semente = random.SystemRandom().randrange(2 ** 31)
+    rng = random.Random(semente)
+    num_questoes, proporcao_ok = configuracao(teste_id)
+    if quantidade is not None:
+        num_questoes = quantidade
+    if ate_imagem is None:
+        ate_imagem = conectar().execute(
+            "SELECT COALESCE(MAX(id), 0) FROM imagens WHERE teste_id=?",
+            (teste_id,)).fetchone()[0]
+    sorteio = {"semente": semente, "sorteadas": 0, "sorteadas_ok": 0,
+               "ate_imagem": ate_imagem}
+
+    ok, nok = _Grupo(teste_id, "OK", ate_imagem), _Grupo(teste_id, "NOK", ate_imagem)
+    if not ok.quantidade and not nok.quantidade:
+        return [], sorteio
+    if questoes_ok is not None:
+        alvo_ok = questoes_ok
+    elif not nok.quantidade:
+        alvo_ok = num_questoes
+    elif not ok.quantidade:
+        alvo_ok = 0
+    elif proporcao_ok is None:
+        alvo_ok = round(num_questoes * ok.quantidade / (ok.quantidade + nok.quantidade))
+    else:
+        alvo_ok = round(num_questoes * proporcao_ok)
+
+    questoes = (ok.sortear(rng, alvo_ok, historico_ate, ponderar)
+                + nok.sortear(rng, num_questoes - alvo_ok, historico_ate, ponderar))
+    rng.shuffle(questoes)
+    sorteio.update(sorteadas=len(questoes),
+                   sorteadas_ok=sum(1 for q in questoes if q[2] == "OK"))
+    return questoes, sorteio
+
+
+def repetir_sorteio(sessao_id):
+    """
+    Refaz o sorteio de uma sessão gravada (auditoria). None se não há semente.
+    Usa a quantidade, o número de OK e o limite de ids gravados com a sessão,
+    não a configuração atual do teste; só imagens excluídas ou com a resposta
+    trocada depois mudam o resultado. Sessões gravadas antes dessas colunas
+    usam o total respondido e a configuração atual.
+    """
+    row = conectar().execute("""
+        SELECT teste_id, semente, total, iniciado_em, ponderado,
+               sorteadas, sorteadas_ok, ate_imagem
+        FROM sessoes WHERE id=?
+    """, (sessao_id,)).fetchone()
+    if not row or row[0] is None or row[1] is None:
+        return None
+    teste_id, semente, total, iniciado_em, ponderado, sorteadas, sorteadas_ok, ate_imagem = row
+    questoes, _ = sortear_questoes(
+        teste_id, semente, total if sorteadas is None else sorteadas,
+        historico_ate=iniciado_em, ponderar=bool(ponderado),
+        questoes_ok=sorteadas_ok, ate_imagem=ate_imagem)
+    return questoes
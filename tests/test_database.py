@@ -0,0 +1,129 @@
+# test_database.py - conteúdos pelo hash: migração dos bancos antigos e
+# contagem de referências
+#
+# Uso: python -m pytest tests
+import os
+import sys
+import sqlite3
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import database  # noqa: E402
+
+
+def _png(cor):
+    saida = BytesIO()
+    Image.new("RGB", (8, 8), cor).save(saida, "PNG")
+    return saida.getvalue()
+
+
+VERMELHA, AZUL, VERDE = _png("red"), _png("blue"), _png("green")
+
+
+@pytest.fixture
+def banco(tmp_path):
+    database.definir_db_path(str(tmp_path / "testes.db"))
+    database.criar_tabelas()
+    with database.transacao() as conn:
+        conn.execute("INSERT INTO testes (nome) VALUES ('Teste 1')")
+    yield 1
+    database.fechar_conexao()
+
+
+def _referencias():
+    return dict(database.conectar().execute("SELECT hash, referencias FROM conteudos"))
+
+
+def test_migracao_move_os_blobs_para_conteudos(tmp_path):
+    # Banco de antes dos conteúdos: os bytes ficam em imagens.imagem
+    caminho = str(tmp_path / "antigo.db")
+    antigo = sqlite3.connect(caminho)
+    antigo.executescript("""
+        CREATE TABLE testes (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                             nome TEXT UNIQUE NOT NULL, descricao TEXT);
+        CREATE TABLE imagens (id INTEGER PRIMARY KEY AUTOINCREMENT,
+                              teste_id INTEGER NOT NULL, nome_arquivo TEXT NOT NULL,
+                              imagem BLOB NOT NULL,
+                              resposta_correta TEXT CHECK(resposta_correta IN ('OK', 'NOK')));
+        INSERT INTO testes (id, nome) VALUES (1, 'Teste 1');
+    """)
+    # ids com buraco e a mesma foto duas vezes
+    antigo.executemany(
+        "INSERT INTO imagens (id, teste_id, nome_arquivo, imagem, resposta_correta) "
+        "VALUES (?, 1, ?, ?, ?)",
+        [(1, "a.png", VERMELHA, "OK"), (2, "b.png", AZUL, "NOK"),
+         (5, "c.png", VERMELHA, "NOK")])
+    antigo.commit()
+    antigo.close()
+
+    database.definir_db_path(caminho)
+    try:
+        database.criar_tabelas()
+        conn = database.conectar()
+        colunas = [c[1] for c in conn.execute("PRAGMA table_info(imagens)")]
+        assert "imagem" not in colunas
+        assert conn.execute(
+            "SELECT id, nome_arquivo, resposta_correta FROM imagens ORDER BY id").fetchall() == [
+            (1, "a.png", "OK"), (2, "b.png", "NOK"), (5, "c.png", "NOK")]
+        assert [database.carregar_imagem(i) for i in (1, 2, 5)] == [VERMELHA, AZUL, VERMELHA]
+        # A foto repetida vira um conteúdo só, com as duas referências
+        assert _referencias() == {database.calcular_hash(VERMELHA): 2,
+                                  database.calcular_hash(AZUL): 1}
+        # Reabrir um banco já migrado não faz nada
+        with database.transacao() as conn:
+            assert database._migrar_imagens_para_conteudos(conn) is False
+        # O AUTOINCREMENT continua depois do maior id antigo
+        database.adicionar_imagens(1, [("d.png", "OK", VERDE)])
+        assert database.conectar().execute("SELECT MAX(id) FROM imagens").fetchone()[0] == 6
+    finally:
+        database.fechar_conexao()
+
+
+def test_referencias_acompanham_as_imagens(banco):
+    vermelha, azul = database.calcular_hash(VERMELHA), database.calcular_hash(AZUL)
+    database.adicionar_imagens(banco, [("a.png", "OK", VERMELHA), ("b.png", "NOK", VERMELHA),
+                                       ("c.png", "OK", AZUL)])
+    assert database.conectar().execute("SELECT COUNT(*) FROM conteudos").fetchone()[0] == 2
+    assert _referencias() == {vermelha: 2, azul: 1}
+
+    # Trocar o conteúdo de uma imagem passa a referência e apaga o que sobrou
+    with database.transacao() as conn:
+        conn.execute("UPDATE imagens SET hash=? WHERE nome_arquivo='c.png'", (vermelha,))
+    assert _referencias() == {vermelha: 3}
+
+    # Alterar outra coluna não mexe na contagem
+    with database.transacao() as conn:
+        conn.execute("UPDATE imagens SET resposta_correta='NOK' WHERE nome_arquivo='a.png'")
+    assert _referencias() == {vermelha: 3}
+
+    with database.transacao() as conn:
+        conn.execute("DELETE FROM imagens WHERE nome_arquivo IN ('a.png', 'b.png')")
+    assert _referencias() == {vermelha: 1}
+
+    # Excluir o teste leva as imagens (cascade) e o último conteúdo junto
+    with database.transacao() as conn:
+        conn.execute("DELETE FROM testes WHERE id=?", (banco,))
+    assert _referencias() == {}
+
+
+def test_extrair_imagem_temp_segue_o_conteudo(banco):
+    database.adicionar_imagens(banco, [("a.png", "OK", VERMELHA)])
+    caminho = database.extrair_imagem_temp(1)
+    assert database.extrair_imagem_temp(1) == caminho
+    with open(caminho, "rb") as f:
+        assert f.read() == VERMELHA
+
+    # Conteúdo substituído: outro arquivo, com os bytes novos
+    database.adicionar_imagens(banco, [("b.png", "OK", AZUL)])
+    with database.transacao() as conn:
+        conn.execute("UPDATE imagens SET hash=? WHERE id=1", (database.calcular_hash(AZUL),))
+    novo = database.extrair_imagem_temp(1)
+    assert novo != caminho
+    with open(novo, "rb") as f:
+        assert f.read() == AZUL
+    assert database.extrair_imagem_temp(99) is None
@@ -0,0 +1,122 @@
+# test_relatorios.py - formato dos CSV dos relatórios
+#
+# O CSV por sessão era gravado com pandas (DataFrame.to_csv, sep=';',
+# utf-8-sig); o csv.writer tem que sair igual, byte a byte.
+# Uso: python -m pytest tests
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import database  # noqa: E402
+import relatorios  # noqa: E402
+from relatorios import gravar_csv, exportar_respostas, COLUNAS_EXPORTACAO  # noqa: E402
+
+# Nomes que precisam de aspas (separador, aspas, quebra de linha) e acentos
+RESPOSTAS = [
+    (1, "peça 1.png", "OK", "OK"),
+    (2, "a;b.png", "NOK", "OK"),
+    (3, 'foto "2".png', "OK", "NOK"),
+    (4, "linha\nquebrada.png", "NOK", "NOK"),
+    (5, " espaço .png", "OK", "OK"),
+]
+FIM = os.linesep
+
+
+@pytest.fixture
+def banco(tmp_path):
+    database.definir_db_path(str(tmp_path / "testes.db"))
+    database.criar_tabelas()
+    with database.transacao() as conn:
+        conn.execute("INSERT INTO testes (nome) VALUES ('Teste; 1')")
+    yield 1
+    database.fechar_conexao()
+
+
+def _bytes(caminho):
+    with open(caminho, "rb") as f:
+        return f.read()
+
+
+def test_csv_da_sessao_igual_ao_do_pandas(tmp_path):
+    pd = pytest.importorskip("pandas")
+    for avaliador in ("José da Silva", None):
+        respostas = RESPOSTAS if avaliador else []
+        esperado = tmp_path / "pandas.csv"
+        pd.DataFrame({
+            "Avaliador": [avaliador] * len(respostas),
+            "Imagem": [r[1] for r in respostas],
+            "Resposta Usuario": [r[2] for r in respostas],
+            "Resposta Correta": [r[3] for r in respostas],
+        }).to_csv(esperado, index=False, sep=';', encoding='utf-8-sig')
+        gravado = tmp_path / "csv.csv"
+        gravar_csv(str(gravado), avaliador, respostas)
+        assert _bytes(gravado) == _bytes(esperado)
+
+
+def test_csv_da_sessao_bytes(tmp_path):
+    # O mesmo, sem depender do pandas
+    esperado = ("\ufeffAvaliador;Imagem;Resposta Usuario;Resposta Correta" + FIM
+                + "Ana;peça 1.png;OK;OK" + FIM
+                + 'Ana;"a;b.png";NOK;OK' + FIM
+                + 'Ana;"foto ""2"".png";OK;NOK' + FIM
+                + 'Ana;"linha\nquebrada.png";NOK;NOK' + FIM
+                + "Ana; espaço .png;OK;OK" + FIM).encode("utf-8")
+    caminho = tmp_path / "sessao.csv"
+    gravar_csv(str(caminho), "Ana", RESPOSTAS)
+    assert _bytes(caminho) == esperado
+
+
+def _registrar(teste_id, operador, respostas):
+    return database.registrar_sessao(
+        {"teste_id": teste_id, "avaliador": "Ana", "operador": operador, "matricula": "12",
+         "turno": "B", "iniciado_em": "2026-03-04 10:00:00",
+         "finalizado_em": "2026-03-04 10:05:00", "acertos": 0, "total": len(respostas)},
+        [(imagem_id, nome, resposta, correta, 250 + imagem_id)
+         for imagem_id, nome, resposta, correta in respostas])
+
+
+def test_arquivo_diario_acrescenta_sem_repetir_cabecalho(banco, tmp_path):
+    primeira = _registrar(banco, "João", RESPOSTAS[:2])
+    segunda = _registrar(banco, "Maria", RESPOSTAS[2:3])
+    arquivo = str(tmp_path / "resultados_2026-03-04.csv")
+
+    assert exportar_respostas(arquivo, "s.id = ?", (primeira,), anexar=True) == (1, 2)
+    assert exportar_respostas(arquivo, "s.id = ?", (segunda,), anexar=True) == (1, 1)
+    esperado = ("\ufeff" + ";".join(COLUNAS_EXPORTACAO) + FIM
+                + f"{primeira};Teste; 1;Ana;João;12;B;2026-03-04 10:05:00;1;peça 1.png;OK;OK;1;251"
+                + FIM
+                + f'{primeira};Teste; 1;Ana;João;12;B;2026-03-04 10:05:00;2;"a;b.png";NOK;OK;0;252'
+                + FIM
+                + f'{segunda};Teste; 1;Ana;Maria;12;B;2026-03-04 10:05:00;1;"foto ""2"".png";'
+                + "OK;NOK;0;253" + FIM)
+    # O nome do teste também vai entre aspas: tem ';'
+    esperado = esperado.replace(";Teste; 1;", ';"Teste; 1";')
+    assert _bytes(arquivo) == esperado.encode("utf-8")
+
+    # A exportação completa de uma vez sai igual ao arquivo montado aos poucos
+    completo = str(tmp_path / "completo.csv")
+    assert exportar_respostas(completo) == (2, 3)
+    assert _bytes(completo) == _bytes(arquivo)
+
+
+def test_arquivo_diario_nao_duplica_sessao(banco, tmp_path):
+    sessao = _registrar(banco, "João", RESPOSTAS[:2])
+    outra = _registrar(banco, "Maria", RESPOSTAS[2:3])
+    arquivo = str(tmp_path / "resultados_2026-03-04.csv")
+
+    for sessao_id in (sessao, sessao, outra, sessao):
+        if not relatorios._sessao_no_csv(arquivo, sessao_id):
+            relatorios._anexar_sessao_csv(arquivo, sessao_id)
+    assert _bytes(arquivo).count(os.linesep.encode()) == 1 + 3
+
+    # Arquivo apagado por fora: a sessão volta a ser gravada
+    os.remove(arquivo)
+    assert not relatorios._sessao_no_csv(arquivo, sessao)
+    # Arquivo escrito por fora (outro processo): lido de novo
+    exportar_respostas(arquivo, "s.id = ?", (outra,), anexar=True)
+    assert relatorios._sessao_no_csv(arquivo, outra)
+    assert not relatorios._sessao_no_csv(arquivo, sessao)
@@ -0,0 +1,189 @@
+# test_replica.py - sincronização das réplicas pelo database.alteracoes_desde
+#
+# O "servidor" é outro banco, aberto numa thread própria (a conexão do
+# database é por thread); o cliente faz o papel do BackendRemoto, com a
+# mesma ida e volta por JSON.
+# Uso: python -m pytest tests
+import os
+import sys
+import json
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from PIL import Image
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import database  # noqa: E402
+import replica  # noqa: E402
+from backend import ErroServidor  # noqa: E402
+
+
+def _png(cor):
+    saida = BytesIO()
+    Image.new("RGB", (8, 8), cor).save(saida, "PNG")
+    return saida.getvalue()
+
+
+class ClienteFalso:
+    """Responde como o servidor.py, a partir do banco aberto em `self.rodar`."""
+
+    url = "http://servidor-falso"
+
+    def __init__(self, caminho):
+        self._thread = ThreadPoolExecutor(max_workers=1)
+        database.definir_db_path(caminho)
+        self.rodar(database.criar_tabelas)
+        self.pedidos = []
+
+    def rodar(self, funcao, *args):
+        return self._thread.submit(funcao, *args).result()
+
+    def executar(self, sql, params=()):
+        def _executar():
+            with database.transacao() as conn:
+                return conn.execute(sql, params).lastrowid
+        return self.rodar(_executar)
+
+    def sincronizar(self, desde, limite=500):
+        self.pedidos.append(desde)
+        return json.loads(json.dumps(self.rodar(database.alteracoes_desde, desde, limite)))
+
+    def baixar_conteudo(self, hash_conteudo, destino):
+        destino.write(self.rodar(lambda: database.conectar().execute(
+            "SELECT dados FROM conteudos WHERE hash=?", (hash_conteudo,)).fetchone()[0]))
+
+    def registrar_sessoes(self, lote):
+        raise NotImplementedError
+
+    def encerrar(self):
+        self.rodar(database.fechar_conexao)
+        self._thread.shutdown()
+
+
+@pytest.fixture
+def servidor_e_replica(tmp_path):
+    cliente = ClienteFalso(str(tmp_path / "servidor.db"))
+    cliente.executar("INSERT INTO testes (nome) VALUES ('Teste 1')")
+    cliente.rodar(database.adicionar_imagens, 1, [
+        (f"{cor}.png", "OK" if i % 2 else "NOK", _png(cor))
+        for i, cor in enumerate(["red", "green", "blue", "white", "black"])])
+    database.definir_db_path(str(tmp_path / "replica.db"))
+    database.criar_tabelas()
+    yield cliente
+    database.fechar_conexao()
+    cliente.encerrar()
+
+
+def _imagens():
+    return database.conectar().execute(
+        "SELECT id, teste_id, nome_arquivo, hash, resposta_correta FROM imagens ORDER BY id"
+    ).fetchall()
+
+
+def _imagens_servidor(cliente):
+    return cliente.rodar(_imagens)
+
+
+def test_alteracoes_desde_pagina_pela_versao(servidor_e_replica):
+    cliente = servidor_e_replica
+    tudo = cliente.rodar(database.alteracoes_desde, -1, 500)
+    assert not tudo["mais"]
+    assert [t[1] for t in tudo["testes"]] == ["Teste 1"]
+    assert [i[1] for i in tudo["imagens"]] == [1, 2, 3, 4, 5]
+
+    # Páginas de 2: cada uma continua da versão em que a anterior parou
+    versao, vistas = -1, []
+    while True:
+        pagina = cliente.rodar(database.alteracoes_desde, versao, 2)
+        assert len(pagina["imagens"]) + len(pagina["imagens_excluidas"]) <= 2
+        vistas += [i[1] for i in pagina["imagens"]]
+        versao = pagina["versao"]
+        if not pagina["mais"]:
+            break
+    assert vistas == [1, 2, 3, 4, 5]
+    assert versao == tudo["versao"]
+
+    # Nada depois da última versão; uma alteração e uma exclusão depois dela
+    vazio = cliente.rodar(database.alteracoes_desde, versao, 500)
+    assert (vazio["imagens"], vazio["imagens_excluidas"], vazio["testes"]) == ([], [], [])
+    cliente.executar("UPDATE imagens SET resposta_correta='OK' WHERE id=2")
+    cliente.executar("DELETE FROM imagens WHERE id=4")
+    depois = cliente.rodar(database.alteracoes_desde, versao, 500)
+    assert [i[1] for i in depois["imagens"]] == [2]
+    assert [e[1] for e in depois["imagens_excluidas"]] == [4]
+    assert depois["versao"] == versao + 2
+
+
+def test_replica_fica_igual_ao_servidor(servidor_e_replica):
+    cliente = servidor_e_replica
+    assert replica.sincronizar(cliente, limite=2) == 6  # 5 imagens e o teste
+    assert _imagens() == _imagens_servidor(cliente)
+    assert all(database.carregar_imagem(i) == cliente.rodar(database.carregar_imagem, i)
+               for i in range(1, 6))
+
+    # Em dia: um pedido só, desde a versão guardada, e nada aplicado
+    cliente.pedidos.clear()
+    assert replica.sincronizar(cliente) == 0
+    assert len(cliente.pedidos) == 1
+
+
+def test_exclusoes_e_trocas_chegam_a_replica(servidor_e_replica):
+    cliente = servidor_e_replica
+    replica.sincronizar(cliente)
+
+    # A imagem 1 passa a usar o conteúdo da 3, a 2 e a 3 saem, entra uma nova
+    hash_3 = cliente.rodar(database.obter_hash, 3)
+    cliente.executar("UPDATE imagens SET hash=? WHERE id=1", (hash_3,))
+    cliente.executar("DELETE FROM imagens WHERE id IN (2, 3)")
+    cliente.rodar(database.adicionar_imagens, 1, [("nova.png", "OK", _png("yellow"))])
+    replica.sincronizar(cliente, limite=1)
+
+    assert _imagens() == _imagens_servidor(cliente)
+    assert [i[0] for i in _imagens()] == [1, 4, 5, 6]
+    # Os conteúdos que ficaram sem imagem saem da réplica também
+    conteudos = dict(database.conectar().execute("SELECT hash, referencias FROM conteudos"))
+    assert conteudos == {h: 1 for _, _, _, h, _ in _imagens()}
+
+    # Teste excluído no servidor: some da réplica com as imagens
+    cliente.executar("DELETE FROM testes WHERE id=1")
+    replica.sincronizar(cliente)
+    assert _imagens() == []
+    assert database.conectar().execute("SELECT COUNT(*) FROM testes").fetchone()[0] == 0
+    assert database.conectar().execute("SELECT COUNT(*) FROM conteudos").fetchone()[0] == 0
+
+
+def test_sessao_recusada_sai_da_fila(servidor_e_replica, monkeypatch):
+    class Recusa(ClienteFalso):
+        def __init__(self):
+            self.lotes = []
+
+        def registrar_sessoes(self, lote):
+            self.lotes.append(len(lote))
+            if any(sessao.get("invalida") for sessao, _ in lote):
+                raise ErroServidor("HTTP 400", 400)
+            if any(sessao.get("instavel") for sessao, _ in lote):
+                raise ErroServidor("HTTP 500", 500)
+            return list(range(len(lote)))
+
+    monkeypatch.setattr(replica, "MAX_TENTATIVAS_ENVIO", 2)
+    for sessao in ({"invalida": 1}, {}, {"instavel": 1}):
+        replica.enfileirar_sessao(sessao, [])
+    cliente = Recusa()
+
+    assert replica.enviar_pendentes(cliente) == 1
+    assert [r[0] for r in replica.listar_recusadas()] == [1]  # 4xx: na primeira vez
+    assert replica.contar_pendentes() == 1
+    assert replica.enviar_pendentes(cliente) == 0
+    assert [r[0] for r in replica.listar_recusadas()] == [1, 3]
+    assert replica.contar_pendentes() == 0
+
+    # Parada, não é mais enviada
+    cliente.lotes.clear()
+    assert replica.enviar_pendentes(cliente) == 0
+    assert cliente.lotes == []
+
+    assert replica.reenviar_recusadas([3]) == 1
+    assert replica.contar_pendentes() == 1
@@ -0,0 +1,113 @@
+# test_semelhanca.py - fotos repetidas com as fotos de imagens/Teste 1
+#
+# As 10 fotos são da mesma peça (5 OK e 5 NOK) e mudam só numa região
+# pequena: nenhuma pode ser apontada como repetida de outra. A mesma foto
+# recomprimida ou redimensionada tem que ser.
+# Uso: python -m pytest tests
+import os
+import sys
+import glob
+import itertools
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import database  # noqa: E402
+import importacao  # noqa: E402
+from semelhanca import (calcular_assinatura, distancia, mesma_foto,  # noqa: E402
+                        imagens_semelhantes, relatorio_duplicatas, IndiceSemelhanca,
+                        DISTANCIA_MAXIMA)
+
+FOTOS = sorted(glob.glob(os.path.join(RAIZ, "imagens", "Teste 1", "*.png")),
+               key=lambda caminho: int(os.path.basename(caminho)[:-4]))
+RESPOSTAS = {nome: ("OK" if int(nome[:-4]) <= 5 else "NOK")
+             for nome in map(os.path.basename, FOTOS)}
+
+
+def _jpeg(caminho, qualidade, tamanho=None):
+    with Image.open(caminho) as imagem:
+        imagem = imagem.convert("RGB")
+        if tamanho:
+            imagem = imagem.resize(tamanho, Image.LANCZOS)
+        saida = BytesIO()
+        imagem.save(saida, "JPEG", quality=qualidade)
+    return saida.getvalue()
+
+
+@pytest.fixture
+def banco(tmp_path):
+    database.definir_db_path(str(tmp_path / "testes.db"))
+    database.criar_tabelas()
+    with database.transacao() as conn:
+        conn.execute("INSERT INTO testes (nome) VALUES ('Teste 1')")
+    yield 1
+    database.fechar_conexao()
+
+
+def _itens(caminhos, nomes=None):
+    return [(nome, RESPOSTAS.get(nome, "OK"), lambda c=caminho: importacao._ler_arquivo(c))
+            for caminho, nome in zip(caminhos, nomes or map(os.path.basename, caminhos))]
+
+
+def test_fotos_diferentes_da_peca_nao_sao_a_mesma():
+    assinaturas = [calcular_assinatura(caminho) for caminho in FOTOS]
+    for a, b in itertools.combinations(assinaturas, 2):
+        # O dhash sozinho não separa: a confirmação pela miniatura tem que separar
+        if distancia(a[0], b[0]) <= DISTANCIA_MAXIMA:
+            assert not mesma_foto(a[6], b[6])
+
+
+@pytest.mark.parametrize("qualidade,tamanho", [(85, None), (40, None), (85, (540, 540)),
+                                               (60, (300, 300)), (85, (1600, 1600))])
+def test_mesma_foto_recomprimida(qualidade, tamanho):
+    for caminho in FOTOS:
+        original = calcular_assinatura(caminho)
+        copia = calcular_assinatura(_jpeg(caminho, qualidade, tamanho))
+        assert distancia(original[0], copia[0]) <= DISTANCIA_MAXIMA
+        assert mesma_foto(original[6], copia[6])
+
+
+def test_importacao_da_pasta_sem_avisos(banco):
+    r = importacao.importar_lote(banco, _itens(FOTOS))
+    assert r["importadas"] == len(FOTOS)
+    assert r["semelhantes"] == []
+    assert relatorio_duplicatas() == []
+    for caminho in FOTOS:
+        parecidas = imagens_semelhantes(calcular_assinatura(caminho))
+        assert [nome for _, _, nome, _, _ in parecidas] == [os.path.basename(caminho)]
+
+
+def test_copia_avisada_uma_vez_entre_lotes(banco):
+    # A cópia vem num lote depois da original: a original já está no banco
+    # e no índice local, mas o aviso sai uma vez só
+    itens = _itens(FOTOS) + [("copia_1.jpg", "NOK", lambda: _jpeg(FOTOS[0], 60, (540, 540)))]
+    r = importacao.importar_lote(banco, itens, tamanho_lote=3)
+    assert r["importadas"] == len(FOTOS) + 1
+    assert [(nome, parecida) for nome, parecida, _, _, _ in r["semelhantes"]] == [
+        ("copia_1.jpg", "1.png")]
+    grupos = relatorio_duplicatas()
+    assert len(grupos) == 1 and grupos[0]["conflito"]
+    assert sorted(img[2] for img in grupos[0]["imagens"]) == ["1.png", "copia_1.jpg"]
+
+
+@pytest.mark.parametrize("diferenca", [None, 100])
+def test_indice_confere_como_mesma_foto(diferenca):
+    # O índice compara as miniaturas em lote (numpy): tem que dar o mesmo
+    # que mesma_foto par a par, também com outro limite
+    assinaturas = {os.path.basename(c): calcular_assinatura(c) for c in FOTOS}
+    assinaturas.update({f"copia_{nome}": calcular_assinatura(_jpeg(c, 50, (400, 400)))
+                        for nome, c in zip(assinaturas, FOTOS)})
+    indice = IndiceSemelhanca()
+    for chave, assinatura in assinaturas.items():
+        esperadas = {outra for outra in indice._linhas
+                     if distancia(assinatura[0], assinaturas[outra][0]) <= DISTANCIA_MAXIMA
+                     and distancia(assinatura[1], assinaturas[outra][1]) <= DISTANCIA_MAXIMA
+                     and mesma_foto(assinatura[6], assinaturas[outra][6], diferenca)}
+        assert {outra for outra, _ in indice.procurar(assinatura, diferenca=diferenca)} == esperadas
+        indice.adicionar(chave, assinatura)
+    if diferenca is None:
+        assert dict(indice.procurar(assinaturas["copia_3.png"])).keys() == {"3.png", "copia_3.png"}
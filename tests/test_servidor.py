@@ -0,0 +1,171 @@
+# test_servidor.py - ETag (304) e Range (206) das imagens no servidor.py
+#
+# Cada teste sobe o servidor numa porta livre, numa thread, com um banco
+# próprio, e conversa com ele por http.client (keep-alive, como o backend).
+# Uso: python -m pytest tests
+import os
+import sys
+import asyncio
+import threading
+import http.client
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import database  # noqa: E402
+from servidor import Servidor  # noqa: E402
+
+
+def _png(cor, lado=64):
+    saida = BytesIO()
+    Image.new("RGB", (lado, lado), cor).save(saida, "PNG")
+    return saida.getvalue()
+
+
+FOTO = _png("red")
+OUTRA = _png("blue")
+
+
+@pytest.fixture
+def servidor(tmp_path, monkeypatch):
+    # Pedaços pequenos: as respostas saem em vários, como as fotos grandes
+    monkeypatch.setattr(database, "TAMANHO_PEDACO", 7)
+    database.definir_db_path(str(tmp_path / "testes.db"))
+    database.criar_tabelas()
+    with database.transacao() as conn:
+        conn.execute("INSERT INTO testes (nome) VALUES ('Teste 1')")
+    database.adicionar_imagens(1, [("a.png", "OK", FOTO)])
+
+    app = Servidor(trabalhadores=2)
+    porta, rodando = [], {}
+    pronto = threading.Event()
+
+    async def principal():
+        rodando["loop"], rodando["tarefa"] = asyncio.get_running_loop(), asyncio.current_task()
+        await app.rodar("127.0.0.1", 0, lambda p: (porta.append(p), pronto.set()))
+
+    def rodar():
+        try:
+            asyncio.run(principal())  # fecha as conexões que sobrarem
+        except asyncio.CancelledError:
+            pass  # o fim do teste cancela o serve_forever
+
+    thread = threading.Thread(target=rodar, daemon=True)
+    thread.start()
+    assert pronto.wait(10)
+    conexao = http.client.HTTPConnection("127.0.0.1", porta[0], timeout=10)
+    yield conexao
+    conexao.close()
+    rodando["loop"].call_soon_threadsafe(rodando["tarefa"].cancel)
+    thread.join(10)
+    app.executor.shutdown()
+    database.fechar_conexao()
+
+
+def _get(conexao, caminho, **cabecalhos):
+    conexao.request("GET", caminho, headers=cabecalhos)
+    resposta = conexao.getresponse()
+    return resposta.status, dict(resposta.getheaders()), resposta.read()
+
+
+def test_imagem_inteira_com_etag(servidor):
+    status, cabecalhos, corpo = _get(servidor, "/imagens/1")
+    assert status == 200
+    assert corpo == FOTO
+    assert cabecalhos["ETag"] == f'"{database.calcular_hash(FOTO)}"'
+    assert cabecalhos["Content-Type"] == "image/png"
+    assert cabecalhos["Content-Length"] == str(len(FOTO))
+    assert cabecalhos["Accept-Ranges"] == "bytes"
+    assert "max-age" in cabecalhos["Cache-Control"]
+
+
+def test_if_none_match(servidor):
+    etag = _get(servidor, "/imagens/1")[1]["ETag"]
+    status, cabecalhos, corpo = _get(servidor, "/imagens/1", **{"If-None-Match": etag})
+    assert (status, corpo) == (304, b"")
+    assert cabecalhos["ETag"] == etag
+    assert "Content-Type" not in cabecalhos
+    # ETag de outra versão: vem a imagem inteira (e a conexão continua boa)
+    status, _, corpo = _get(servidor, "/imagens/1", **{"If-None-Match": '"outro"'})
+    assert (status, corpo) == (200, FOTO)
+
+
+def test_etag_muda_com_o_conteudo(servidor):
+    etag = _get(servidor, "/imagens/1")[1]["ETag"]
+    database.adicionar_imagens(1, [("b.png", "OK", OUTRA)])
+    with database.transacao() as conn:
+        conn.execute("UPDATE imagens SET hash=? WHERE id=1", (database.calcular_hash(OUTRA),))
+    status, cabecalhos, corpo = _get(servidor, "/imagens/1", **{"If-None-Match": etag})
+    assert (status, corpo) == (200, OUTRA)
+    assert cabecalhos["ETag"] == f'"{database.calcular_hash(OUTRA)}"'
+
+
+@pytest.mark.parametrize("faixa, inicio, fim", [
+    ("bytes=0-0", 0, 0),
+    ("bytes=10-29", 10, 29),   # atravessa vários pedaços
+    ("bytes=20-", 20, None),
+    ("bytes=-15", -15, None),
+    ("bytes=5-100000", 5, None),  # fim além do tamanho: até o último byte
+])
+def test_range(servidor, faixa, inicio, fim):
+    status, cabecalhos, corpo = _get(servidor, "/imagens/1", Range=faixa)
+    esperado = FOTO[inicio:None if fim is None else fim + 1]
+    assert status == 206
+    assert corpo == esperado
+    primeiro = inicio % len(FOTO)
+    assert cabecalhos["Content-Range"] == \
+        f"bytes {primeiro}-{primeiro + len(esperado) - 1}/{len(FOTO)}"
+    assert cabecalhos["Content-Length"] == str(len(esperado))
+    assert cabecalhos["ETag"] == f'"{database.calcular_hash(FOTO)}"'
+
+
+@pytest.mark.parametrize("faixa", ["bytes=a-b", "items=0-5", "bytes=0-1,4-5"])
+def test_range_que_nao_da_para_atender_vem_inteiro(servidor, faixa):
+    status, cabecalhos, corpo = _get(servidor, "/imagens/1", Range=faixa)
+    assert (status, corpo) == (200, FOTO)
+    assert "Content-Range" not in cabecalhos
+
+
+def test_range_fora_da_imagem(servidor):
+    status, _, _ = _get(servidor, "/imagens/1", Range=f"bytes={len(FOTO) + 5}-")
+    assert status == 416
+    # If-None-Match vale antes do Range
+    etag = f'"{database.calcular_hash(FOTO)}"'
+    status, _, corpo = _get(servidor, "/imagens/1", Range="bytes=0-9", **{"If-None-Match": etag})
+    assert (status, corpo) == (304, b"")
+
+
+def test_imagem_inexistente(servidor):
+    assert _get(servidor, "/imagens/99")[0] == 404
+    assert _get(servidor, "/imagens/99/miniatura")[0] == 404
+
+
+def test_miniatura_com_etag(servidor):
+    status, cabecalhos, corpo = _get(servidor, "/imagens/1/miniatura?largura=20&altura=10")
+    assert status == 200
+    assert cabecalhos["Content-Type"] == "image/png"
+    with Image.open(BytesIO(corpo)) as imagem:
+        assert max(imagem.size) <= 20
+    etag = cabecalhos["ETag"]
+    assert database.calcular_hash(FOTO) in etag
+    assert _get(servidor, "/imagens/1/miniatura?largura=20&altura=10",
+                **{"If-None-Match": etag})[:3:2] == (304, b"")
+    # Outro tamanho ou formato é outra miniatura
+    status, cabecalhos, _ = _get(servidor, "/imagens/1/miniatura?largura=20&altura=10&formato=JPEG",
+                                 **{"If-None-Match": etag})
+    assert status == 200 and cabecalhos["ETag"] != etag
+    assert _get(servidor, "/imagens/1/miniatura?largura=0")[0] == 400
+
+
+def test_conteudo_pelo_hash(servidor):
+    hash_foto = database.calcular_hash(FOTO)
+    status, cabecalhos, corpo = _get(servidor, f"/conteudos/{hash_foto}")
+    assert (status, corpo) == (200, FOTO)
+    assert "immutable" in cabecalhos["Cache-Control"]
+    assert _get(servidor, f"/conteudos/{hash_foto}",
+                **{"If-None-Match": f'"{hash_foto}"'})[:3:2] == (304, b"")
+    assert _get(servidor, "/conteudos/naoexiste")[0] == 404
@@ -0,0 +1,161 @@
+# test_sorteio.py - proporção de OK/NOK do sorteio e repetição pela semente
+#
+# Uso: python -m pytest tests
+import os
+import sys
+from collections import Counter
+from io import BytesIO
+
+import pytest
+from PIL import Image
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+import database  # noqa: E402
+import sorteio  # noqa: E402
+from sorteio import sortear_questoes, repetir_sorteio  # noqa: E402
+
+INICIO = "2026-01-01 08:00:00"
+
+
+def _png():
+    saida = BytesIO()
+    Image.new("RGB", (8, 8), "gray").save(saida, "PNG")
+    return saida.getvalue()
+
+
+def _adicionar(teste_id, quantidade, resposta, prefixo=None):
+    dados = _png()  # o conteúdo é o mesmo: o sorteio só olha os ids
+    database.adicionar_imagens(teste_id, [
+        (f"{prefixo or resposta}_{i}.png", resposta, dados) for i in range(quantidade)])
+
+
+@pytest.fixture
+def banco(tmp_path):
+    database.definir_db_path(str(tmp_path / "testes.db"))
+    database.criar_tabelas()
+    with database.transacao() as conn:
+        conn.execute("INSERT INTO testes (nome, num_questoes) VALUES ('Teste 1', 10)")
+        conn.execute("INSERT INTO testes (nome) VALUES ('Outro')")
+    # Imagens de outro teste entre as deste: ids do grupo espalhados
+    _adicionar(1, 30, "OK")
+    _adicionar(2, 50, "OK", "outro")
+    _adicionar(1, 10, "NOK")
+    yield 1
+    database.fechar_conexao()
+
+
+def _proporcao(teste_id, proporcao_ok):
+    with database.transacao() as conn:
+        conn.execute("UPDATE testes SET proporcao_ok=? WHERE id=?", (proporcao_ok, teste_id))
+
+
+def _sessao(teste_id, questoes, sorteio_feito, finalizado_em="2026-01-01 08:05:00",
+            resposta="OK"):
+    return database.registrar_sessao(dict(
+        sorteio_feito, teste_id=teste_id, avaliador="a", operador="o", matricula="1",
+        turno="A", iniciado_em=INICIO, finalizado_em=finalizado_em, acertos=0,
+        total=len(questoes)),
+        [(i, nome, resposta, correta, 100) for i, nome, correta in questoes])
+
+
+@pytest.mark.parametrize("proporcao_ok, ok_esperadas", [(None, 8), (0.5, 5), (0.2, 2),
+                                                       (1.0, 10), (0.0, 0)])
+def test_proporcao_de_ok(banco, proporcao_ok, ok_esperadas):
+    _proporcao(banco, proporcao_ok)  # None: a do próprio teste, 30 de 40
+    for semente in range(20):
+        questoes, feito = sortear_questoes(banco, semente, historico_ate=INICIO)
+        assert len(questoes) == 10
+        assert len({q[0] for q in questoes}) == 10  # sem repetir imagem
+        assert Counter(q[2] for q in questoes)["OK"] == ok_esperadas
+        assert feito == {"semente": semente, "sorteadas": 10, "sorteadas_ok": ok_esperadas,
+                         "ate_imagem": 90}
+        nomes = {q[1] for q in questoes}
+        assert not any(nome.startswith("outro") for nome in nomes)
+
+
+def test_menos_imagens_que_questoes(banco):
+    _proporcao(banco, 0.0)
+    questoes, _ = sortear_questoes(banco, 3, quantidade=25, historico_ate=INICIO)
+    # 25 questões com 10 NOK: todas aparecem 2 ou 3 vezes
+    assert sorted(Counter(q[0] for q in questoes).values()) == [2] * 5 + [3] * 5
+
+
+def test_sorteio_uniforme_sem_historico(banco):
+    vezes = Counter()
+    for semente in range(400):
+        questoes, _ = sortear_questoes(banco, semente, historico_ate=INICIO)
+        vezes.update(q[0] for q in questoes if q[2] == "OK")
+    # 400 sorteios de 8 entre 30: cada uma sai ~107 vezes
+    assert len(vezes) == 30
+    assert min(vezes.values()) > 60 and max(vezes.values()) < 160
+
+
+def test_mesma_semente_mesmo_sorteio(banco):
+    a, _ = sortear_questoes(banco, 42, historico_ate=INICIO)
+    b, _ = sortear_questoes(banco, 42, historico_ate=INICIO)
+    c, _ = sortear_questoes(banco, 43, historico_ate=INICIO)
+    assert a == b
+    assert a != c
+    # Sem semente, uma nova a cada sessão
+    assert sortear_questoes(banco)[1]["semente"] != sortear_questoes(banco)[1]["semente"]
+
+
+def test_repetir_sorteio_depois_de_editar_o_teste(banco):
+    questoes, feito = sortear_questoes(banco, 7, historico_ate=INICIO)
+    sessao_id = _sessao(banco, questoes, feito)
+    assert repetir_sorteio(sessao_id) == questoes
+
+    # Teste editado e com imagens novas: a sessão repete o que foi sorteado
+    with database.transacao() as conn:
+        conn.execute("UPDATE testes SET num_questoes=4, proporcao_ok=0.25 WHERE id=?", (banco,))
+    _adicionar(banco, 20, "NOK", "nova")
+    assert repetir_sorteio(sessao_id) == questoes
+    # Uma sessão nova já segue a configuração nova
+    novas, feito_novo = sortear_questoes(banco, 7, historico_ate=INICIO)
+    assert (feito_novo["sorteadas"], feito_novo["sorteadas_ok"]) == (4, 1)
+    assert feito_novo["ate_imagem"] == 110
+
+
+def test_repetir_sorteio_ignora_o_historico_posterior(banco):
+    questoes, feito = sortear_questoes(banco, 11, historico_ate=INICIO)
+    sessao_id = _sessao(banco, questoes, feito)
+    # Muitas sessões depois do início, errando tudo: mudariam os pesos
+    for semente in range(10):
+        outras, outro = sortear_questoes(banco, 100 + semente)
+        _sessao(banco, outras, outro, finalizado_em="2026-01-02 08:00:00", resposta="NOK")
+    assert repetir_sorteio(sessao_id) == questoes
+
+
+def test_repetir_sorteio_de_sessao_antiga(banco):
+    # Sessões gravadas antes dos parâmetros do sorteio: total e configuração atual
+    questoes, feito = sortear_questoes(banco, 5, historico_ate=INICIO)
+    sessao_id = _sessao(banco, questoes, {"semente": feito["semente"]})
+    assert repetir_sorteio(sessao_id) == questoes
+    assert repetir_sorteio(9999) is None
+    sem_semente = _sessao(banco, questoes, {})
+    assert repetir_sorteio(sem_semente) is None
+
+
+def test_peso_das_dificeis(banco, monkeypatch):
+    # Metade das OK sempre errada no histórico: saem mais que as outras
+    dificeis = {i for (i,) in database.conectar().execute(
+        "SELECT id FROM imagens WHERE teste_id=? AND resposta_correta='OK' ORDER BY id LIMIT 15",
+        (banco,))}
+    database.registrar_sessao(
+        {"teste_id": banco, "avaliador": "a", "operador": "o", "matricula": "1",
+         "turno": "A", "iniciado_em": INICIO, "finalizado_em": INICIO, "acertos": 0,
+         "total": 15 * sorteio.MIN_RESPOSTAS},
+        [(i, f"{i}.png", "NOK", "OK", 100) for i in dificeis] * sorteio.MIN_RESPOSTAS)
+    vezes = Counter()
+    for semente in range(300):
+        questoes, _ = sortear_questoes(banco, semente)
+        vezes.update("dificil" if q[0] in dificeis else "facil" for q in questoes if q[2] == "OK")
+    assert vezes["dificil"] > 1.5 * vezes["facil"]
+    # Sem ponderar (réplica), as duas metades saem por igual
+    vezes.clear()
+    for semente in range(300):
+        questoes, _ = sortear_questoes(banco, semente, ponderar=False)
+        vezes.update("dificil" if q[0] in dificeis else "facil" for q in questoes if q[2] == "OK")
+    assert 0.75 < vezes["dificil"] / vezes["facil"] < 1.33